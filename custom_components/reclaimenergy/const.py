@@ -38,3 +38,11 @@ AWS_IDENTITY_POOL = "ap-southeast-2:e04c5d62-0c40-4eac-a343-27d5f76c4920"
 AWS_HOSTNAME = "a254daig9zo2wn-ats.iot.ap-southeast-2.amazonaws.com"
 AWS_PORT = 8883
 
+# seconds to wait for the controller to answer a read request
+REQUEST_TIMEOUT = 10
+
+# seconds before the first reconnect attempt; doubles per failed attempt up to MAX_RECONNECT_DELAY
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 300
+# reconnect once this many requests in a row get no payload back within REQUEST_TIMEOUT
+STALE_REQUESTS = 3
@@ -1,16 +1,28 @@
 """Reclaim Energy V2 Heat Pump Hot Water System Controller."""
 
 import asyncio
+import itertools
 import json
 import logging
+import random
 import ssl
+import time
 from typing import Any
 
 import aiomqtt
 import boto3
 import botocore
 
-from .const import AWS_REGION_NAME, AWS_IDENTITY_POOL, AWS_HOSTNAME, AWS_PORT
+from .const import (
+    AWS_HOSTNAME,
+    AWS_IDENTITY_POOL,
+    AWS_PORT,
+    AWS_REGION_NAME,
+    MAX_RECONNECT_DELAY,
+    RECONNECT_DELAY,
+    REQUEST_TIMEOUT,
+    STALE_REQUESTS,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -83,6 +95,22 @@ def ushort(x: int):
     return x - 65536 if x & 0x8000 else x
 
 
+def create_tls_context(cacert: str, certificate: str, key: str) -> ssl.SSLContext:
+    """Build the mutual TLS context used to connect to AWS IoT."""
+    tls_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    tls_context.load_verify_locations(cafile=cacert)
+    tls_context.load_cert_chain(certfile=certificate, keyfile=key)
+    tls_context.verify_mode = ssl.CERT_REQUIRED
+    tls_context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return tls_context
+
+
+def reconnect_delay(attempt: int) -> float:
+    """Seconds to wait before reconnect attempt (counting from 0), jittered so clients spread out."""
+    delay = min(MAX_RECONNECT_DELAY, RECONNECT_DELAY * 2 ** min(attempt, 16))
+    return random.uniform(delay / 2, delay)
+
+
 class ReclaimState:
     """Represents the current system state."""
 
@@ -143,25 +171,167 @@ class ReclaimState:
         "mode8_start": (41001, lambda x: int(x / 256), lambda x: x * 256),
     }
 
-    def __init__(self, data: dict) -> None:
-        """Initialise with modbus data."""
-        self.data = data
+    # array equivalents of the modbus_map decoders, used by decode_batch
+    batch_map = {
+        "mode": ("enum", modes, 2),
+        "pump": ("raw",),
+        "case": ("signed", 2),
+        "water": ("signed", 2),
+        "outlet": ("signed", 1),
+        "inlet": ("signed", 1),
+        "discharge": ("signed", 1),
+        "suction": ("signed", 1),
+        "evaporator": ("signed", 1),
+        "ambient": ("signed", 1),
+        "compspeed": ("raw",),
+        "waterspeed": ("raw",),
+        "fanspeed": ("raw",),
+        "power": ("raw",),
+        "current": ("scale", 1000),
+        "hours": ("raw",),
+        "starts": ("raw",),
+        "boost": ("bool",),
+        "mode5_timer1_start": ("hour",),
+        "mode5_timer1_duration": ("hour",),
+        "mode5_timer2_start": ("hour",),
+        "mode5_timer2_duration": ("hour",),
+        "mode5_timer2_on_temp": ("scale", 2),
+        "mode6_timer1_start": ("hour",),
+        "mode6_timer1_duration": ("hour",),
+        "mode6_timer2_start": ("hour",),
+        "mode6_timer2_duration": ("hour",),
+        "mode6_timer2_on_temp": ("scale", 2),
+        "mode6_timer2_off_temp": ("scale", 2),
+        "mode7_start": ("hour",),
+        "mode7_duration": ("hour",),
+        "mode8_day": ("enum", days, 1),
+        "mode8_start": ("hour",),
+    }
 
-    def __getattr__(self, name: str):
-        """Return a processed attribute."""
-        try:
-            if self.data:
-                mb = self.modbus_map[name]
-                if mb[0] not in self.data:
-                    return "unavailable"
+    # every attribute is decoded once up front and stored in a slot, so reads
+    # are plain field loads; a register that fails to decode leaves its slot
+    # empty and reading it raises AttributeError
+    __slots__ = ("data", *modbus_map)
 
-                if mb[1]:
-                    return mb[1](self.data[mb[0]])
+    # register -> (attribute, decoder), precomputed from modbus_map
+    _decoders = {entry[0]: (name, entry[1]) for name, entry in modbus_map.items()}
 
-                return self.data[mb[0]]
-            return "unavailable"
-        except (IndexError, KeyError) as e:
-            raise AttributeError from e
+    def __init__(self, data: dict) -> None:
+        """Initialise with modbus data."""
+        self.data = data
+        self._decode()
+
+    @classmethod
+    def from_modbus(cls, raw: list[int]) -> "ReclaimState":
+        """Decode a flat [register, value, ...] list in a single pass."""
+        state = cls.__new__(cls)
+        state.data = cls.registers(raw)
+        state._decode()
+        return state
+
+    @staticmethod
+    def registers(raw: list[int]) -> dict[int, int]:
+        """Pair up a flat [register, value, ...] list."""
+        if len(raw) % 2:
+            raise IndexError("modbusVal has an unpaired register")
+        return dict(zip(raw[::2], raw[1::2]))
+
+    @classmethod
+    def decode_batch(
+        cls, payloads: list[list[int]], names: list[str] | None = None
+    ) -> dict[str, Any]:
+        """Decode many modbusVal lists into one NumPy array per attribute.
+
+        payloads may also be a 2D array of equal length modbusVal rows.
+
+        Numeric attributes are float64 with NaN where a payload lacks the
+        register, boost is a bool array and mode/mode8_day are object arrays
+        holding None where the register is missing or out of range.
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        names = list(cls.batch_map) if names is None else names
+        if isinstance(payloads, np.ndarray):
+            # equal length payloads already stacked into a 2D array
+            lengths = np.full(payloads.shape[0], payloads.shape[1])
+            flat = payloads.reshape(-1)
+        else:
+            lengths = np.fromiter(map(len, payloads), dtype=np.intp, count=len(payloads))
+            flat = np.fromiter(
+                itertools.chain.from_iterable(payloads), dtype=np.int64, count=lengths.sum()
+            )
+        if (lengths % 2).any():
+            raise IndexError("modbusVal has an unpaired register")
+        registers, values = flat[0::2], flat[1::2]
+        rows = np.repeat(np.arange(len(payloads)), lengths // 2)
+
+        # map each received register to its output column, dropping the rest
+        wanted = np.array([cls.modbus_map[name][0] for name in names])
+        order = np.argsort(wanted)
+        index = np.searchsorted(wanted[order], registers).clip(max=len(names) - 1)
+        hit = wanted[order][index] == registers
+        raw = np.full((len(names), len(payloads)), np.nan)
+        raw[order[index[hit]], rows[hit]] = values[hit]
+
+        columns = {}
+        for name, column in zip(names, raw):
+            kind, *args = cls.batch_map[name]
+            if kind == "signed":
+                column = np.where(column >= 0x8000, column - 65536, column) / args[0]
+            elif kind == "scale":
+                column = column / args[0]
+            elif kind == "hour":
+                column = np.floor(column / 256)
+            elif kind == "bool":
+                column = np.nan_to_num(column) != 0
+            elif kind == "enum":
+                labels, offset = args
+                index = column - offset
+                valid = (index >= -len(labels)) & (index < len(labels))
+                decoded = np.full(len(column), None, dtype=object)
+                decoded[valid] = np.array(labels, dtype=object)[index[valid].astype(np.intp)]
+                column = decoded
+            columns[name] = column
+        return columns
+
+    def _decode(self) -> None:
+        data = self.data
+        for register, (name, decode) in self._decoders.items():
+            if register not in data:
+                setattr(self, name, "unavailable")
+            elif decode is None:
+                setattr(self, name, data[register])
+            else:
+                try:
+                    setattr(self, name, decode(data[register]))
+                except (IndexError, KeyError):
+                    pass
+
+
+class ReclaimStateStore:
+    """Last known register set: the latest full read with later write acks merged in."""
+
+    def __init__(self) -> None:
+        """Initialise empty."""
+        self.state = ReclaimState({})
+        self.version = 0
+        # epoch ms each register was last received, and of the last full read
+        self.updated_ms: dict[int, int] = {}
+        self.read_ms: int | None = None
+
+    def apply(self, data: dict, full: bool = False) -> ReclaimState:
+        """Replace the registers with a full read, or merge a write ack into them, and return the new state."""
+        received_ms = int(time.time() * 1000)
+        if full:
+            # registers missing from a full read are no longer reported, not unchanged
+            self.state = ReclaimState(data)
+            self.updated_ms = dict.fromkeys(data, received_ms)
+            self.read_ms = received_ms
+        else:
+            self.state = ReclaimState({**self.state.data, **data})
+            self.updated_ms.update(dict.fromkeys(data, received_ms))
+        self.version += 1
+        return self.state
 
 
 class MessageListener:
@@ -174,16 +344,35 @@ class MessageListener:
 class ReclaimV2:
     """ReclaimV2 HPHWS Controller."""
 
-    def __init__(self, unique_id: int, cacert: str, certificate: str, key: str) -> None:
+    def __init__(
+        self,
+        unique_id: int,
+        cacert: str,
+        certificate: str,
+        key: str,
+        request_timeout: float = REQUEST_TIMEOUT,
+    ) -> None:
         """Initialize."""
         self.unique_id = unique_id
         self.cacert = cacert
         self.certificate = certificate
         self.key = key
+        self.request_timeout = request_timeout
 
         self._client = None
         self._connected = False
         self._listener_task = None
+        self._tls_context: ssl.SSLContext | None = None
+        # expires while STALE_REQUESTS requests in a row are unanswered, forcing a reconnect
+        self._watchdog: asyncio.Timeout | None = None
+        self._unanswered = 0
+        self._pending_reads: list[asyncio.Future] = []
+        self.last_round_trip: float | None = None
+        # running totals for monitoring; dropped payloads failed to parse or were not recognised
+        self.messages_received = 0
+        self.messages_dropped = 0
+        self.decode_seconds = 0.0
+        self.store = ReclaimStateStore()
 
         hexid = f"{self.unique_id:#016x}"[2:-2]
         self.subscribe_topic = f"dontek{hexid}/status/psw"
@@ -194,40 +383,50 @@ class ReclaimV2:
         self._listener_task = asyncio.create_task(self._listen(listener))
 
     def _create_tls_context(self):
-        tls_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        tls_context.load_verify_locations(cafile=self.cacert)
-        tls_context.load_cert_chain(certfile=self.certificate, keyfile=self.key)
-        tls_context.verify_mode = ssl.CERT_REQUIRED
-        tls_context.minimum_version = ssl.TLSVersion.TLSv1_2
-        return tls_context
+        return create_tls_context(self.cacert, self.certificate, self.key)
 
     async def _listen(self, listener: MessageListener):
-        loop = asyncio.get_running_loop()
-        tls_context = await loop.run_in_executor(None, self._create_tls_context)
+        if self._tls_context is None:
+            loop = asyncio.get_running_loop()
+            self._tls_context = await loop.run_in_executor(None, self._create_tls_context)
 
         self._connected = True
+        attempt = 0
         while self._connected:
             try:
                 async with aiomqtt.Client(
-                    hostname=AWS_HOSTNAME, port=AWS_PORT, tls_context=tls_context
+                    hostname=AWS_HOSTNAME, port=AWS_PORT, tls_context=self._tls_context
                 ) as self._client:
                     _LOGGER.info("Connected, subscribing to %s", self.subscribe_topic)
                     await self._client.subscribe(self.subscribe_topic)
 
-                    # request initial update
-                    await self.request_update()
-
-                    # process messages
-                    async for message in self._client.messages:
-                        self._process_message(message, listener)
+                    try:
+                        async with asyncio.timeout(None) as self._watchdog:
+                            # request initial update
+                            await self.request_update()
+
+                            # process messages
+                            async for message in self._client.messages:
+                                attempt = 0
+                                self._process_message(message, listener)
+                    except TimeoutError:
+                        if not self._watchdog.expired():
+                            raise
+                        # backs off like any other failure, as the device may stay silent for good
+                        _LOGGER.warning("No payload after %d requests, reconnecting", STALE_REQUESTS)
 
             except aiomqtt.MqttError as mqtt_err:
                 _LOGGER.warning("Waiting for retry, error: %s", mqtt_err)
-                self._client = None
             except Exception as e:  # noqa: BLE001
                 _LOGGER.error("Exception in MQTT loop: %s", e)
             finally:
-                await asyncio.sleep(5)
+                self._client = None
+                self._watchdog = None
+                self._unanswered = 0
+
+            if self._connected:
+                await asyncio.sleep(reconnect_delay(attempt))
+                attempt += 1
 
     async def disconnect(self) -> None:
         """Disconnect from MQTT Server."""
@@ -241,29 +440,47 @@ class ReclaimV2:
             _LOGGER.debug("listener is cancelled")
         self._listener_task = None
         self._client = None
+        self._resolve_pending_reads(None)
         _LOGGER.info("Disconnected from MQTT Server")
 
+    def _resolve_pending_reads(self, state: ReclaimState | None) -> None:
+        """Complete every read that is waiting for a full register set."""
+        pending, self._pending_reads = self._pending_reads, []
+        for future in pending:
+            if not future.done():
+                future.set_result(state)
+
     def _process_message(self, message, listener: MessageListener):
+        started = time.perf_counter()
+        self.messages_received += 1
+        # any payload shows the connection is alive
+        self._unanswered = 0
+        if self._watchdog:
+            self._watchdog.reschedule(None)
         try:
             payload = json.loads(message.payload)
             if payload["messageId"] == "read" and payload["modbusReg"] == 1:
                 # full modbus packet with all values
-                raw = payload["modbusVal"]
-                data = {raw[i]: raw[i + 1] for i in range(0, len(raw), 2)}
+                data = ReclaimState.registers(payload["modbusVal"])
                 _LOGGER.debug("Received modbus data: %s", data)
-                state = ReclaimState(data)
+                state = self.store.apply(data, full=True)
                 listener.on_message(state)
+                self._resolve_pending_reads(state)
             elif payload["messageId"] == "write":
-                # ack of a command, process so the entities are updated
+                # ack of a command, merge so the entities are updated
                 values = payload["modbusVal"]
                 if len(values) == 1:
-                    state = ReclaimState({payload["modbusReg"]: values[0]})
+                    state = self.store.apply({payload["modbusReg"]: values[0]})
                     _LOGGER.debug("Received modbus data: %s", payload)
                     listener.on_message(state)
             else:
+                self.messages_dropped += 1
                 _LOGGER.warning("Unknown payload: %s", payload)
         except (json.JSONDecodeError, IndexError, AttributeError) as e:
+            self.messages_dropped += 1
             _LOGGER.error("Error processing payload(%s): %s", e, message.payload)
+        finally:
+            self.decode_seconds += time.perf_counter() - started
 
     async def request_update(self) -> bool:
         """Send MQTT update request to controller."""
@@ -278,11 +495,50 @@ class ReclaimV2:
                     json.dumps({"messageId": "read", "modbusReg": 1, "modbusVal": [1]}),
                     qos=1,
                 )
+                self._unanswered += 1
+                if (
+                    self._unanswered >= STALE_REQUESTS
+                    and self._watchdog
+                    and self._watchdog.when() is None
+                ):
+                    # give the last request the usual time to be answered
+                    self._watchdog.reschedule(
+                        asyncio.get_running_loop().time() + self.request_timeout
+                    )
                 return True
             except aiomqtt.exceptions.MqttError as e:
                 _LOGGER.error("Error publishing update request: %s", e)
         return False
 
+    async def request_state(self, timeout: float | None = None) -> ReclaimState | None:
+        """Request a full register read and wait for the matching response.
+
+        Resolves with the next full ``read`` payload received after the request
+        is published, or None if the request fails or times out.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_reads.append(future)
+        started = time.monotonic()
+
+        try:
+            if not await self.request_update():
+                return None
+            state = await asyncio.wait_for(
+                asyncio.shield(future),
+                self.request_timeout if timeout is None else timeout,
+            )
+        except TimeoutError:
+            _LOGGER.warning("Timed out waiting for state from %s", self.unique_id)
+            return None
+        finally:
+            if future in self._pending_reads:
+                self._pending_reads.remove(future)
+
+        if state is not None:
+            self.last_round_trip = time.monotonic() - started
+        return state
+
     async def set_value(self, name: str, value: Any) -> None:
         """Send MQTT message to turn on boost mode."""
         if not self._connected:
@@ -312,6 +568,133 @@ class ReclaimV2:
                 _LOGGER.error("Error publishing value request: %s", e)
 
 
+class ReclaimFleet:
+    """Many ReclaimV2 controllers sharing a single MQTT connection."""
+
+    def __init__(
+        self,
+        cacert: str,
+        certificate: str,
+        key: str,
+        request_timeout: float = REQUEST_TIMEOUT,
+    ) -> None:
+        """Initialize."""
+        self.cacert = cacert
+        self.certificate = certificate
+        self.key = key
+        self.request_timeout = request_timeout
+        self.devices: dict[int, ReclaimV2] = {}
+
+        self._client = None
+        self._connected = False
+        self._listener_task = None
+        self._tls_context: ssl.SSLContext | None = None
+        self._routes: dict[str, tuple[ReclaimV2, MessageListener]] = {}
+        # messages on topics of no registered device
+        self.messages_dropped = 0
+
+    def add_device(self, unique_id: int, listener: MessageListener) -> ReclaimV2:
+        """Register a device; must be called before connect."""
+        device = ReclaimV2(
+            unique_id, self.cacert, self.certificate, self.key, self.request_timeout
+        )
+        self.devices[unique_id] = device
+        self._routes[device.subscribe_topic] = (device, listener)
+        return device
+
+    @property
+    def is_connected(self) -> bool:
+        """Whether the shared MQTT connection is currently up."""
+        return self._client is not None
+
+    async def connect(self) -> None:
+        """Connect to MQTT server and subscribe for updates from every device."""
+        self._listener_task = asyncio.create_task(self._listen())
+
+    def _attach(
+        self, client: aiomqtt.Client | None, watchdog: asyncio.Timeout | None = None
+    ) -> None:
+        """Point every device at the shared client and its watchdog."""
+        self._client = client
+        for device in self.devices.values():
+            device._client = client
+            device._connected = self._connected
+            device._watchdog = watchdog
+            device._unanswered = 0
+
+    async def _listen(self):
+        if self._tls_context is None:
+            loop = asyncio.get_running_loop()
+            self._tls_context = await loop.run_in_executor(
+                None, create_tls_context, self.cacert, self.certificate, self.key
+            )
+
+        self._connected = True
+        attempt = 0
+        while self._connected:
+            try:
+                async with aiomqtt.Client(
+                    hostname=AWS_HOSTNAME, port=AWS_PORT, tls_context=self._tls_context
+                ) as client:
+                    _LOGGER.info("Connected, subscribing to %d devices", len(self._routes))
+                    await client.subscribe([(topic, 0) for topic in self._routes])
+
+                    # a payload from any device shows the shared connection is alive
+                    try:
+                        async with asyncio.timeout(None) as watchdog:
+                            self._attach(client, watchdog)
+
+                            # request initial update
+                            for device in self.devices.values():
+                                await device.request_update()
+
+                            # route messages to the device that owns the topic
+                            async for message in client.messages:
+                                attempt = 0
+                                self._route_message(message)
+                    except TimeoutError:
+                        if not watchdog.expired():
+                            raise
+                        # backs off like any other failure, as the devices may stay silent for good
+                        _LOGGER.warning("No payload after %d requests, reconnecting", STALE_REQUESTS)
+
+            except aiomqtt.MqttError as mqtt_err:
+                _LOGGER.warning("Waiting for retry, error: %s", mqtt_err)
+            except Exception as e:  # noqa: BLE001
+                _LOGGER.error("Exception in MQTT loop: %s", e)
+            finally:
+                self._attach(None)
+
+            if self._connected:
+                await asyncio.sleep(reconnect_delay(attempt))
+                attempt += 1
+
+    def _route_message(self, message) -> None:
+        route = self._routes.get(str(message.topic))
+        if route is None:
+            self.messages_dropped += 1
+            _LOGGER.warning("Message on unknown topic %s", message.topic)
+            return
+        device, listener = route
+        device._process_message(message, listener)
+
+    async def disconnect(self) -> None:
+        """Disconnect from MQTT Server."""
+        if self._listener_task is None:
+            return
+        self._connected = False
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            _LOGGER.debug("listener is cancelled")
+        self._listener_task = None
+        self._attach(None)
+        for device in self.devices.values():
+            device._resolve_pending_reads(None)
+        _LOGGER.info("Disconnected from MQTT Server")
+
+
 async def main():
     """Test harness."""
 
@@ -23,32 +23,39 @@ interface HistoryData {
   boost: boolean[];
 }
 
+const EMPTY_DATA: HistoryData = {
+  timestamp_ms: [],
+  pump: [],
+  case: [],
+  water: [],
+  outlet: [],
+  inlet: [],
+  discharge: [],
+  suction: [],
+  evaporator: [],
+  ambient: [],
+  compspeed: [],
+  waterspeed: [],
+  fanspeed: [],
+  power: [],
+  current: [],
+  hours: [],
+  starts: [],
+  boost: [],
+};
+
+const TEMPERATURE_TYPES = ['water', 'case', 'outlet', 'inlet', 'discharge', 'suction', 'evaporator', 'ambient'];
+// only the columns the chart draws are requested
+const PLOTTED_FIELDS = ['timestamp_ms', ...TEMPERATURE_TYPES];
+
 function App() {
   const [startTime, setStartTime] = useState<number>(Date.now() - 3600000); // Default to 1 hour ago
   const [refreshInterval, setRefreshInterval] = useState<number>(10000); // Default to 10 seconds
-  const [data, setData] = useState<HistoryData>({
-    timestamp_ms: [],
-    pump: [],
-    case: [],
-    water: [],
-    outlet: [],
-    inlet: [],
-    discharge: [],
-    suction: [],
-    evaporator: [],
-    ambient: [],
-    compspeed: [],
-    waterspeed: [],
-    fanspeed: [],
-    power: [],
-    current: [],
-    hours: [],
-    starts: [],
-    boost: [],
-  });
+  const [data, setData] = useState<HistoryData>(EMPTY_DATA);
   const [isPlotting, setIsPlotting] = useState<boolean>(false);
   const [isToggling, setIsToggling] = useState<boolean>(false);
   const plotRef = useRef<HTMLDivElement>(null);
+  const cursorRef = useRef<string | null>(null);
 
   const toLocalISOString = (date: Date) => {
     const year = date.getFullYear();
@@ -95,9 +102,11 @@ function App() {
     }
   };
 
+  // Fetches the whole range, downsampled, and remembers where it ended
   const fetchData = async (start: number, end: number): Promise<HistoryData | null> => {
     try {
-      const response = await axios.get<HistoryData>(`/history/${start}/${end}`);
+      const response = await axios.get<HistoryData>(`/history/${start}/${end}`, { params: { max_points: 2000, fields: PLOTTED_FIELDS.join(',') } });
+      cursorRef.current = response.headers['x-history-cursor'] ?? null;
       return response.data;
     } catch (error) {
       console.error('Error fetching data:', error);
@@ -105,6 +114,26 @@ function App() {
     }
   };
 
+  // Fetches only the rows logged since the last fetch; null when nothing is new
+  const fetchNewData = async (start: number, end: number): Promise<HistoryData | null> => {
+    const cursor = cursorRef.current;
+    try {
+      const response = await axios.get<HistoryData>(`/history/${start}/${end}`, {
+        params: { after: cursor, fields: PLOTTED_FIELDS.join(',') },
+        headers: { 'If-None-Match': `"${cursor}"` },
+        validateStatus: (status) => status === 200 || status === 304,
+      });
+      if (response.status === 304 || !response.data.timestamp_ms) {
+        return null;
+      }
+      cursorRef.current = response.headers['x-history-cursor'] ?? cursor;
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching new data:', error);
+      return null;
+    }
+  };
+
   useEffect(() => {
     const fetchPlottingStatus = async () => {
       try {
@@ -137,11 +166,30 @@ function App() {
       }
     };
 
+    const fetchAndAppendData = async () => {
+      if (!cursorRef.current) {
+        return fetchAndSetData();
+      }
+      const newData = await fetchNewData(startTime, Date.now());
+      if (newData) {
+        setData(previous => {
+          const merged = { ...previous };
+          (Object.keys(newData) as (keyof HistoryData)[]).forEach(key => {
+            if (previous[key]) {
+              (merged as any)[key] = [...previous[key], ...newData[key]];
+            }
+          });
+          return merged;
+        });
+      }
+    };
+
+    cursorRef.current = null;
     fetchAndSetData(); // Initial fetch when startTime changes or on mount
 
     const intervalId = setInterval(() => {
       if (isPlotting) { // Only poll if isPlotting is true
-        fetchAndSetData(); // Re-fetch all data from startTime to now
+        fetchAndAppendData(); // Only fetch rows logged since the last poll
       }
     }, refreshInterval);
 
@@ -152,8 +200,7 @@ function App() {
     if (plotRef.current) {
       const marks: Plot.Markish[] = [];
       if (data.timestamp_ms.length > 0) {
-        const temperatureTypes = ['water', 'case', 'outlet', 'inlet', 'discharge', 'suction', 'evaporator', 'ambient'];
-        temperatureTypes.forEach(type => {
+        TEMPERATURE_TYPES.forEach(type => {
           marks.push(
             Plot.line(data.timestamp_ms.map((t, i) => ({ x: new Date(t), y: (data as any)[type][i], type: type })), { x: 'x', y: 'y', stroke: 'type' }),
             Plot.dot([
@@ -3,8 +3,12 @@ import botocore
 import os, sys
 import logging
 import asyncio
+import json
+import time
 import uvicorn
 import asyncpg
+import numpy as np
+import random
 
 # Set environment variables for local PostgreSQL connection
 os.environ["DB_USER"] = "user"
@@ -12,9 +16,11 @@ os.environ["DB_PASSWORD"] = "password"
 os.environ["DB_HOST"] = "localhost"
 os.environ["DB_PORT"] = "5433"
 os.environ["DB_NAME"] = "reclaim_energy"
-from fastapi import FastAPI, Request, Response, status
-from contextlib import asynccontextmanager
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager, contextmanager, nullcontext, suppress
+from typing import Annotated, AsyncIterator, Callable, Iterator, Optional
 
 from custom_components.reclaimenergy.const import (AWS_IOT_ROOT_CERT,
                                                    AWS_REGION_NAME,
@@ -25,9 +31,16 @@ from custom_components.reclaimenergy.const import (AWS_IOT_ROOT_CERT,
                                                    CERT_FILENAME,
                                                    KEY_FILENAME,
                                                    UNIQUE_ID_FILENAME,)
-from custom_components.reclaimenergy.reclaimv2 import ReclaimV2, ReclaimState
+from custom_components.reclaimenergy.reclaimv2 import ReclaimFleet, ReclaimV2, ReclaimState
 from custom_components.reclaimenergy.config_flow import obtain_and_save_aws_keys
-from model import ReclaimStateResponse, ReclaimBoostResponse, BoostStatus
+import metrics
+from metrics import Collected, Counter, Histogram
+from model import ReclaimStateResponse, ReclaimBoostResponse, BoostStatus, StateStream
+from storage import (ColumnRecords, HistoryCompressor, HistorySpool, HistoryStore, HistoryWriter, PostgresStore,
+                     RecentHistory, SqliteStore, downsample, history_row, rollup)
+from storage import export as history_export
+from storage import query as history_query
+from storage.const import NUMERIC_COLUMNS, STATE_COLUMNS
 
 BASEPATH = os.getcwd()
 
@@ -36,115 +49,396 @@ CERT_PATH = os.path.join(BASEPATH, CERT_FILENAME)
 KEY_PATH = os.path.join(BASEPATH, KEY_FILENAME)
 UNIQUE_ID_PATH = os.path.join(BASEPATH, UNIQUE_ID_FILENAME)
 
+# 'postgres' for the DB_* server, 'sqlite' for an embedded database file at SQLITE_PATH
+HISTORY_BACKEND = os.environ.get("HISTORY_BACKEND", "postgres")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(BASEPATH, "history.db"))
+# Newest history rows kept in memory to answer recent /history ranges, about 190 bytes each
+RECENT_HISTORY_ROWS = int(os.environ.get("RECENT_HISTORY_ROWS", "86400"))
+# History rows are appended here while the database cannot be written, and replayed once it can
+HISTORY_SPOOL_PATH = os.environ.get("HISTORY_SPOOL_PATH", os.path.join(BASEPATH, "history.spool"))
+# Longest wait between attempts to reconnect to the database
+MAX_RECONNECT_SECONDS = 300
+# Give up on a database connection attempt after this long, so an unreachable server cannot hold up startup
+DB_CONNECT_TIMEOUT = 10
+
+HISTORY_STREAM_FORMATS = ('rows', 'columns')
+# Live /stream clients are dropped once this many updates behind
+STREAM_QUEUE_SIZE = 32
+STREAM_KEEPALIVE_SECONDS = 15
+# Response header carrying the (timestamp_ms, id) keyset cursor of the newest history row returned
+CURSOR_HEADER = 'X-History-Cursor'
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 _LOGGER = logging.getLogger(__name__)
 
+MQTT_ROUND_TRIP = Histogram('reclaim_mqtt_round_trip_seconds',
+                            "Time from publishing a read request to the full register payload answering it",
+                            ('device',))
+MQTT_REQUESTS = Counter('reclaim_mqtt_requests', "Read requests by whether a payload answered them",
+                        ('device', 'outcome'))
+STREAM_DROPPED = Counter('reclaim_stream_updates_dropped', "State updates not delivered to a /stream subscriber "
+                         "that fell behind")
+HISTORY_QUERY_SECONDS = Histogram('reclaim_history_query_seconds', "Time to read history for an endpoint",
+                                  ('endpoint', 'query', 'source'))
+BOOST_TOGGLES = Counter('reclaim_boost_toggles', "Boost requests by action and outcome", ('action', 'outcome'))
+
 
 class MessageListener:
     """Message Listener."""
     state: ReclaimState = ReclaimState({})
 
+    def __init__(self) -> None:
+        # queue -> whether to drop the subscriber instead of the update when it is full
+        self._subscribers: dict[asyncio.Queue, bool] = {}
+
     def on_message(self, state: ReclaimState) -> None:
         """Process device state updates."""
         self.state = state
+        for queue, drop_slow in list(self._subscribers.items()):
+            try:
+                queue.put_nowait(state)
+            except asyncio.QueueFull:
+                # a subscriber that falls behind misses updates rather than stalling the others
+                if drop_slow:
+                    # the queued updates are discarded along with this one
+                    STREAM_DROPPED.inc(queue.qsize() + 1)
+                    del self._subscribers[queue]
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+    @contextmanager
+    def subscribe(self, maxsize: int = 100, drop_slow: bool = False) -> Iterator[asyncio.Queue]:
+        """Receive every state update while the context is open.
+
+        With drop_slow, a subscriber whose queue fills up is unsubscribed and
+        receives None in place of the updates it missed.
+        """
+        queue = asyncio.Queue(maxsize)
+        self._subscribers[queue] = drop_slow
+        try:
+            yield queue
+        finally:
+            self._subscribers.pop(queue, None)
+
+
+class StateCache:
+    """Shares device reads between concurrent callers."""
+
+    def __init__(self, reclaimv2: ReclaimV2) -> None:
+        self.reclaimv2 = reclaimv2
+        self.state: Optional[ReclaimState] = None
+        self.updated_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def get(self, max_age_ms: int = 0) -> Optional[ReclaimState]:
+        """Return a state no older than max_age_ms, joining any read already in flight."""
+        if self.state is not None and max_age_ms > 0 \
+                and (time.monotonic() - self.updated_at) * 1000 <= max_age_ms:
+            return self.state
+
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self) -> Optional[ReclaimState]:
+        started = time.perf_counter()
+        state = await self.reclaimv2.request_state()
+        device = str(self.reclaimv2.unique_id)
+        MQTT_REQUESTS.labels(device, 'unanswered' if state is None else 'answered').inc()
+        if state is not None:
+            MQTT_ROUND_TRIP.labels(device).observe(time.perf_counter() - started)
+            self.state = state
+            self.updated_at = time.monotonic()
+        return state
+
+
+class Device:
+    """A Reclaim unit served by the fleet, with its listener and state cache."""
+
+    def __init__(self, reclaimv2: ReclaimV2, listener: MessageListener) -> None:
+        self.reclaimv2 = reclaimv2
+        self.listener = listener
+        self.state_cache = StateCache(reclaimv2)
+
+def _device_totals(attribute: str) -> dict:
+    devices = getattr(app.state, 'devices', {})
+    return {(str(unique_id),): getattr(device.reclaimv2, attribute) for unique_id, device in devices.items()}
+
+def _messages_dropped() -> dict:
+    totals = _device_totals('messages_dropped')
+    fleet = getattr(app.state, 'fleet', None)
+    if fleet is not None:
+        totals[('unknown',)] = fleet.messages_dropped
+    return totals
+
+def _decode_seconds() -> dict:
+    devices = getattr(app.state, 'devices', {})
+    return {(str(unique_id),): (device.reclaimv2.decode_seconds, device.reclaimv2.messages_received)
+            for unique_id, device in devices.items()}
+
+def _writer_gauges(read: Callable) -> Callable[[], dict]:
+    def collect() -> dict:
+        writer = getattr(app.state, 'history_writer', None)
+        return {(): read(writer)} if writer is not None else {}
+    return collect
+
+Collected('reclaim_mqtt_messages_received', "MQTT payloads received per device", 'counter',
+          lambda: _device_totals('messages_received'), ('device',))
+Collected('reclaim_mqtt_messages_dropped', "MQTT payloads that failed to parse, were not recognised or had no device",
+          'counter', _messages_dropped, ('device',))
+Collected('reclaim_mqtt_decode_seconds', "Time spent decoding MQTT payloads in _process_message", 'summary',
+          _decode_seconds, ('device',))
+Collected('reclaim_history_pending_rows', "History rows queued in memory for the next write", 'gauge',
+          _writer_gauges(lambda writer: writer.pending))
+Collected('reclaim_history_spool_bytes', "Bytes of history rows spooled to disk awaiting replay", 'gauge',
+          _writer_gauges(lambda writer: writer.spool.size if writer.spool else 0))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Connect to the Reclaim HWS
-    obtain_and_save_aws_keys(CACERT_PATH, CERT_PATH, KEY_PATH)
-    with open(UNIQUE_ID_PATH, 'r') as f:
-        unique_id = int(f.readline().strip())
-    app.state.reclaimv2 = ReclaimV2(
-        unique_id,
+    # Devices exist from the start, one unique id per line; the services behind them come up concurrently
+    started = time.perf_counter()
+    unique_ids = await asyncio.to_thread(_read_unique_ids)
+    app.state.fleet = ReclaimFleet(
         CACERT_PATH,
         CERT_PATH,
         KEY_PATH,
     )
-    app.state.listener = MessageListener()
-    await app.state.reclaimv2.connect(app.state.listener)
+    app.state.devices = {}
+    for unique_id in unique_ids:
+        listener = MessageListener()
+        app.state.devices[unique_id] = Device(app.state.fleet.add_device(unique_id, listener), listener)
+    app.state.default_device_id = unique_ids[0]
+
+    app.state.credentials_ready = None
+    app.state.store = None
+    app.state.reconnect_task = None
+    await asyncio.gather(_start_mqtt(), _start_database())
+    _LOGGER.info(f"Started in {time.perf_counter() - started:.2f}s: {_readiness()}")
+
+    app.state.recent = RecentHistory(RECENT_HISTORY_ROWS)
+    app.state.history_writer = HistoryWriter(app.state.store, recent=app.state.recent,
+                                             spool=HistorySpool(HISTORY_SPOOL_PATH))
+    await app.state.history_writer.start()
+    if not app.state.store:
+        app.state.reconnect_task = asyncio.create_task(_reconnect_store())
+
+    app.state.logging_task = None
+    app.state.logging_stats = {}
+    app.state.stop_logging_event = asyncio.Event()
+
+    yield
 
-    _LOGGER.info("Connecting to database...")
-    db_user = os.environ.get("DB_USER")
-    db_password = os.environ.get("DB_PASSWORD")
-    db_host = os.environ.get("DB_HOST")
-    db_port = os.environ.get("DB_PORT")
-    db_name = os.environ.get("DB_NAME")
+    # Stop logging and write out any buffered history
+    app.state.stop_logging_event.set()
+    if app.state.logging_task:
+        app.state.logging_task.cancel()
+        await asyncio.gather(app.state.logging_task, return_exceptions=True)
+    if app.state.reconnect_task:
+        app.state.reconnect_task.cancel()
+        await asyncio.gather(app.state.reconnect_task, return_exceptions=True)
+    await app.state.history_writer.close()
+
+    # Disconnect from the Reclaim HWS units
+    await app.state.fleet.disconnect()
+
+    _LOGGER.info("Disconnecting from database...")
+    if app.state.store:
+        await app.state.store.close()
+        app.state.store = None
+    _LOGGER.info("Database disconnected.")
 
-    _LOGGER.info(f"Attempting to connect with: User={db_user}, Host={db_host}, Port={db_port}, DB={db_name}")
-    # WARNING: Do NOT log the password in a production environment!
-    _LOGGER.info(f"Password length: {len(db_password) if db_password else 0}")
+def _read_unique_ids() -> list[int]:
+    with open(UNIQUE_ID_PATH, 'r') as f:
+        return [int(line.strip()) for line in f if line.strip()]
 
+async def _start_mqtt() -> None:
+    """Load or obtain the AWS credentials off the event loop, then start the MQTT connection in the background."""
+    started = time.perf_counter()
+    try:
+        app.state.credentials_ready = await asyncio.to_thread(obtain_and_save_aws_keys, CACERT_PATH, CERT_PATH, KEY_PATH)
+    except Exception as e:
+        _LOGGER.error(f"Failed to obtain AWS credentials: {e}")
+        app.state.credentials_ready = False
+    if not app.state.credentials_ready:
+        _LOGGER.error("No AWS credentials, not connecting to the Reclaim HWS units")
+        return
+    _LOGGER.info(f"AWS credentials ready in {time.perf_counter() - started:.2f}s")
+    await app.state.fleet.connect()
+
+async def _start_database() -> None:
+    started = time.perf_counter()
     try:
-        app.state.pool = await asyncpg.create_pool(
+        app.state.store = await _open_store()
+    except Exception as e:
+        _LOGGER.error(f"Failed to connect to database or migrate schema, spooling history until it is back: {e}")
+        return
+    _LOGGER.info(f"Database schema is at version {app.state.store.schema_version}, "
+                 f"ready in {time.perf_counter() - started:.2f}s")
+
+def _readiness() -> dict[str, str]:
+    """The state of each subsystem the service depends on."""
+    if app.state.credentials_ready is None:
+        credentials = mqtt = 'starting'
+    elif not app.state.credentials_ready:
+        credentials = mqtt = 'failed'
+    else:
+        credentials = 'ready'
+        mqtt = 'ready' if app.state.fleet.is_connected else 'connecting'
+    return {
+        'credentials': credentials,
+        'mqtt': mqtt,
+        'database': 'ready' if app.state.store else 'connecting',
+    }
+
+async def _open_store() -> HistoryStore:
+    """Connect to the HISTORY_BACKEND database and bring its schema up to date."""
+    if HISTORY_BACKEND == 'sqlite':
+        _LOGGER.info(f"Opening SQLite history at {SQLITE_PATH}")
+        store = SqliteStore(SQLITE_PATH)
+    else:
+        _LOGGER.info("Connecting to database...")
+        db_user = os.environ.get("DB_USER")
+        db_password = os.environ.get("DB_PASSWORD")
+        db_host = os.environ.get("DB_HOST")
+        db_port = os.environ.get("DB_PORT")
+        db_name = os.environ.get("DB_NAME")
+
+        _LOGGER.info(f"Attempting to connect with: User={db_user}, Host={db_host}, Port={db_port}, DB={db_name}")
+        # WARNING: Do NOT log the password in a production environment!
+        _LOGGER.info(f"Password length: {len(db_password) if db_password else 0}")
+
+        store = PostgresStore(await asyncpg.create_pool(
             user=db_user,
             password=db_password,
             host=db_host,
             port=int(db_port),
             database=db_name,
-        )
+            timeout=DB_CONNECT_TIMEOUT,
+        ))
         _LOGGER.info("Database connected.")
+    try:
+        await store.open()
+    except BaseException:
+        await store.close()
+        raise
+    return store
+
+async def _reconnect_store() -> None:
+    """Retry _open_store with jittered exponential backoff, handing the store to the history writer once open."""
+    delay = 1.0
+    while True:
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        try:
+            store = await _open_store()
+        except Exception as e:
+            delay = min(delay * 2, MAX_RECONNECT_SECONDS)
+            _LOGGER.warning(f"Database still unavailable, retrying in up to {delay:.0f}s: {e}")
+            continue
+        _LOGGER.info(f"Database reconnected, schema is at version {store.schema_version}.")
+        await app.state.history_writer.attach(store)
+        app.state.store = store
+        # replay whatever was spooled during the outage now rather than at the next flush
+        await app.state.history_writer.flush()
+        return
 
-        # Create table if it doesn't exist
-        async with app.state.pool.acquire() as connection:
-            await connection.execute("""
-                CREATE TABLE IF NOT EXISTS reclaim_state_history (
-                    id SERIAL PRIMARY KEY,
-                    timestamp_ms BIGINT DEFAULT (EXTRACT(EPOCH FROM NOW()) * 1000),
-                    mode TEXT,
-                    pump BOOLEAN,
-                    "case" REAL,
-                    water REAL,
-                    outlet REAL,
-                    inlet REAL,
-                    discharge REAL,
-                    suction REAL,
-                    evaporator REAL,
-                    ambient REAL,
-                    compspeed INTEGER,
-                    waterspeed INTEGER,
-                    fanspeed INTEGER,
-                    power INTEGER,
-                    current REAL,
-                    hours REAL,
-                    starts REAL,
-                    boost BOOLEAN
-                )
-            """)
-        _LOGGER.info("Table 'reclaim_state_history' ensured to exist.")
-    except Exception as e:
-        _LOGGER.error(f"Failed to connect to database or create table: {e}")
-        app.state.pool = None
-
-    app.state.logging_task = None
-    app.state.stop_logging_event = asyncio.Event()
-
-    yield
+app = FastAPI(lifespan=lifespan)
 
-    # Disconnect from the Reclaim HWS
-    await app.state.reclaimv2.disconnect()
+@app.get('/health')
+async def health(request: Request):
+    """Readiness of credentials, MQTT and the database; 503 until all of them are ready."""
+    readiness = _readiness()
+    ready = all(state == 'ready' for state in readiness.values())
+    return JSONResponse(readiness, status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
 
-    _LOGGER.info("Disconnecting from database...")
-    if app.state.pool:
-        await app.state.pool.close()
-        app.state.pool = None
-    _LOGGER.info("Database disconnected.")
+@app.get('/metrics')
+async def get_metrics(request: Request):
+    """Counters and histograms in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-app = FastAPI(lifespan=lifespan)
+@app.get('/devices')
+async def devices(request: Request):
+    # ids are 17 digits, which is beyond the integer precision of JSON clients
+    return {"default": str(app.state.default_device_id),
+            "devices": [str(unique_id) for unique_id in app.state.devices]}
 
 @app.get('/state')
-async def state(request: Request) -> ReclaimStateResponse:
-    state: Optional[ReclaimStateResponse] = await _get_latest_state()
-    return state if state else ReclaimStateResponse(
-        mode='unknown'
-    )
+async def state(request: Request, device_id: Optional[int] = None, max_age_ms: int = 0) -> ReclaimStateResponse:
+    state: Optional[ReclaimStateResponse] = await _get_latest_state(_get_device(device_id), max_age_ms)
+    return state if state else Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.get('/stream')
+async def stream(request: Request, device_id: Optional[int] = None):
+    """Server-sent events carrying the device's state as it is pushed: all fields first, then only changes."""
+    device = _get_device(device_id)
+
+    async def events() -> AsyncIterator[str]:
+        encoder = StateStream()
+        async for state in _live_states(device):
+            if state is None:
+                yield ": keepalive\n\n"
+                continue
+            frame = encoder.json_frame(int(time.time() * 1000), state)
+            if frame:
+                yield f"data: {frame}\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.websocket('/stream')
+async def stream_socket(websocket: WebSocket, device_id: Optional[int] = None, binary: bool = False):
+    """The /stream updates over a WebSocket, as JSON text frames or StateStream binary frames."""
+    device = app.state.devices.get(device_id if device_id is not None else app.state.default_device_id)
+    if device is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Unknown device {device_id}")
+        return
+
+    await websocket.accept()
+
+    async def send() -> None:
+        encoder = StateStream()
+        async for state in _live_states(device):
+            if state is None:
+                continue
+            timestamp_ms = int(time.time() * 1000)
+            if binary:
+                frame = encoder.binary_frame(timestamp_ms, state)
+                if frame:
+                    await websocket.send_bytes(frame)
+            else:
+                frame = encoder.json_frame(timestamp_ms, state)
+                if frame:
+                    await websocket.send_text(frame)
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Client fell behind")
+
+    async def receive() -> None:
+        # nothing is expected from the client, but reading is how a disconnect shows up
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+
+    tasks = {asyncio.create_task(send()), asyncio.create_task(receive())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        with suppress(WebSocketDisconnect):
+            task.result()
 
 @app.post('/logging/start/{interval_seconds}')
-async def start_logging(request: Request, interval_seconds: int):
+async def start_logging(request: Request, interval_seconds: int, device_id: Optional[int] = None,
+                        on_push: bool = False, min_spacing_ms: int = 0, compress: bool = False):
+    device = _get_device(device_id)
+    if interval_seconds <= 0:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST, content="Interval must be positive.")
     if app.state.logging_task and not app.state.logging_task.done():
         return Response(status_code=status.HTTP_409_CONFLICT, content="Logging is already running.")
 
     app.state.stop_logging_event.clear()
-    app.state.logging_task = asyncio.create_task(_log_data_periodically(interval_seconds))
+    compressor = HistoryCompressor() if compress else None
+    app.state.logging_task = asyncio.create_task(_log_data(device, interval_seconds, on_push, min_spacing_ms, compressor))
+    if on_push:
+        return Response(status_code=status.HTTP_200_OK,
+                        content=f"Started logging device pushes, polling if none arrive for {interval_seconds} seconds.")
     return Response(status_code=status.HTTP_200_OK, content=f"Started logging data every {interval_seconds} seconds.")
 
 @app.post('/logging/stop')
@@ -154,154 +448,385 @@ async def stop_logging(request: Request):
 
     app.state.stop_logging_event.set()
     await app.state.logging_task
+    await app.state.history_writer.flush()
     return Response(status_code=status.HTTP_200_OK, content="Stopped logging data.")
 
 @app.get('/logging/status')
 async def logging_status(request: Request):
     if app.state.logging_task and not app.state.logging_task.done():
-        return {"status": "running"}
-    return {"status": "stopped"}
+        return {"status": "running", **app.state.logging_stats}
+    return {"status": "stopped", **app.state.logging_stats}
 
-async def _log_data_periodically(interval_seconds: int):
-    while not app.state.stop_logging_event.is_set():
-        try:
-            state = await _get_latest_state()
-            if state and app.state.pool:
-                async with app.state.pool.acquire() as connection:
-                    await connection.execute("""
-                        INSERT INTO reclaim_state_history (mode, pump, "case", water, outlet, inlet, discharge, suction, evaporator, ambient, compspeed, waterspeed, fanspeed, power, current, hours, starts, boost)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18)
-                    """, state.mode, state.pump, state.case, state.water, state.outlet, state.inlet, state.discharge, state.suction, state.evaporator, state.ambient, state.compspeed, state.waterspeed, state.fanspeed, state.power, state.current, state.hours, state.starts, state.boost)
-            await asyncio.sleep(interval_seconds)
-        except asyncio.CancelledError:
-            _LOGGER.info("Logging task cancelled.")
-            break
-        except Exception as e:
-            _LOGGER.error(f"Error in logging task: {e}")
-            # Decide if the loop should continue or stop on error
-            await asyncio.sleep(interval_seconds)
+async def _log_data(device: Device, interval_seconds: int, on_push: bool, min_spacing_ms: int,
+                    compressor: Optional[HistoryCompressor] = None):
+    """Record full device states on wall-clock aligned ticks, or as the device pushes them.
+
+    With on_push, ticks only poll the device when no push was recorded during the
+    previous interval. Ticks that pass while a poll is still running are counted
+    as missed and skipped rather than run late, so polls stay on the grid. With a
+    compressor, only the rows it keeps are written.
+    """
+    stats = app.state.logging_stats = {"recorded": 0, "written": 0, "missed_ticks": 0}
+    stop = app.state.stop_logging_event
+    store = device.reclaimv2.store
+    last_recorded_ms = 0
+    next_tick = (time.time() // interval_seconds + 1) * interval_seconds
+
+    def record(state: ReclaimStateResponse) -> None:
+        nonlocal last_recorded_ms
+        last_recorded_ms = store.read_ms
+        stats["recorded"] += 1
+        row = history_row(store.read_ms, state)
+        write(compressor.add(row) if compressor else [row])
+
+    def write(rows: list[tuple]) -> None:
+        stats["written"] += len(rows)
+        for row in rows:
+            app.state.history_writer.put_row(row)
+
+    # polling never reads pushes, so it must not hold a queue that would fill up with them
+    with device.listener.subscribe() if on_push else nullcontext() as pushes:
+        while not stop.is_set():
+            try:
+                behind = time.time() - next_tick
+                if behind > 0:
+                    # every tick that passed during the last poll is skipped, not run late
+                    missed = int(behind // interval_seconds) + 1
+                    stats["missed_ticks"] += missed
+                    next_tick += missed * interval_seconds
+
+                pushed = await _wait_for_push(pushes, next_tick)
+                if stop.is_set():
+                    break
+
+                if pushed:
+                    # only full reads move read_ms, write acks are ignored
+                    if store.read_ms and store.read_ms - last_recorded_ms >= max(min_spacing_ms, 1):
+                        record(ReclaimStateResponse.from_state(store.state))
+                    continue
+
+                next_tick += interval_seconds
+                if not on_push or time.time() * 1000 - last_recorded_ms >= interval_seconds * 1000:
+                    state = await _get_latest_state(device)
+                    if state:
+                        record(state)
+            except asyncio.CancelledError:
+                _LOGGER.info("Logging task cancelled.")
+                break
+            except Exception as e:
+                _LOGGER.error(f"Error in logging task: {e}")
+
+    if compressor:
+        write(compressor.flush())
+
+async def _live_states(device: Device) -> AsyncIterator[Optional[ReclaimStateResponse]]:
+    """Yield the device's current state and then every complete state it pushes.
+
+    None is yielded after STREAM_KEEPALIVE_SECONDS without an update. The
+    iteration ends if the consumer falls STREAM_QUEUE_SIZE updates behind.
+    """
+    with device.listener.subscribe(STREAM_QUEUE_SIZE, drop_slow=True) as updates:
+        pending = device.listener.state
+        while True:
+            if pending is not None:
+                try:
+                    response = ReclaimStateResponse.from_state(pending)
+                except (ValueError, AttributeError):
+                    # a write ack before the first full read has nothing to show
+                    response = None
+                if response:
+                    yield response
+            try:
+                pending = await asyncio.wait_for(updates.get(), STREAM_KEEPALIVE_SECONDS)
+            except TimeoutError:
+                pending = None
+                yield None
+                continue
+            if pending is None:
+                _LOGGER.warning("Dropped a live stream client that fell behind")
+                return
+
+async def _wait_for_push(pushes: Optional[asyncio.Queue], deadline: float) -> bool:
+    """Wait until the wall-clock deadline, a push arrives or logging is stopped; True on a push."""
+    waiters = {asyncio.ensure_future(app.state.stop_logging_event.wait())}
+    if pushes:
+        get = asyncio.ensure_future(pushes.get())
+        waiters.add(get)
+    done, pending = await asyncio.wait(waiters, timeout=max(deadline - time.time(), 0),
+                                       return_when=asyncio.FIRST_COMPLETED)
+    for waiter in pending:
+        waiter.cancel()
+    return pushes is not None and get in done
 
 @app.post('/boost/on')
-async def boost_on(request: Request, response: Response) -> ReclaimBoostResponse:
-    error_response = await _validate_boost_toggle(BoostStatus.OFF)
+async def boost_on(request: Request, response: Response, device_id: Optional[int] = None) -> ReclaimBoostResponse:
+    device = _get_device(device_id)
+    error_response = await _validate_boost_toggle(device, BoostStatus.OFF)
     if error_response:
         response.status_code = error_response.status_code
+        BOOST_TOGGLES.labels('on', _boost_outcome(error_response)).inc()
         return error_response
 
-    toggle_response = await _perform_boost_toggle(BoostStatus.OFF)
+    toggle_response = await _perform_boost_toggle(device, BoostStatus.OFF)
     response.status_code = toggle_response.status_code
+    BOOST_TOGGLES.labels('on', _boost_outcome(toggle_response)).inc()
     return toggle_response
 
 @app.post('/boost/off')
-async def boost_off(request: Request, response: Response) -> ReclaimBoostResponse:
-    error_response = await _validate_boost_toggle(BoostStatus.ON)
+async def boost_off(request: Request, response: Response, device_id: Optional[int] = None) -> ReclaimBoostResponse:
+    device = _get_device(device_id)
+    error_response = await _validate_boost_toggle(device, BoostStatus.ON)
     if error_response:
         response.status_code = error_response.status_code
+        BOOST_TOGGLES.labels('off', _boost_outcome(error_response)).inc()
         return error_response
 
-    toggle_response = await _perform_boost_toggle(BoostStatus.ON)
+    toggle_response = await _perform_boost_toggle(device, BoostStatus.ON)
     response.status_code = toggle_response.status_code
+    BOOST_TOGGLES.labels('off', _boost_outcome(toggle_response)).inc()
     return toggle_response
 
 @app.get('/tables')
 async def get_tables(request: Request):
-    if not app.state.pool:
+    """Columns and types of every table, excluding partitions, cached until the schema version changes."""
+    store = app.state.store
+    if not store:
         return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Database not connected")
 
-    async with app.state.pool.acquire() as connection:
-        tables = await connection.fetch("""
-            SELECT tablename
-            FROM pg_catalog.pg_tables
-            WHERE schemaname != 'pg_catalog' AND schemaname != 'information_schema'
-        """)
-        
-        response = {}
-        for table in tables:
-            table_name = table['tablename']
-            columns = await connection.fetch(f"""
-                SELECT column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_name = '{table_name}'
-            """)
-            response[table_name] = {col['column_name']: col['data_type'] for col in columns}
-            
-        return response
+    cached = getattr(app.state, 'tables_cache', None)
+    if cached and cached[0] == (store, store.schema_version):
+        return cached[1]
 
-@app.get('/history/{start_timestamp_ms}/{end_timestamp_ms}')
-async def get_history(request: Request, start_timestamp_ms: int, end_timestamp_ms: int, sample_rate: Optional[int] = None):
-    if not app.state.pool:
-        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Database not connected")
+    with HISTORY_QUERY_SECONDS.labels('/tables', 'tables', 'store').time():
+        response = await store.tables()
+    app.state.tables_cache = ((store, store.schema_version), response)
+    return response
 
-    query = """
-        SELECT * FROM reclaim_state_history
-        WHERE timestamp_ms >= $1 AND timestamp_ms <= $2
+@app.get('/history/{start_timestamp_ms}/{end_timestamp_ms}')
+async def get_history(request: Request, response: Response, start_timestamp_ms: int, end_timestamp_ms: int,
+                      sample_rate: Optional[int] = None, bucket_ms: Optional[int] = None, max_points: Optional[int] = None,
+                      lttb: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                      stream: Optional[str] = None, export: Optional[str] = None, compression: Optional[str] = None,
+                      fields: Optional[str] = None, where: Annotated[list[str], Query()] = []):
+    """History between two timestamps as one list per column.
+
+    fields projects the result to a comma separated list of columns in SQL;
+    timestamp_ms and id (samples for buckets) are always included. Each where
+    parameter filters rows, e.g. where=boost=true or where=water<45.
+
+    With bucket_ms or max_points the range is aggregated in the database into
+    fixed-width time buckets: numeric columns come back as <column> (average),
+    <column>_min and <column>_max, pump and boost as whether they were on at all
+    and <column>_fraction. Unfiltered buckets of a minute or more have their edges
+    aligned to the coarsest rollup table that fits, which Postgres reads them
+    from. With lttb=<column> and max_points, raw rows are thinned to max_points
+    with Largest-Triangle-Three-Buckets on that column instead. Averages, samples
+    and fractions are per stored row, so over history logged with compress=true
+    they weight steady stretches, kept only as heartbeats, less than changing ones.
+
+    Ranges starting within the newest RECENT_HISTORY_ROWS rows are answered from
+    memory with the same results, and keep working while the database is down.
+
+    Every response carries the (timestamp_ms, id) of the newest row it covers in
+    an X-History-Cursor header. Passing that back as after= returns only the raw
+    rows since then (at most limit of them), with the cursor doubling as the
+    ETag, so a poll with a matching If-None-Match and nothing new gets a 304.
+
+    With stream=rows or stream=columns, raw rows are read through a database
+    cursor and sent as NDJSON as they arrive, either one object per row or one
+    object of column lists per block, so memory stays flat however long the
+    range. Streamed responses carry no cursor header.
+
+    With export=arrow or export=parquet, raw rows are streamed the same way as an
+    Arrow IPC stream or a Parquet file with typed columns, optionally compressed.
+    Exports contain exactly the requested fields.
     """
-    params = [start_timestamp_ms, end_timestamp_ms]
-
-    if sample_rate and sample_rate > 0:
-        query += f" AND id % {sample_rate} = 0"
-
-    query += " ORDER BY timestamp_ms"
+    if (bucket_ms is not None and bucket_ms <= 0) or (max_points is not None and max_points <= 0):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST, content="bucket_ms and max_points must be positive")
+    if limit is not None and limit <= 0:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST, content="limit must be positive")
+    if lttb is not None and (lttb not in NUMERIC_COLUMNS or max_points is None):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST,
+                        content=f"lttb needs max_points and one of {', '.join(NUMERIC_COLUMNS)}")
+    if after is not None:
+        cursor = _parse_cursor(after)
+        if cursor is None or any(p is not None for p in (sample_rate, bucket_ms, max_points, lttb)):
+            return Response(status_code=status.HTTP_400_BAD_REQUEST,
+                            content="after must be <timestamp_ms>:<id> and cannot be combined with downsampling")
+    if stream is not None and (stream not in HISTORY_STREAM_FORMATS or any(
+            p is not None for p in (bucket_ms, max_points, lttb, after))):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST,
+                        content=f"stream must be one of {', '.join(HISTORY_STREAM_FORMATS)} and only applies to raw rows")
+    if export is not None and (export not in history_export.MEDIA_TYPES or any(p is not None for p in (
+            sample_rate, bucket_ms, max_points, lttb, after, stream))):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST,
+                        content=f"export must be one of {', '.join(history_export.MEDIA_TYPES)} and only applies to raw rows")
+    if export is not None and compression not in history_export.COMPRESSIONS[export]:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST, content=f"Unknown {export} compression {compression}")
+
+    bucketed = lttb is None and (bucket_ms is not None or max_points is not None)
+    try:
+        if bucketed:
+            columns = history_query.parse_fields(fields, ('timestamp_ms', *STATE_COLUMNS))
+            columns = [column for column in columns if column != 'timestamp_ms']
+        elif export is not None:
+            columns = history_query.parse_fields(fields)
+        else:
+            columns = history_query.parse_fields(fields, required=('id', 'timestamp_ms', *([lttb] if lttb else [])))
+        filters = history_query.parse_filters(where)
+    except ValueError as e:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST, content=str(e))
 
-    async with app.state.pool.acquire() as connection:
-        records = await connection.fetch(query, *params)
-        if not records:
-            return {}
-        
-        result = {key: [] for key in records[0].keys()}
-        for record in records:
-            for key, value in record.items():
-                result[key].append(value)
-        return result
+    if (export is not None or stream is not None) and not app.state.store:
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Database not connected")
+    if export is not None:
+        return StreamingResponse(
+            _export_history(app.state.store.raw_blocks(start_timestamp_ms, end_timestamp_ms, columns, filters),
+                            columns, export, compression),
+            media_type=history_export.MEDIA_TYPES[export],
+            headers={'Content-Disposition': f'attachment; filename="history_{start_timestamp_ms}_{end_timestamp_ms}.{export}"'})
+    if after is not None:
+        return await _get_history_since(request, start_timestamp_ms, end_timestamp_ms, cursor, limit,
+                                        columns, filters)
+    if lttb is not None:
+        return await _get_history_lttb(start_timestamp_ms, end_timestamp_ms, max_points, lttb, columns, filters)
+    if bucketed:
+        origin = rollup.plan(start_timestamp_ms, end_timestamp_ms, bucket_ms, max_points, filtered=bool(filters))[1]
+        source = _history_source(origin)
+        with _query_timer('buckets', source):
+            records = await source.fetch_buckets(start_timestamp_ms, end_timestamp_ms, columns, filters,
+                                                bucket_ms, max_points)
+            newest = await source.newest(start_timestamp_ms, end_timestamp_ms)
+        if newest:
+            response.headers[CURSOR_HEADER] = _format_cursor(*newest)
+        return _columns(records)
+
+    if stream is not None:
+        blocks = app.state.store.raw_blocks(start_timestamp_ms, end_timestamp_ms, columns, filters, sample_rate,
+                                            block_rows=1000)
+        return StreamingResponse(_stream_history(blocks, stream), media_type='application/x-ndjson')
+
+    source = _history_source(start_timestamp_ms)
+    with _query_timer('raw', source):
+        records = await source.fetch_raw(start_timestamp_ms, end_timestamp_ms, columns, filters, sample_rate)
+    if not records:
+        return {}
+    if not sample_rate:
+        response.headers[CURSOR_HEADER] = _format_cursor(records[-1]['timestamp_ms'], records[-1]['id'])
+    return _columns(records)
+
+async def _stream_history(blocks: AsyncIterator[list], stream: str) -> AsyncIterator[bytes]:
+    """Yield NDJSON for blocks of records, holding one block at a time."""
+    async for records in blocks:
+        if stream == 'rows':
+            yield "".join(json.dumps(dict(record)) + "\n" for record in records).encode()
+        else:
+            yield (json.dumps(_columns(records)) + "\n").encode()
+
+async def _export_history(blocks: AsyncIterator[list], fields: list[str], export: str,
+                          compression: Optional[str]) -> AsyncIterator[bytes]:
+    async for chunk in history_export.encode(blocks, fields, export, compression):
+        yield chunk
+
+def _history_source(from_ms: int) -> HistoryStore | RecentHistory:
+    """The recent rows in memory when they hold everything from from_ms on, otherwise the store."""
+    if app.state.recent is not None and app.state.recent.covers(from_ms):
+        return app.state.recent
+    if not app.state.store:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database not connected")
+    return app.state.store
+
+def _query_timer(query: str, source: HistoryStore | RecentHistory):
+    return HISTORY_QUERY_SECONDS.labels('/history', query, 'memory' if source is app.state.recent else 'store').time()
+
+async def _get_history_since(request: Request, start_timestamp_ms: int, end_timestamp_ms: int,
+                             cursor: tuple[int, int], limit: Optional[int], columns: list[str],
+                             filters: list[history_query.Filter]) -> Response:
+    source = _history_source(max(start_timestamp_ms, cursor[0]))
+    with _query_timer('since', source):
+        records = await source.fetch_since(start_timestamp_ms, end_timestamp_ms, cursor, limit, columns, filters)
+    next_cursor = _format_cursor(records[-1]['timestamp_ms'], records[-1]['id']) if records else _format_cursor(*cursor)
+    headers = {CURSOR_HEADER: next_cursor, 'ETag': f'"{next_cursor}"'}
+    if not records and request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(jsonable_encoder(_columns(records)), headers=headers)
+
+def _parse_cursor(cursor: str) -> Optional[tuple[int, int]]:
+    try:
+        timestamp_ms, row_id = cursor.split(':')
+        return int(timestamp_ms), int(row_id)
+    except ValueError:
+        return None
+
+def _format_cursor(timestamp_ms: int, row_id: int) -> str:
+    return f"{timestamp_ms}:{row_id}"
+
+async def _get_history_lttb(start_timestamp_ms: int, end_timestamp_ms: int, max_points: int, column: str,
+                            columns: list[str], filters: list[history_query.Filter]):
+    source = _history_source(start_timestamp_ms)
+    with _query_timer('lttb', source):
+        records = await source.fetch_raw(start_timestamp_ms, end_timestamp_ms, columns, filters)
+    if not records:
+        return {}
+    data = _columns(records)
+    kept = downsample.lttb(np.array(data['timestamp_ms'], dtype=np.float64),
+                           np.array(data[column], dtype=np.float64), max_points)
+    return {key: [values[i] for i in kept] for key, values in data.items()}
+
+def _columns(records: list) -> dict:
+    """Transpose records into one list per column."""
+    if not records:
+        return {}
+    if isinstance(records, ColumnRecords):
+        return records.columns
+    return {key: [record[key] for record in records] for key in records[0].keys()}
 
 @app.post('/test_data/add')
 async def add_test_data(request: Request):
-    if not app.state.pool:
+    if not app.state.store:
         return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Database not connected")
 
-    async with app.state.pool.acquire() as connection:
-        # Insert a sample row of data
-        await connection.execute("""
-            INSERT INTO reclaim_state_history (mode, pump, "case", water, outlet, inlet, discharge, suction, evaporator, ambient, compspeed, waterspeed, fanspeed, power, current, hours, starts, boost)
-            VALUES ('heating', true, 45.1, 50.2, 55.3, 40.1, 60.5, 35.2, 5.1, 25.6, 3000, 100, 500, 1500, 6.5, 1234.5, 123, false)
-        """)
-        return Response(status_code=status.HTTP_201_CREATED, content="Test data added.")
+    # Insert a sample row of data
+    app.state.history_writer.put_row((int(time.time() * 1000), 'heating', True, 45.1, 50.2, 55.3, 40.1, 60.5, 35.2,
+                                      5.1, 25.6, 3000, 100, 500, 1500, 6.5, 1234.5, 123, False))
+    await app.state.history_writer.flush()
+    return Response(status_code=status.HTTP_201_CREATED, content="Test data added.")
 
 @app.delete('/test_data/delete/{start_id}/{end_id}')
 async def delete_test_data(request: Request, start_id: int, end_id: int):
-    if not app.state.pool:
+    if not app.state.store:
         return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Database not connected")
 
-    async with app.state.pool.acquire() as connection:
-        result = await connection.execute("DELETE FROM reclaim_state_history WHERE id >= $1 AND id <= $2", start_id, end_id)
-        
-        # The result format is 'DELETE count'. We parse the count.
-        try:
-            count = int(result.split(' ')[1])
-        except (IndexError, ValueError):
-            count = 0
-
-        if count > 0:
-            return Response(status_code=status.HTTP_200_OK, content=f"{count} records between id {start_id} and {end_id} deleted.")
-        else:
-            return Response(status_code=status.HTTP_404_NOT_FOUND, content=f"No records found between id {start_id} and {end_id}.")
-
-async def _get_latest_state() -> Optional[ReclaimStateResponse]:
-    if (await app.state.reclaimv2.request_update()):
-        return ReclaimStateResponse.from_state(app.state.listener.state)
-    return None
+    count = await app.state.store.delete(start_id, end_id)
+    app.state.recent.delete(start_id, end_id)
+    if count > 0:
+        return Response(status_code=status.HTTP_200_OK, content=f"{count} records between id {start_id} and {end_id} deleted.")
+    else:
+        return Response(status_code=status.HTTP_404_NOT_FOUND, content=f"No records found between id {start_id} and {end_id}.")
+
+def _get_device(device_id: Optional[int]) -> Device:
+    device = app.state.devices.get(app.state.default_device_id if device_id is None else device_id)
+    if device is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown device {device_id}.")
+    return device
+
+async def _get_latest_state(device: Device, max_age_ms: int = 0) -> Optional[ReclaimStateResponse]:
+    state = await device.state_cache.get(max_age_ms)
+    if state is None:
+        return None
+    return ReclaimStateResponse.from_state(state)
 
-async def _validate_boost_toggle(expected_initial_status: BoostStatus) -> Optional[ReclaimBoostResponse]:
+async def _validate_boost_toggle(device: Device, expected_initial_status: BoostStatus) -> Optional[ReclaimBoostResponse]:
     if expected_initial_status == BoostStatus.UNKNOWN:
         raise ValueError(f'Expected initial status is {expected_initial_status}')
     desired_final_status = BoostStatus.OFF if expected_initial_status == BoostStatus.ON else BoostStatus.ON
 
-    state = await _get_latest_state()
+    state = await _get_latest_state(device)
     if state is None:
         return ReclaimBoostResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                     initial_status=BoostStatus.UNKNOWN,
                                     final_status=BoostStatus.UNKNOWN,
-                                    detail=f'Failed to get current state; will not turn boost {desired_final_status}.')
+                                    detail=f'Failed to get current state; will not turn boost {desired_final_status.value}.')
 
     initial_status = BoostStatus.ON if state.boost else BoostStatus.OFF
 
@@ -309,7 +834,7 @@ async def _validate_boost_toggle(expected_initial_status: BoostStatus) -> Option
         return ReclaimBoostResponse(status_code=status.HTTP_409_CONFLICT,
                                     initial_status=initial_status,
                                     final_status=initial_status,
-                                    detail=f'Boost was already {desired_final_status}; will not turn boost {desired_final_status}.')
+                                    detail=f'Boost was already {desired_final_status.value}; will not turn boost {desired_final_status.value}.')
     elif desired_final_status == BoostStatus.ON:
         if state.pump or state.water > 55:
             return ReclaimBoostResponse(status_code=status.HTTP_409_CONFLICT,
@@ -319,12 +844,17 @@ async def _validate_boost_toggle(expected_initial_status: BoostStatus) -> Option
                                             if state.pump else 'Water temperature is over 55C; will not turn on boost.')
     return None
 
-async def _perform_boost_toggle(initial_status: BoostStatus) -> ReclaimBoostResponse:
+def _boost_outcome(response: ReclaimBoostResponse) -> str:
+    if response.status_code == status.HTTP_200_OK:
+        return 'success'
+    return 'rejected' if response.status_code == status.HTTP_409_CONFLICT else 'failed'
+
+async def _perform_boost_toggle(device: Device, initial_status: BoostStatus) -> ReclaimBoostResponse:
     if initial_status == BoostStatus.UNKNOWN:
         raise Exception('Cannot toggle boost because current state is unknown.')
     desired_final_status = BoostStatus.OFF if initial_status == BoostStatus.ON else BoostStatus.ON
-    await app.state.reclaimv2.set_value("boost", desired_final_status == BoostStatus.ON)
-    state = await _get_latest_state()
+    await device.reclaimv2.set_value("boost", desired_final_status == BoostStatus.ON)
+    state = await _get_latest_state(device)
 
     if state is None:
         return ReclaimBoostResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,180 @@
+"""Counters and histograms rendered in the Prometheus text exposition format.
+
+Metrics are only updated from the event loop thread, so values are plain
+numbers with no locks; observing a histogram is a bisect and three additions.
+Values owned elsewhere, like queue depths and the MQTT client's running
+totals, are read by a callback when /metrics is scraped instead of being
+mirrored on every change.
+"""
+import bisect
+import math
+from abc import ABC, abstractmethod
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Seconds, from sub-millisecond memory reads to MQTT round trips at the request timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_METRICS: list["Metric"] = []
+
+
+class Metric(ABC):
+    """A named metric rendered as the samples it yields."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        _METRICS.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """(name, labels, value) of every sample to render."""
+
+
+class _Instrumented(Metric):
+    """A metric updated in place, with one child per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}")
+            child = self._children[values] = self._child()
+        return child
+
+    @abstractmethod
+    def _child(self):
+        """A new child holding the values for one combination of labels."""
+
+
+class Counter(_Instrumented):
+    kind = 'counter'
+
+    class Child:
+        __slots__ = ('value',)
+
+        def __init__(self) -> None:
+            self.value = 0.0
+
+        def inc(self, amount: float = 1.0) -> None:
+            self.value += amount
+
+    def _child(self) -> "Counter.Child":
+        return Counter.Child()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for values, child in self._children.items():
+            yield f"{self.name}_total", dict(zip(self.label_names, values)), child.value
+
+
+class Histogram(_Instrumented):
+    kind = 'histogram'
+
+    class Child:
+        __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+        def __init__(self, bounds: tuple[float, ...]) -> None:
+            self.bounds = bounds
+            # per-bucket counts, made cumulative only when rendered
+            self.counts = [0] * (len(bounds) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+        def observe(self, value: float) -> None:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+
+        @contextmanager
+        def time(self) -> Iterator[None]:
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - started)
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self) -> "Histogram.Child":
+        return Histogram.Child(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for values, child in self._children.items():
+            labels = dict(zip(self.label_names, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, 'le': _format(bound)}, cumulative
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+
+class Collected(Metric):
+    """A metric whose values are read by collect() at scrape time, keyed by label values.
+
+    The sample names follow kind: counters get _total, summaries are given
+    (sum, count) pairs and get _sum and _count.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, collect: Callable[[], dict],
+                 labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for values, value in self.collect().items():
+            labels = dict(zip(self.label_names, values))
+            if self.kind == 'counter':
+                yield f"{self.name}_total", labels, value
+            elif self.kind == 'summary':
+                yield f"{self.name}_sum", labels, value[0]
+                yield f"{self.name}_count", labels, value[1]
+            else:
+                yield self.name, labels, value
+
+
+def render() -> str:
+    """Every metric in the text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if labels:
+                rendered = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+                lines.append(f"{name}{{{rendered}}} {_format(value)}")
+            else:
+                lines.append(f"{name} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(label: str) -> str:
+    return label.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
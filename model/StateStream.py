@@ -0,0 +1,78 @@
+import json
+import struct
+from typing import Optional
+
+from custom_components.reclaimenergy.reclaimv2 import ReclaimState
+from .ReclaimStateResponse import ReclaimStateResponse
+
+# struct format of each field in a binary frame; mode is sent as its index in ReclaimState.modes
+_BINARY_FORMATS = {
+    "mode": "B",
+    "pump": "?",
+    "compspeed": "i",
+    "waterspeed": "i",
+    "fanspeed": "i",
+    "power": "i",
+    "boost": "?",
+}
+_UNKNOWN_MODE = 255
+
+
+class StateStream:
+    """Turns the successive states of one device into frames for a live client.
+
+    The first frame holds every field and later frames only the fields that
+    changed; an unchanged state produces no frame. JSON frames are objects with
+    timestamp_ms and the changed fields. Binary frames are little-endian: the
+    int64 timestamp_ms, a uint32 with bit i set when field i of FIELDS changed,
+    then each changed field in FIELDS order (mode as a uint8 index into
+    ReclaimState.modes, bools as uint8, int fields as int32, the rest float32).
+    """
+
+    FIELDS = tuple(ReclaimStateResponse.model_fields)
+    FORMATS = tuple(_BINARY_FORMATS.get(field, "f") for field in FIELDS)
+
+    def __init__(self) -> None:
+        self._last: dict = {}
+
+    def diff(self, state: ReclaimStateResponse) -> dict:
+        """Fields of state that differ from the previous one, all of them the first time."""
+        current = state.model_dump()
+        changes = {field: value for field, value in current.items() if self._last.get(field, self) != value}
+        self._last = current
+        return changes
+
+    def json_frame(self, timestamp_ms: int, state: ReclaimStateResponse) -> Optional[str]:
+        changes = self.diff(state)
+        return json.dumps({"timestamp_ms": timestamp_ms, **changes}) if changes else None
+
+    def binary_frame(self, timestamp_ms: int, state: ReclaimStateResponse) -> Optional[bytes]:
+        changes = self.diff(state)
+        if not changes:
+            return None
+        mask, formats, values = 0, "<qI", [timestamp_ms]
+        for i, (field, fmt) in enumerate(zip(self.FIELDS, self.FORMATS)):
+            if field in changes:
+                mask |= 1 << i
+                formats += fmt
+                values.append(self._binary_value(field, changes[field]))
+        return struct.pack(formats, values[0], mask, *values[1:])
+
+    @classmethod
+    def decode_binary(cls, frame: bytes) -> dict:
+        """Inverse of binary_frame, for clients and tests."""
+        timestamp_ms, mask = struct.unpack_from("<qI", frame)
+        fields = [field for i, field in enumerate(cls.FIELDS) if mask >> i & 1]
+        formats = "".join(fmt for field, fmt in zip(cls.FIELDS, cls.FORMATS) if field in fields)
+        values = struct.unpack_from("<" + formats, frame, struct.calcsize("<qI"))
+        decoded = dict(zip(fields, values))
+        if "mode" in decoded:
+            modes = ReclaimState.modes
+            decoded["mode"] = modes[decoded["mode"]] if decoded["mode"] < len(modes) else None
+        return {"timestamp_ms": timestamp_ms, **decoded}
+
+    @staticmethod
+    def _binary_value(field: str, value):
+        if field == "mode":
+            return ReclaimState.modes.index(value) if value in ReclaimState.modes else _UNKNOWN_MODE
+        return value
@@ -1,2 +1,3 @@
 from .ReclaimStateResponse import ReclaimStateResponse
-from .ReclaimBoostResponse import ReclaimBoostResponse, BoostStatus
\ No newline at end of file
+from .ReclaimBoostResponse import ReclaimBoostResponse, BoostStatus
+from .StateStream import StateStream
\ No newline at end of file
@@ -1,7 +1,11 @@
+import sys
+
 import matplotlib.pyplot as plt
-import pandas as pd
 
-data = pd.read_csv('output.csv')
+from storage.export import read_history
+
+# an export from `python -m storage.export` or /history?export=parquet
+data = read_history(sys.argv[1] if len(sys.argv) > 1 else 'output.parquet')
 cols = data.columns
 
 
@@ -12,11 +16,7 @@ plt.plot(data['timestamp_ms'], data['discharge'])
 plt.legend(['outlet', 'discharge'])
 plt.ylim([0, 100])
 plt.yticks(list(range(0, 105, 5)))
-plt.plot(data['timestamp_ms'], [int(b=='t') for b in list(data['boost'])])
-plt.plot(data['timestamp_ms'], [int(b=='t')*2 for b in list(data['boost'])])
+plt.plot(data['timestamp_ms'], data['boost'].fillna(False).astype(int))
+plt.plot(data['timestamp_ms'], data['boost'].fillna(False).astype(int) * 2)
 
 plt.show()
-
-
-
-
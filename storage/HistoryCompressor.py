@@ -0,0 +1,106 @@
+from typing import Optional
+
+from .const import HISTORY_COLUMNS
+
+# Allowed interpolation error per column; None means the value must match exactly
+DEFAULT_DEADBANDS = {
+    "mode": None,
+    "pump": None,
+    "case": 0.5,
+    "water": 0.5,
+    "outlet": 0.5,
+    "inlet": 0.5,
+    "discharge": 0.5,
+    "suction": 0.5,
+    "evaporator": 0.5,
+    "ambient": 0.5,
+    "compspeed": 50,
+    "waterspeed": 50,
+    "fanspeed": 50,
+    "power": 50,
+    "current": 0.2,
+    "hours": 1,
+    "starts": None,
+    "boost": None,
+}
+
+
+class HistoryCompressor:
+    """Swinging-door compression of one series of history rows.
+
+    Rows are tuples in HISTORY_COLUMNS order. A row is only kept when linear
+    interpolation between the kept rows either side of it would move a column
+    further than its deadband, when it or the row before it is either side of a
+    change in an exact column, or when heartbeat_ms has passed since the last
+    kept row. Every dropped row can therefore be
+    rebuilt from the kept ones within tolerance.
+    """
+
+    def __init__(self, deadbands: Optional[dict] = None, heartbeat_ms: int = 15 * 60 * 1000):
+        deadbands = DEFAULT_DEADBANDS if deadbands is None else deadbands
+        self.heartbeat_ms = heartbeat_ms
+        self._linear = [(i, deadbands[column]) for i, column in enumerate(HISTORY_COLUMNS)
+                        if i and deadbands.get(column) is not None]
+        self._exact = [i for i, column in enumerate(HISTORY_COLUMNS)
+                       if i and deadbands.get(column) is None]
+        self._archived: Optional[tuple] = None
+        self._held: Optional[tuple] = None
+        # per linear column, the range of slopes from the archived row that keeps
+        # every row since then within its deadband
+        self._doors: list[list[float]] = []
+
+    def add(self, row: tuple) -> list[tuple]:
+        """Feed the next row in time order, returning the rows to persist."""
+        if self._archived is None:
+            return self._archive(row)
+        if row[0] <= (self._held or self._archived)[0]:
+            # out of order or repeated timestamp
+            return []
+
+        last = self._held or self._archived
+        if any(row[i] != last[i] for i in self._exact):
+            # a step: keep the last row before it and the first row after it
+            held = self._archive(self._held) if self._held is not None else []
+            return held + self._archive(row)
+        if self._held is not None and not self._fits(row):
+            return self._archive(self._held) + self.add(row)
+        if row[0] - self._archived[0] >= self.heartbeat_ms:
+            return self._archive(row)
+
+        self._narrow(row)
+        self._held = row
+        return []
+
+    def flush(self) -> list[tuple]:
+        """End the series, returning the last row if it has not been kept yet."""
+        rows = [self._held] if self._held is not None else []
+        self._archived = self._held = None
+        return rows
+
+    def _archive(self, row: tuple) -> list[tuple]:
+        self._archived = row
+        self._held = None
+        self._doors = [[float("-inf"), float("inf")] for _ in self._linear]
+        return [row]
+
+    def _fits(self, row: tuple) -> bool:
+        """True if the line from the archived row to row passes every row in between."""
+        archived = self._archived
+        elapsed = row[0] - archived[0]
+        for (i, _), (low, high) in zip(self._linear, self._doors):
+            if row[i] is None or archived[i] is None:
+                if row[i] is not archived[i]:
+                    return False
+                continue
+            if not low <= (row[i] - archived[i]) / elapsed <= high:
+                return False
+        return True
+
+    def _narrow(self, row: tuple) -> None:
+        archived = self._archived
+        elapsed = row[0] - archived[0]
+        for (i, deadband), door in zip(self._linear, self._doors):
+            if row[i] is None or archived[i] is None:
+                continue
+            door[0] = max(door[0], (row[i] - deadband - archived[i]) / elapsed)
+            door[1] = min(door[1], (row[i] + deadband - archived[i]) / elapsed)
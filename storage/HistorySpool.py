@@ -0,0 +1,153 @@
+import os
+import struct
+from typing import Iterable
+
+from .const import STATE_COLUMNS
+from .query import FILTER_TYPES
+
+# struct format of each column after mode; nulls are written as zero with their bit set in the null mask
+_VALUE_FORMAT = "<" + "".join({bool: "?", int: "q", float: "d"}[FILTER_TYPES[column]]
+                              for column in STATE_COLUMNS[1:])
+_ZEROS = {bool: False, int: 0, float: 0.0}
+_DEFAULTS = tuple(_ZEROS[FILTER_TYPES[column]] for column in STATE_COLUMNS[1:])
+_HEADER = struct.Struct("<qqIH")
+_LENGTH = struct.Struct("<I")
+_VALUES = struct.Struct(_VALUE_FORMAT)
+
+
+def encode_row(row: tuple) -> bytes:
+    """A row in RAW_FIELDS order as one length-prefixed spool record.
+
+    The record is the little-endian int64 id and timestamp_ms, a uint32 with
+    bit i set when STATE_COLUMNS[i] is null, the uint16 length and UTF-8 bytes
+    of mode, then the remaining columns as bool, int64 or float64.
+    """
+    row_id, timestamp_ms, mode, *values = row
+    nulls = 0
+    for i, value in enumerate((mode, *values)):
+        if value is None:
+            nulls |= 1 << i
+    mode_bytes = b"" if mode is None else mode.encode()
+    body = (_HEADER.pack(row_id, timestamp_ms, nulls, len(mode_bytes)) + mode_bytes
+            + _VALUES.pack(*(default if value is None else value for value, default in zip(values, _DEFAULTS))))
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_row(body: bytes) -> tuple:
+    row_id, timestamp_ms, nulls, mode_length = _HEADER.unpack_from(body)
+    mode = body[_HEADER.size:_HEADER.size + mode_length].decode()
+    values = _VALUES.unpack_from(body, _HEADER.size + mode_length)
+    state = [None if nulls >> i & 1 else value for i, value in enumerate((mode, *values))]
+    return (row_id, timestamp_ms, *state)
+
+
+class HistorySpool:
+    """Append-only file of history rows that could not be written to the store.
+
+    Rows are appended as length-prefixed records (see encode_row) and fsynced,
+    so a crash can at worst leave a torn final record, which is truncated when
+    the spool is next opened. A sidecar file <path>.last_id holds the highest row id
+    ever handed out, so ids stay unique across restarts while the store is
+    unreachable. It is only written once ids are known to continue the
+    store's, so without it spooled ids may collide with stored rows and have
+    to be renumbered before they are replayed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._size = self._truncate_torn() if os.path.exists(path) else 0
+
+    def _truncate_torn(self) -> int:
+        """Cut off a record torn by a crash, so appends follow the last complete one; returns the new size."""
+        end = 0
+        with open(self.path, "r+b") as spool:
+            while True:
+                prefix = spool.read(_LENGTH.size)
+                if len(prefix) < _LENGTH.size:
+                    break
+                (length,) = _LENGTH.unpack(prefix)
+                if len(spool.read(length)) < length:
+                    break
+                end += _LENGTH.size + length
+            spool.truncate(end)
+        return end
+
+    @property
+    def pending(self) -> bool:
+        return self._size > 0
+
+    @property
+    def size(self) -> int:
+        """Bytes of rows waiting to be replayed."""
+        return self._size
+
+    def append(self, rows: Iterable[tuple]) -> None:
+        data = b"".join(encode_row(row) for row in rows)
+        with open(self.path, "ab") as spool:
+            spool.write(data)
+            spool.flush()
+            os.fsync(spool.fileno())
+        self._size += len(data)
+
+    def read(self, offset: int, max_rows: int) -> tuple[list[tuple], int]:
+        """Up to max_rows complete records from offset, and the offset after them."""
+        rows = []
+        with open(self.path, "rb") as spool:
+            spool.seek(offset)
+            while len(rows) < max_rows:
+                prefix = spool.read(_LENGTH.size)
+                if len(prefix) < _LENGTH.size:
+                    break
+                (length,) = _LENGTH.unpack(prefix)
+                body = spool.read(length)
+                if len(body) < length:
+                    break
+                rows.append(decode_row(body))
+                offset += _LENGTH.size + length
+        return rows, offset
+
+    def renumber(self, shift: int) -> None:
+        """Add shift to the id of every spooled row, replacing the spool atomically."""
+        temporary = self.path + ".tmp"
+        offset = 0
+        with open(temporary, "wb") as renumbered:
+            while True:
+                rows, offset = self.read(offset, 10000)
+                if not rows:
+                    break
+                renumbered.write(b"".join(encode_row((row[0] + shift, *row[1:])) for row in rows))
+            renumbered.flush()
+            os.fsync(renumbered.fileno())
+        os.replace(temporary, self.path)
+        self._size = os.path.getsize(self.path)
+
+    def clear(self) -> None:
+        with open(self.path, "wb"):
+            pass
+        self._size = 0
+
+    @property
+    def has_last_id(self) -> bool:
+        """Whether save_last_id has recorded ids that continue the store's."""
+        return os.path.exists(self.path + ".last_id")
+
+    def last_id(self) -> int:
+        """The highest id recorded by save_last_id or spooled, 0 if none."""
+        try:
+            with open(self.path + ".last_id") as saved:
+                last_id = int(saved.read())
+        except (OSError, ValueError):
+            last_id = 0
+        offset = 0
+        while self.pending:
+            rows, offset = self.read(offset, 10000)
+            if not rows:
+                break
+            last_id = max(last_id, max(row[0] for row in rows))
+        return last_id
+
+    def save_last_id(self, last_id: int) -> None:
+        temporary = self.path + ".last_id.tmp"
+        with open(temporary, "w") as saved:
+            saved.write(str(last_id))
+        os.replace(temporary, self.path + ".last_id")
@@ -0,0 +1,69 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+
+from .query import Filter
+
+
+class HistoryStore(ABC):
+    """Where history rows are written and how /history reads them back.
+
+    Rows are written in RAW_FIELDS order, with ids allocated by the writer
+    counting on from last_id(). Reads take an inclusive timestamp_ms range, the
+    columns to return and parsed filters, and return records that can be
+    indexed by column name and have keys() and values() in the requested
+    column order. Raw rows always come back in (timestamp_ms, id) order.
+    """
+
+    schema_version: Optional[int] = None
+
+    @abstractmethod
+    async def open(self, read_only: bool = False) -> None:
+        """Create or migrate the schema, setting schema_version.
+
+        With read_only the schema is left as it is and only schema_version is
+        read, for tools that must not change the database they read from.
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+    @abstractmethod
+    async def write(self, rows: list[tuple]) -> None:
+        """Insert a batch of rows atomically."""
+
+    @abstractmethod
+    async def last_id(self) -> int:
+        """The highest id handed out so far, 0 for an empty history."""
+
+    @abstractmethod
+    async def fetch_raw(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                        sample_rate: Optional[int] = None) -> list:
+        """Raw rows in the range, only those whose id is a multiple of sample_rate if given."""
+
+    @abstractmethod
+    def raw_blocks(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                   sample_rate: Optional[int] = None, block_rows: int = 10000) -> AsyncIterator[list]:
+        """fetch_raw as blocks of up to block_rows records, read without holding the whole range."""
+
+    @abstractmethod
+    async def fetch_since(self, start_ms: int, end_ms: int, cursor: tuple[int, int], limit: Optional[int],
+                          fields: list[str], filters: list[Filter]) -> list:
+        """Raw rows in the range after the (timestamp_ms, id) cursor, at most limit of them."""
+
+    @abstractmethod
+    async def fetch_buckets(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                            bucket_ms: Optional[int], max_points: Optional[int]) -> list:
+        """Rows in the range aggregated into buckets with the columns of downsample.bucket_query."""
+
+    @abstractmethod
+    async def newest(self, start_ms: int, end_ms: int) -> Optional[tuple[int, int]]:
+        """(timestamp_ms, id) of the newest row in the range."""
+
+    @abstractmethod
+    async def tables(self) -> dict[str, dict[str, str]]:
+        """Columns and their types of every table, by table name."""
+
+    @abstractmethod
+    async def delete(self, start_id: int, end_id: int) -> int:
+        """Delete rows with ids in the inclusive range, returning how many were deleted."""
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+from metrics import Counter, Histogram
+from model import ReclaimStateResponse
+from .const import STATE_COLUMNS
+from .HistorySpool import HistorySpool
+from .HistoryStore import HistoryStore
+from .RecentHistory import RecentHistory
+
+_LOGGER = logging.getLogger(__name__)
+
+WRITE_SECONDS = Histogram('reclaim_history_write_seconds', "Time to write one batch of history rows to the store",
+                          ('outcome',))
+ROWS = Counter('reclaim_history_rows', "History rows by where they went: written, spooled or dropped",
+               ('destination',))
+
+
+def history_row(timestamp_ms: int, state: ReclaimStateResponse) -> tuple:
+    """Flatten a state into a row in HISTORY_COLUMNS order."""
+    return (timestamp_ms, *(getattr(state, column) for column in STATE_COLUMNS))
+
+
+class HistoryWriter:
+    """Buffers history samples and writes them to the store in batches.
+
+    Rows are flushed once max_rows are pending or every flush_interval seconds,
+    whichever comes first. Each batch is one store write, e.g. a COPY and a
+    rollup update in one transaction for Postgres.
+
+    Every row is given its id as it is queued, so rows can be handed to recent
+    straight away with the id they will have in the store.
+
+    With a spool, batches that cannot be written, or arrive while store is None,
+    are appended to it instead of being dropped. Later batches are spooled
+    behind them until the spool has been replayed into the store in blocks of
+    replay_rows, retried with exponential backoff, so the store only ever sees
+    ids in increasing order and rows already written by an interrupted replay
+    can be skipped by comparing with its last_id().
+
+    Started without a store or a saved last id, ids begin after the highest
+    spooled one and may collide with rows the store already holds. attach()
+    shifts spooled, pending and recent rows past the store's last id before
+    any of them are written.
+    """
+
+    replay_rows = 10000
+    max_retry_delay = 300.0
+
+    def __init__(self, store: Optional[HistoryStore], max_rows: int = 500, flush_interval: float = 5.0,
+                 recent: Optional[RecentHistory] = None, spool: Optional[HistorySpool] = None):
+        self.store = store
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.recent = recent
+        self.spool = spool
+        self._rows: list[tuple] = []
+        self._next_id = 1
+        # whether ids are known to continue the store's, rather than guessed from the spool
+        self._synced = store is not None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # one flush at a time, so batches reach the store or the spool in id order
+        self._flushing = asyncio.Lock()
+        self._retry_delay = flush_interval
+        self._retry_at = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    async def start(self) -> None:
+        last_id = self.spool.last_id() if self.spool else 0
+        if self.store:
+            last_id = max(last_id, await self.store.last_id())
+        elif self.spool:
+            self._synced = self.spool.has_last_id
+        self._next_id = last_id + 1
+        self._task = asyncio.create_task(self._run())
+
+    async def attach(self, store: HistoryStore) -> None:
+        """Write to store from now on, continuing its ids so no queued or spooled row collides with its rows."""
+        async with self._flushing:
+            last_id = await store.last_id()
+            if not self._synced:
+                spooled = []
+                if self.spool and self.spool.pending:
+                    spooled, _ = await asyncio.to_thread(self.spool.read, 0, 1)
+                first_id = (spooled or self._rows or [(self._next_id,)])[0][0]
+                shift = last_id + 1 - first_id
+                if shift > 0:
+                    _LOGGER.warning(f"Spooled history ids from {first_id} collide with stored rows, "
+                                    f"renumbering them from {last_id + 1}")
+                    if spooled:
+                        await asyncio.to_thread(self.spool.renumber, shift)
+                    # rows queued while the spool was rewritten are shifted along with the rest
+                    self._rows = [(row[0] + shift, *row[1:]) for row in self._rows]
+                    if self.recent is not None:
+                        self.recent.renumber(first_id, shift)
+                    self._next_id += shift
+                if self.spool:
+                    await asyncio.to_thread(self.spool.save_last_id, self._next_id - 1)
+                self._synced = True
+            self._next_id = max(self._next_id, last_id + 1)
+            self.store = store
+
+    async def close(self) -> None:
+        """Stop the background flusher and write everything still pending."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def put(self, timestamp_ms: int, state: ReclaimStateResponse) -> None:
+        self.put_row(history_row(timestamp_ms, state))
+
+    def put_row(self, row: tuple) -> None:
+        """Queue a row already in HISTORY_COLUMNS order."""
+        row = (self._next_id, *row)
+        self._next_id += 1
+        self._rows.append(row)
+        if self.recent is not None:
+            self.recent.append(row)
+        if len(self._rows) >= self.max_rows:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write all pending rows, and any spooled rows once the store takes them, returning how many were written."""
+        async with self._flushing:
+            rows, self._rows = self._rows, []
+            written = await self._write(rows) if rows else 0
+            if self.spool and self.spool.pending and self.store and time.monotonic() >= self._retry_at:
+                written += await self._replay()
+            return written
+
+    async def _write(self, rows: list[tuple]) -> int:
+        if self.spool:
+            if self._synced:
+                await asyncio.to_thread(self.spool.save_last_id, rows[-1][0])
+            if not self.store or self.spool.pending:
+                await self._spool(rows)
+                return 0
+        elif not self.store:
+            _LOGGER.error(f"No history store, dropping {len(rows)} rows")
+            ROWS.labels('dropped').inc(len(rows))
+            return 0
+        try:
+            await self._write_store(rows)
+        except Exception as e:
+            if not self.spool:
+                _LOGGER.error(f"Failed to write {len(rows)} history rows: {e}")
+                ROWS.labels('dropped').inc(len(rows))
+                return 0
+            _LOGGER.warning(f"Failed to write {len(rows)} history rows, spooling them to {self.spool.path}: {e}")
+            await self._spool(rows)
+            self._back_off()
+            return 0
+        return len(rows)
+
+    async def _write_store(self, rows: list[tuple]) -> None:
+        started = time.perf_counter()
+        try:
+            await self.store.write(rows)
+        except Exception:
+            WRITE_SECONDS.labels('error').observe(time.perf_counter() - started)
+            raise
+        WRITE_SECONDS.labels('ok').observe(time.perf_counter() - started)
+        ROWS.labels('written').inc(len(rows))
+
+    async def _spool(self, rows: list[tuple]) -> None:
+        await asyncio.to_thread(self.spool.append, rows)
+        ROWS.labels('spooled').inc(len(rows))
+
+    async def _replay(self) -> int:
+        written = 0
+        try:
+            last_id = await self.store.last_id()
+            offset = 0
+            while True:
+                rows, offset = await asyncio.to_thread(self.spool.read, offset, self.replay_rows)
+                if not rows:
+                    break
+                rows = [row for row in rows if row[0] > last_id]
+                if rows:
+                    await self._write_store(rows)
+                    written += len(rows)
+        except Exception as e:
+            delay = self._back_off()
+            _LOGGER.warning(f"Failed to replay spooled history rows, retrying in {delay:.0f}s: {e}")
+            return written
+        await asyncio.to_thread(self.spool.clear)
+        self._retry_delay = self.flush_interval
+        _LOGGER.info(f"Replayed {written} spooled history rows")
+        return written
+
+    def _back_off(self) -> float:
+        """Hold off replaying for the next, doubled, retry delay, returning it."""
+        # jittered so a fleet of loggers does not retry in lockstep
+        delay = self._retry_delay * random.uniform(0.5, 1.0)
+        self._retry_at = time.monotonic() + delay
+        self._retry_delay = min(self._retry_delay * 2, self.max_retry_delay)
+        return delay
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            # shield so a close() mid-write cannot lose the batch being written
+            await asyncio.shield(self.flush())
@@ -0,0 +1,145 @@
+import time
+from typing import AsyncIterator, Optional
+
+import asyncpg
+
+from . import downsample, rollup
+from .const import HISTORY_TABLE
+from .HistoryStore import HistoryStore
+from .migrations import ensure_partitions, migrate, month_bounds, schema_version
+from .query import RAW_FIELDS, Filter, compile_filters, select_raw
+
+# Every table outside the $1 schemas with its columns in order, in one round trip
+TABLES_QUERY = """
+    SELECT t.relname AS table_name, c.column_name, c.data_type
+    FROM pg_catalog.pg_class t
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+    LEFT JOIN information_schema.columns c ON c.table_schema = n.nspname AND c.table_name = t.relname
+    WHERE t.relkind IN ('r', 'p') AND NOT t.relispartition AND n.nspname <> ALL($1::text[])
+    ORDER BY t.relname, c.ordinal_position
+"""
+NEWEST_ROW_QUERY = f"""
+    SELECT timestamp_ms, id FROM {HISTORY_TABLE}
+    WHERE timestamp_ms >= $1 AND timestamp_ms <= $2
+    ORDER BY timestamp_ms DESC, id DESC
+    LIMIT 1
+"""
+ID_SEQUENCE = f"{HISTORY_TABLE}_id_seq"
+
+
+class PostgresStore(HistoryStore):
+    """History in the monthly partitioned Postgres table, with rollup tables for bucketed reads.
+
+    Writes COPY the batch and fold it into the rollups in one transaction,
+    creating any missing monthly partitions first.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        # start of every month already known to have a partition
+        self._months: set[int] = set()
+
+    async def open(self, read_only: bool = False) -> None:
+        async with self.pool.acquire() as connection:
+            if read_only:
+                self.schema_version = await schema_version(connection)
+                return
+            self.schema_version = await migrate(connection)
+            # make sure this month and the next can be written
+            now_ms = int(time.time() * 1000)
+            await ensure_partitions(connection, now_ms, month_bounds(now_ms)[1])
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def write(self, rows: list[tuple]) -> None:
+        async with self.pool.acquire() as connection:
+            await self._ensure_partitions(connection, rows)
+            async with connection.transaction():
+                await connection.copy_records_to_table(HISTORY_TABLE, records=rows, columns=RAW_FIELDS)
+                # keep the sequence ahead of the ids written for anything still inserting without one
+                await connection.execute(f"SELECT setval('{ID_SEQUENCE}', greatest(last_value, $1)) FROM {ID_SEQUENCE}",
+                                         max(row[0] for row in rows))
+                await rollup.update_rollups(connection, [row[1:] for row in rows])
+
+    async def last_id(self) -> int:
+        async with self.pool.acquire() as connection:
+            return await connection.fetchval(f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {ID_SEQUENCE}")
+
+    async def fetch_raw(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                        sample_rate: Optional[int] = None) -> list:
+        query, params = self._select_raw(start_ms, end_ms, fields, filters, sample_rate)
+        async with self.pool.acquire() as connection:
+            return await connection.fetch(query, *params)
+
+    async def raw_blocks(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                         sample_rate: Optional[int] = None, block_rows: int = 10000) -> AsyncIterator[list]:
+        query, params = self._select_raw(start_ms, end_ms, fields, filters, sample_rate)
+        async with self.pool.acquire() as connection:
+            # server-side cursors only live inside a transaction
+            async with connection.transaction():
+                cursor = await connection.cursor(query, *params)
+                while records := await cursor.fetch(block_rows):
+                    yield records
+
+    async def fetch_since(self, start_ms: int, end_ms: int, cursor: tuple[int, int], limit: Optional[int],
+                          fields: list[str], filters: list[Filter]) -> list:
+        conditions, params = compile_filters(filters, 6)
+        async with self.pool.acquire() as connection:
+            # the plain timestamp bound lets the planner range-scan the timestamp index
+            return await connection.fetch(f"""
+                SELECT {", ".join(f'"{field}"' for field in fields)} FROM {HISTORY_TABLE}
+                WHERE timestamp_ms >= greatest($1::bigint, $3::bigint) AND timestamp_ms <= $2
+                    AND (timestamp_ms, id) > ($3, $4){conditions}
+                ORDER BY timestamp_ms, id
+                LIMIT $5
+            """, start_ms, end_ms, *cursor, limit, *params)
+
+    async def fetch_buckets(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                            bucket_ms: Optional[int], max_points: Optional[int]) -> list:
+        conditions, params = compile_filters(filters, 4)
+        tier, origin, width = rollup.plan(start_ms, end_ms, bucket_ms, max_points, filtered=bool(filters))
+        query = rollup.query(tier, fields) if tier else downsample.bucket_query(fields, conditions)
+        async with self.pool.acquire() as connection:
+            return await connection.fetch(query, origin, end_ms, width, *params)
+
+    async def newest(self, start_ms: int, end_ms: int) -> Optional[tuple[int, int]]:
+        async with self.pool.acquire() as connection:
+            row = await connection.fetchrow(NEWEST_ROW_QUERY, start_ms, end_ms)
+        return (row['timestamp_ms'], row['id']) if row else None
+
+    async def tables(self) -> dict[str, dict[str, str]]:
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(TABLES_QUERY, ['pg_catalog', 'information_schema'])
+        tables = {}
+        for row in rows:
+            columns = tables.setdefault(row['table_name'], {})
+            if row['column_name'] is not None:
+                columns[row['column_name']] = row['data_type']
+        return tables
+
+    async def delete(self, start_id: int, end_id: int) -> int:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                deleted = await connection.fetch(
+                    f"DELETE FROM {HISTORY_TABLE} WHERE id >= $1 AND id <= $2 RETURNING timestamp_ms",
+                    start_id, end_id)
+                # the rollups still count the deleted rows until their buckets are rebuilt
+                await rollup.rebuild_rollups(connection, (record['timestamp_ms'] for record in deleted))
+        return len(deleted)
+
+    @staticmethod
+    def _select_raw(start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                    sample_rate: Optional[int]) -> tuple[str, list]:
+        conditions, params = compile_filters(filters, 3)
+        if sample_rate and sample_rate > 0:
+            conditions += f" AND id % {int(sample_rate)} = 0"
+        return select_raw(fields, conditions), [start_ms, end_ms, *params]
+
+    async def _ensure_partitions(self, connection: asyncpg.Connection, rows: list[tuple]) -> None:
+        first_ms = min(row[1] for row in rows)
+        last_ms = max(row[1] for row in rows)
+        months = {month_bounds(first_ms)[0], month_bounds(last_ms)[0]}
+        if not months <= self._months:
+            await ensure_partitions(connection, first_ms, last_ms)
+            self._months |= months
@@ -0,0 +1,208 @@
+import operator
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+
+from .const import FLAG_COLUMNS, STATE_COLUMNS
+from .query import FILTER_TYPES, Filter
+from .rollup import plan
+
+# columns held in the float32 value matrix, in HISTORY_COLUMNS order after mode
+_VALUE_COLUMNS = tuple(column for column in STATE_COLUMNS if column != "mode")
+_VALUE_INDEX = {column: i for i, column in enumerate(_VALUE_COLUMNS)}
+_OPERATORS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+              ">": operator.gt, ">=": operator.ge}
+
+
+class RecentHistory:
+    """The most recent history rows in fixed-size arrays, answering reads of recent ranges from memory.
+
+    Rows are tuples in RAW_FIELDS order (id first) appended in time order. The
+    arrays are twice the capacity and every row is written at i and i +
+    capacity, so the retained rows are always one contiguous slice and a read
+    only touches the rows in its range. Numeric and flag columns are float32
+    with NaN for nulls, which holds Postgres REAL values exactly.
+
+    covers() says whether every stored row from a timestamp on is held here;
+    the read methods mirror HistoryStore's and return the same records, as
+    ColumnRecords so a whole column can be taken without building every row.
+    """
+
+    def __init__(self, capacity: int = 86400):
+        self.capacity = capacity
+        self._ids = np.zeros(2 * capacity, dtype=np.int64)
+        self._timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self._modes = np.empty(2 * capacity, dtype=object)
+        self._values = np.full((2 * capacity, len(_VALUE_COLUMNS)), np.nan, dtype=np.float32)
+        self._head = 0
+        self._size = 0
+        # rows from here on are all held; nothing is until the first append
+        self._covered_from: Optional[int] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def covers(self, start_ms: int) -> bool:
+        return self._covered_from is not None and start_ms >= self._covered_from
+
+    def append(self, row: tuple) -> None:
+        row_id, timestamp_ms, mode, *values = row
+        if self._size and timestamp_ms < self._timestamps[self._head + self._size - 1]:
+            # keeping the arrays sorted matters more than one late row; stop claiming its time
+            self._covered_from = max(self._covered_from, timestamp_ms + 1)
+            return
+        if self._covered_from is None:
+            self._covered_from = timestamp_ms
+
+        if self._size == self.capacity:
+            self._covered_from = max(self._covered_from, int(self._timestamps[self._head]) + 1)
+            position = self._head
+            self._head = (self._head + 1) % self.capacity
+        else:
+            position = (self._head + self._size) % self.capacity
+            self._size += 1
+        values = [np.nan if value is None else value for value in values]
+        for i in (position, position + self.capacity):
+            self._ids[i] = row_id
+            self._timestamps[i] = timestamp_ms
+            self._modes[i] = mode
+            self._values[i] = values
+
+    def delete(self, start_id: int, end_id: int) -> None:
+        """Drop rows with ids in the inclusive range, as HistoryStore.delete does in the store."""
+        ids = self._window(self._ids)
+        keep = (ids < start_id) | (ids > end_id)
+        if keep.all():
+            return
+        for array in (self._ids, self._timestamps, self._modes, self._values):
+            kept = self._window(array)[keep]
+            array[:len(kept)] = array[self.capacity:self.capacity + len(kept)] = kept
+        self._head, self._size = 0, len(kept)
+
+    def renumber(self, start_id: int, shift: int) -> None:
+        """Add shift to the ids from start_id on, as HistoryWriter.attach does to rows it has not written yet."""
+        self._ids[self._ids >= start_id] += shift
+
+    async def fetch_raw(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                        sample_rate: Optional[int] = None) -> list:
+        rows = self._select(start_ms, end_ms, filters)
+        if sample_rate and sample_rate > 0:
+            rows = rows[self._ids[rows] % sample_rate == 0]
+        return self._records(rows, fields)
+
+    async def fetch_since(self, start_ms: int, end_ms: int, cursor: tuple[int, int], limit: Optional[int],
+                          fields: list[str], filters: list[Filter]) -> list:
+        rows = self._select(max(start_ms, cursor[0]), end_ms, filters)
+        timestamps, ids = self._timestamps[rows], self._ids[rows]
+        rows = rows[(timestamps > cursor[0]) | ((timestamps == cursor[0]) & (ids > cursor[1]))]
+        return self._records(rows if limit is None else rows[:limit], fields)
+
+    async def fetch_buckets(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                            bucket_ms: Optional[int], max_points: Optional[int]) -> list:
+        _, origin, width = plan(start_ms, end_ms, bucket_ms, max_points, filtered=bool(filters))
+        rows = self._select(origin, end_ms, filters)
+        if not len(rows):
+            return ColumnRecords({})
+        buckets = origin + (self._timestamps[rows] - origin) // width * width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(rows)]
+
+        columns = {"timestamp_ms": buckets[starts].tolist(), "samples": (ends - starts).tolist()}
+        for column in fields:
+            if column == "mode":
+                columns["mode"] = self._modes[rows[ends - 1]].tolist()
+                continue
+            values = self._values[rows, _VALUE_INDEX[column]].astype(np.float64)
+            present = ~np.isnan(values)
+            counts = np.add.reduceat(present, starts)
+            sums = np.add.reduceat(np.where(present, values, 0.0), starts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                averages = sums / counts
+            if column in FLAG_COLUMNS:
+                columns[column] = _nullable((sums > 0).tolist(), counts == 0)
+                columns[f"{column}_fraction"] = _nullable(averages.tolist(), counts == 0)
+            else:
+                columns[f"{column}_min"] = _nullable(np.fmin.reduceat(values, starts).tolist(), counts == 0)
+                columns[f"{column}_max"] = _nullable(np.fmax.reduceat(values, starts).tolist(), counts == 0)
+                columns[column] = _nullable(averages.tolist(), counts == 0)
+        return ColumnRecords(columns)
+
+    async def newest(self, start_ms: int, end_ms: int) -> Optional[tuple[int, int]]:
+        timestamps = self._window(self._timestamps)
+        last = np.searchsorted(timestamps, end_ms, side="right") - 1
+        if last < 0 or timestamps[last] < start_ms:
+            return None
+        return int(timestamps[last]), int(self._window(self._ids)[last])
+
+    def _window(self, array: np.ndarray) -> np.ndarray:
+        return array[self._head:self._head + self._size]
+
+    def _select(self, start_ms: int, end_ms: int, filters: list[Filter]) -> np.ndarray:
+        """Positions of the rows in the range that match filters, in (timestamp_ms, id) order."""
+        timestamps = self._window(self._timestamps)
+        first = np.searchsorted(timestamps, start_ms, side="left")
+        last = np.searchsorted(timestamps, end_ms, side="right")
+        rows = np.arange(self._head + first, self._head + last)
+        for column, op, value in filters:
+            values = self._column(column, rows)
+            if values.dtype == np.float32 and FILTER_TYPES[column] is float:
+                # Postgres infers the parameter as REAL from the column and compares in single precision
+                value = np.float32(value)
+            elif values.dtype == np.float32:
+                # integer and flag columns are held exactly, compare them against the exact parameter
+                values = values.astype(np.float64)
+            # like SQL, a null never matches, not even !=
+            present = values != None if column == "mode" else ~np.isnan(values)  # noqa: E711
+            rows = rows[present & _OPERATORS[op](values, value)]
+        return rows
+
+    def _column(self, column: str, rows: np.ndarray) -> np.ndarray:
+        if column == "id":
+            return self._ids[rows]
+        if column == "timestamp_ms":
+            return self._timestamps[rows]
+        if column == "mode":
+            return self._modes[rows]
+        return self._values[rows, _VALUE_INDEX[column]]
+
+    def _records(self, rows: np.ndarray, fields: list[str]) -> "ColumnRecords":
+        columns = {}
+        for field in fields:
+            values = self._column(field, rows)
+            if field in ("id", "timestamp_ms", "mode"):
+                columns[field] = values.tolist()
+                continue
+            kind = FILTER_TYPES[field]
+            missing = np.isnan(values)
+            if kind is bool:
+                values = values != 0
+            elif kind is int:
+                values = np.where(missing, 0, values).astype(np.int64)
+            columns[field] = _nullable(values.tolist(), missing)
+        return ColumnRecords(columns)
+
+
+class ColumnRecords(Sequence):
+    """Records held as one list per column; indexing builds a row dict on demand."""
+
+    def __init__(self, columns: dict[str, list]):
+        self.columns = columns
+        self._length = len(next(iter(columns.values()), []))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnRecords({key: values[index] for key, values in self.columns.items()})
+        if not -self._length <= index < self._length:
+            raise IndexError(index)
+        return {key: values[index] for key, values in self.columns.items()}
+
+
+def _nullable(values: list, missing: np.ndarray) -> list:
+    """values with None wherever missing is set."""
+    for i in np.flatnonzero(missing).tolist():
+        values[i] = None
+    return values
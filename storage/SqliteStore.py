@@ -0,0 +1,242 @@
+import asyncio
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from .const import FLAG_COLUMNS, HISTORY_TABLE
+from .HistoryStore import HistoryStore
+from .query import RAW_FIELDS, Filter, compile_filters, select_raw
+from .rollup import plan
+
+# schema scripts by version; user_version records how many have been applied
+MIGRATIONS = {
+    1: f"""
+        CREATE TABLE {HISTORY_TABLE} (
+            id INTEGER PRIMARY KEY,
+            timestamp_ms INTEGER NOT NULL,
+            mode TEXT,
+            pump INTEGER,
+            "case" REAL,
+            water REAL,
+            outlet REAL,
+            inlet REAL,
+            discharge REAL,
+            suction REAL,
+            evaporator REAL,
+            ambient REAL,
+            compspeed INTEGER,
+            waterspeed INTEGER,
+            fanspeed INTEGER,
+            power INTEGER,
+            current REAL,
+            hours REAL,
+            starts REAL,
+            boost INTEGER
+        );
+        -- the rowid rides along in every index entry, so this also serves (timestamp_ms, id) order
+        CREATE INDEX {HISTORY_TABLE}_timestamp_ms_idx ON {HISTORY_TABLE} (timestamp_ms);
+        CREATE INDEX {HISTORY_TABLE}_pump_idx ON {HISTORY_TABLE} (timestamp_ms) WHERE pump;
+        CREATE INDEX {HISTORY_TABLE}_boost_idx ON {HISTORY_TABLE} (timestamp_ms) WHERE boost;
+    """,
+}
+
+TABLES_QUERY = """
+    SELECT m.name AS table_name, c.name AS column_name, c.type AS data_type
+    FROM sqlite_master m LEFT JOIN pragma_table_info(m.name) c
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+    ORDER BY m.name, c.cid
+"""
+NEWEST_ROW_QUERY = f"""
+    SELECT timestamp_ms, id FROM {HISTORY_TABLE}
+    WHERE timestamp_ms >= ?1 AND timestamp_ms <= ?2
+    ORDER BY timestamp_ms DESC, id DESC
+    LIMIT 1
+"""
+INSERT = f"""
+    INSERT INTO {HISTORY_TABLE} ({", ".join(f'"{column}"' for column in RAW_FIELDS)})
+    VALUES ({", ".join("?" * len(RAW_FIELDS))})
+"""
+
+_PLACEHOLDER = re.compile(r"\$(\d+)")
+
+
+class SqliteStore(HistoryStore):
+    """History in an embedded SQLite database in WAL mode, for running without a database server.
+
+    Writes go through one connection on a dedicated thread and reads through
+    another, so WAL lets reads run while a batch is being written. Each batch
+    is inserted with executemany in a single transaction. There are no rollup
+    tables; bucketed reads aggregate raw rows over the timestamp index, with
+    the same bucket edges as Postgres.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._reader: Optional[ThreadPoolExecutor] = None
+        self._read_only = False
+
+    async def open(self, read_only: bool = False) -> None:
+        self._read_only = read_only
+        self._writer = ThreadPoolExecutor(1, "sqlite-writer", initializer=self._connect)
+        self._reader = ThreadPoolExecutor(1, "sqlite-reader", initializer=self._connect)
+        if read_only:
+            self.schema_version = await self._run(self._reader, self._version)
+        else:
+            self.schema_version = await self._run(self._writer, self._migrate)
+
+    async def close(self) -> None:
+        for executor in (self._writer, self._reader):
+            if executor:
+                await self._run(executor, lambda: self._local.connection.close())
+                executor.shutdown()
+        self._writer = self._reader = None
+
+    async def write(self, rows: list[tuple]) -> None:
+        def insert():
+            with self._local.connection:
+                self._local.connection.executemany(INSERT, rows)
+        await self._run(self._writer, insert)
+
+    async def last_id(self) -> int:
+        rows = await self._fetch(f"SELECT coalesce(max(id), 0) AS id FROM {HISTORY_TABLE}", [])
+        return rows[0]['id']
+
+    async def fetch_raw(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                        sample_rate: Optional[int] = None) -> list:
+        query, params = self._select_raw(start_ms, end_ms, fields, filters, sample_rate)
+        return await self._fetch(query, params)
+
+    async def raw_blocks(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                         sample_rate: Optional[int] = None, block_rows: int = 10000) -> AsyncIterator[list]:
+        query, params = self._select_raw(start_ms, end_ms, fields, filters, sample_rate)
+        cursor = await self._run(self._reader, lambda: self._local.connection.execute(_prepare(query), params))
+        try:
+            while records := await self._run(self._reader, lambda: cursor.fetchmany(block_rows)):
+                yield records
+        finally:
+            await self._run(self._reader, cursor.close)
+
+    async def fetch_since(self, start_ms: int, end_ms: int, cursor: tuple[int, int], limit: Optional[int],
+                          fields: list[str], filters: list[Filter]) -> list:
+        conditions, params = compile_filters(filters, 6)
+        # a negative LIMIT is no limit
+        return await self._fetch(f"""
+            SELECT {", ".join(f'"{field}"' for field in fields)} FROM {HISTORY_TABLE}
+            WHERE timestamp_ms >= max($1, $3) AND timestamp_ms <= $2
+                AND (timestamp_ms, id) > ($3, $4){conditions}
+            ORDER BY timestamp_ms, id
+            LIMIT $5
+        """, [start_ms, end_ms, *cursor, -1 if limit is None else limit, *params])
+
+    async def fetch_buckets(self, start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                            bucket_ms: Optional[int], max_points: Optional[int]) -> list:
+        conditions, params = compile_filters(filters, 4)
+        _, origin, width = plan(start_ms, end_ms, bucket_ms, max_points, filtered=bool(filters))
+        return await self._fetch(bucket_query(fields, conditions), [origin, end_ms, width, *params])
+
+    async def newest(self, start_ms: int, end_ms: int) -> Optional[tuple[int, int]]:
+        rows = await self._fetch(NEWEST_ROW_QUERY, [start_ms, end_ms])
+        return (rows[0]['timestamp_ms'], rows[0]['id']) if rows else None
+
+    async def tables(self) -> dict[str, dict[str, str]]:
+        tables = {}
+        for row in await self._fetch(TABLES_QUERY, []):
+            columns = tables.setdefault(row['table_name'], {})
+            if row['column_name'] is not None:
+                columns[row['column_name']] = row['data_type']
+        return tables
+
+    async def delete(self, start_id: int, end_id: int) -> int:
+        def delete():
+            with self._local.connection:
+                return self._local.connection.execute(
+                    f"DELETE FROM {HISTORY_TABLE} WHERE id >= ? AND id <= ?", (start_id, end_id)).rowcount
+        return await self._run(self._writer, delete)
+
+    def _connect(self) -> None:
+        if self._read_only:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", timeout=30, uri=True)
+            connection.row_factory = _record
+            self._local.connection = connection
+            return
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = _record
+        connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode a crash can only lose the last transactions, never corrupt the file
+        connection.execute("PRAGMA synchronous=NORMAL")
+        self._local.connection = connection
+
+    def _version(self) -> int:
+        return self._local.connection.execute("PRAGMA user_version").fetchone()["user_version"]
+
+    def _migrate(self) -> int:
+        connection = self._local.connection
+        version = self._version()
+        for target in sorted(v for v in MIGRATIONS if v > version):
+            connection.executescript(f"BEGIN; {MIGRATIONS[target]} PRAGMA user_version = {target}; COMMIT;")
+            version = target
+        return version
+
+    async def _fetch(self, query: str, params: list) -> list:
+        return await self._run(self._reader, lambda: self._local.connection.execute(_prepare(query), params).fetchall())
+
+    @staticmethod
+    def _select_raw(start_ms: int, end_ms: int, fields: list[str], filters: list[Filter],
+                    sample_rate: Optional[int]) -> tuple[str, list]:
+        conditions, params = compile_filters(filters, 3)
+        if sample_rate and sample_rate > 0:
+            conditions += f" AND id % {int(sample_rate)} = 0"
+        return select_raw(fields, conditions), [start_ms, end_ms, *params]
+
+    @staticmethod
+    async def _run(executor: ThreadPoolExecutor, call: Callable):
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+def bucket_query(fields: Iterable[str], conditions: str = "") -> str:
+    """downsample.bucket_query for SQLite, with the same parameters and columns."""
+    columns = []
+    for column in fields:
+        if column == "mode":
+            columns.append("min(last_mode) AS mode")
+        elif column in FLAG_COLUMNS:
+            columns.append(f"max({column}) AS {column}")
+            columns.append(f"avg({column}) AS {column}_fraction")
+        else:
+            columns.append(f'CAST(min("{column}") AS REAL) AS {column}_min')
+            columns.append(f'CAST(max("{column}") AS REAL) AS {column}_max')
+            columns.append(f'avg("{column}") AS "{column}"')
+    aggregates = "".join(f",\n        {column}" for column in columns)
+    last_mode = ""
+    if "mode" in fields:
+        last_mode = ", first_value(mode) OVER (PARTITION BY bucket_ms ORDER BY timestamp_ms DESC, id DESC) AS last_mode"
+    return f"""
+    SELECT
+        bucket_ms AS timestamp_ms,
+        count(*) AS samples{aggregates}
+    FROM (
+        SELECT *{last_mode} FROM (
+            SELECT *, $1 + (timestamp_ms - $1) / $3 * $3 AS bucket_ms FROM {HISTORY_TABLE}
+            WHERE timestamp_ms >= $1 AND timestamp_ms <= $2{conditions}
+        )
+    )
+    GROUP BY bucket_ms
+    ORDER BY bucket_ms
+"""
+
+
+def _record(cursor: sqlite3.Cursor, row: tuple) -> dict:
+    """Rows as dicts like asyncpg records, with the 0/1 flag columns turned back into bools."""
+    record = {}
+    for (name, *_), value in zip(cursor.description, row):
+        record[name] = bool(value) if name in FLAG_COLUMNS and value is not None else value
+    return record
+
+
+def _prepare(query: str) -> str:
+    """Turn the $n placeholders of the shared query builders into SQLite's ?n."""
+    return _PLACEHOLDER.sub(r"?\1", query)
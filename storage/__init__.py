@@ -0,0 +1,7 @@
+from .HistoryWriter import HistoryWriter, history_row
+from .HistoryCompressor import HistoryCompressor, DEFAULT_DEADBANDS
+from .HistoryStore import HistoryStore
+from .PostgresStore import PostgresStore
+from .SqliteStore import SqliteStore
+from .RecentHistory import ColumnRecords, RecentHistory
+from .HistorySpool import HistorySpool
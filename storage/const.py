@@ -0,0 +1,43 @@
+"""Constants for the history storage."""
+
+HISTORY_TABLE = "reclaim_state_history"
+
+# ReclaimStateResponse fields stored for every sample, in table order
+STATE_COLUMNS = (
+    "mode",
+    "pump",
+    "case",
+    "water",
+    "outlet",
+    "inlet",
+    "discharge",
+    "suction",
+    "evaporator",
+    "ambient",
+    "compspeed",
+    "waterspeed",
+    "fanspeed",
+    "power",
+    "current",
+    "hours",
+    "starts",
+    "boost",
+)
+
+HISTORY_COLUMNS = ("timestamp_ms", *STATE_COLUMNS)
+
+# columns summarised as min/max/avg when downsampling
+NUMERIC_COLUMNS = (
+    "case", "water", "outlet", "inlet", "discharge", "suction", "evaporator",
+    "ambient", "compspeed", "waterspeed", "fanspeed", "power", "current",
+    "hours", "starts",
+)
+# columns summarised as whether they were ever true and the fraction of samples that were
+FLAG_COLUMNS = ("pump", "boost")
+
+# (suffix, bucket width in ms) of the rollup tables, finest first
+ROLLUP_TIERS = (
+    ("1m", 60 * 1000),
+    ("1h", 60 * 60 * 1000),
+    ("1d", 24 * 60 * 60 * 1000),
+)
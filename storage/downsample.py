@@ -0,0 +1,73 @@
+"""Server-side downsampling of history for charting long time ranges."""
+
+import math
+from typing import Iterable
+
+import numpy as np
+
+from .const import FLAG_COLUMNS, HISTORY_TABLE, STATE_COLUMNS
+
+
+def bucket_query(fields: Iterable[str] = STATE_COLUMNS, conditions: str = "") -> str:
+    """Aggregate raw rows matching conditions into buckets, summarising only fields.
+
+    $1 is the start, $2 the end and $3 the bucket width; every bucket is labelled
+    with its start time.
+    """
+    columns = []
+    for column in fields:
+        if column == "mode":
+            columns.append('(array_agg(mode ORDER BY timestamp_ms DESC))[1] AS mode')
+        elif column in FLAG_COLUMNS:
+            columns.append(f'bool_or({column}) AS {column}')
+            columns.append(f'avg({column}::int)::double precision AS {column}_fraction')
+        else:
+            columns.append(f'min("{column}")::double precision AS {column}_min')
+            columns.append(f'max("{column}")::double precision AS {column}_max')
+            columns.append(f'avg("{column}")::double precision AS "{column}"')
+    aggregates = "".join(f",\n        {column}" for column in columns)
+    return f"""
+    SELECT
+        $1 + (timestamp_ms - $1) / $3 * $3 AS timestamp_ms,
+        count(*) AS samples{aggregates}
+    FROM {HISTORY_TABLE}
+    WHERE timestamp_ms >= $1 AND timestamp_ms <= $2{conditions}
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+def bucket_width(start_ms: int, end_ms: int, max_points: int) -> int:
+    """Smallest bucket in ms that splits start_ms to end_ms into at most max_points buckets."""
+    return max(1, math.ceil((end_ms - start_ms + 1) / max_points))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Between them, each bucket keeps
+    the point forming the largest triangle with the previously kept point and
+    the mean of the next bucket, which preserves peaks and troughs. NaN values
+    in y never win a bucket unless the whole bucket is NaN.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    kept = np.empty(threshold, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        following = slice(stop, edges[i + 2] if i + 2 < len(edges) else n)
+        next_x = x[following].mean()
+        next_y = np.nanmean(y[following]) if not np.isnan(y[following]).all() else y[a]
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a])
+                       - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start if np.isnan(areas).all() else start + int(np.nanargmax(areas))
+        kept[i + 1] = a
+    return kept
@@ -0,0 +1,177 @@
+"""Arrow IPC and Parquet export of history with typed columns.
+
+Run from the repository root to export a range to a file, for example:
+
+    python -m storage.export 1753290000000 1753453200000 history.parquet --compression zstd --fields timestamp_ms,outlet,boost
+
+Pass --sqlite <path> to export from an embedded SQLite history instead of Postgres.
+"""
+
+import argparse
+import asyncio
+import io
+import os
+from typing import AsyncIterator, Optional
+
+import asyncpg
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from .PostgresStore import PostgresStore
+from .query import parse_fields, parse_filters
+from .SqliteStore import SqliteStore
+
+ARROW_TYPES = {
+    "id": pa.int32(),
+    "timestamp_ms": pa.int64(),
+    "mode": pa.string(),
+    "pump": pa.bool_(),
+    "case": pa.float32(),
+    "water": pa.float32(),
+    "outlet": pa.float32(),
+    "inlet": pa.float32(),
+    "discharge": pa.float32(),
+    "suction": pa.float32(),
+    "evaporator": pa.float32(),
+    "ambient": pa.float32(),
+    "compspeed": pa.int32(),
+    "waterspeed": pa.int32(),
+    "fanspeed": pa.int32(),
+    "power": pa.int32(),
+    "current": pa.float32(),
+    "hours": pa.float32(),
+    "starts": pa.float32(),
+    "boost": pa.bool_(),
+}
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# codecs each format accepts; None writes uncompressed
+COMPRESSIONS = {
+    "arrow": (None, "lz4", "zstd"),
+    "parquet": (None, "snappy", "gzip", "brotli", "zstd", "lz4"),
+}
+
+
+def record_batch(records: list, fields: list[str]) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays(
+        [pa.array([record[field] for record in records], type=ARROW_TYPES[field]) for field in fields],
+        schema=_schema(fields),
+    )
+
+
+async def encode(blocks: AsyncIterator[list], fields: list[str], export: str,
+                 compression: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Encode blocks of records as an Arrow IPC stream or a Parquet file, yielding bytes as they are written."""
+    sink = _ChunkSink()
+    schema = _schema(fields)
+    if export == "arrow":
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+    else:
+        writer = pq.ParquetWriter(sink, schema, compression=compression or "none")
+    try:
+        async for records in blocks:
+            if export == "arrow":
+                writer.write_batch(record_batch(records, fields))
+            else:
+                # one row group per block keeps the writer's memory bounded
+                writer.write_table(pa.Table.from_batches([record_batch(records, fields)]))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def read_history(path: str):
+    """Load an exported .arrow or .parquet file into a pandas DataFrame without re-parsing."""
+    if path.endswith(".parquet"):
+        table = pq.read_table(path)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_stream(source).read_all()
+    return table.to_pandas()
+
+
+def _schema(fields: list[str]) -> pa.Schema:
+    return pa.schema([(field, ARROW_TYPES[field]) for field in fields])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what has been written since the last take()."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+async def _export(args: argparse.Namespace) -> None:
+    try:
+        fields = parse_fields(args.fields)
+        filters = parse_filters(args.where)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    export = args.format or ("parquet" if args.output.endswith(".parquet") else "arrow")
+    if args.compression not in COMPRESSIONS[export]:
+        raise SystemExit(f"{export} supports compression {', '.join(str(c) for c in COMPRESSIONS[export])}")
+
+    if args.sqlite:
+        if not os.path.exists(args.sqlite):
+            raise SystemExit(f"No SQLite history at {args.sqlite}")
+        store = SqliteStore(args.sqlite)
+    else:
+        store = PostgresStore(await asyncpg.create_pool(
+            user=os.environ.get("DB_USER", "user"),
+            password=os.environ.get("DB_PASSWORD", "password"),
+            host=os.environ.get("DB_HOST", "localhost"),
+            port=int(os.environ.get("DB_PORT", "5433")),
+            database=os.environ.get("DB_NAME", "reclaim_energy"),
+            min_size=1,
+            max_size=1,
+        ))
+    # an export only reads, so it must not migrate the schema or create partitions
+    await store.open(read_only=True)
+    try:
+        if not store.schema_version:
+            raise SystemExit("No history to export: the schema has not been created yet")
+        blocks = store.raw_blocks(args.start_timestamp_ms, args.end_timestamp_ms, fields, filters)
+        with open(args.output, "wb") as output:
+            async for chunk in encode(blocks, fields, export, args.compression):
+                output.write(chunk)
+    finally:
+        await store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export reclaim_state_history to Arrow IPC or Parquet.")
+    parser.add_argument("start_timestamp_ms", type=int)
+    parser.add_argument("end_timestamp_ms", type=int)
+    parser.add_argument("output", help="file to write; .parquet selects Parquet, anything else Arrow IPC")
+    parser.add_argument("--format", choices=list(MEDIA_TYPES))
+    parser.add_argument("--compression", help="codec, e.g. zstd; uncompressed by default")
+    parser.add_argument("--fields", help=f"comma separated columns from {', '.join(ARROW_TYPES)}")
+    parser.add_argument("--where", action="append", default=[], help="filter such as boost=true or water<45; repeatable")
+    parser.add_argument("--sqlite", metavar="PATH", help="read from this SQLite history database instead of Postgres")
+    asyncio.run(_export(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Versioned schema migrations for the history database."""
+
+import logging
+from datetime import datetime, timezone
+
+import asyncpg
+
+from .const import FLAG_COLUMNS, HISTORY_TABLE, NUMERIC_COLUMNS, ROLLUP_TIERS
+
+_LOGGER = logging.getLogger(__name__)
+
+# serialises migrations between processes sharing the database
+MIGRATION_LOCK_ID = 0x7265636C61696D
+
+
+async def _create_history_table(connection: asyncpg.Connection) -> None:
+    await connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+            id SERIAL PRIMARY KEY,
+            timestamp_ms BIGINT DEFAULT (EXTRACT(EPOCH FROM NOW()) * 1000),
+            mode TEXT,
+            pump BOOLEAN,
+            "case" REAL,
+            water REAL,
+            outlet REAL,
+            inlet REAL,
+            discharge REAL,
+            suction REAL,
+            evaporator REAL,
+            ambient REAL,
+            compspeed INTEGER,
+            waterspeed INTEGER,
+            fanspeed INTEGER,
+            power INTEGER,
+            current REAL,
+            hours REAL,
+            starts REAL,
+            boost BOOLEAN
+        )
+    """)
+
+
+async def _partition_history_by_month(connection: asyncpg.Connection) -> None:
+    """Turn the history table into one range partitioned by month on timestamp_ms.
+
+    Existing rows are not copied; the old table is attached as a single partition
+    covering everything before the first monthly partition.
+    """
+    legacy = f"{HISTORY_TABLE}_legacy"
+    await connection.execute(f"""
+        ALTER TABLE {HISTORY_TABLE} RENAME TO {legacy};
+        ALTER TABLE {legacy} DROP CONSTRAINT {HISTORY_TABLE}_pkey;
+        ALTER SEQUENCE {HISTORY_TABLE}_id_seq OWNED BY NONE;
+        CREATE TABLE {HISTORY_TABLE} (
+            id INTEGER NOT NULL DEFAULT nextval('{HISTORY_TABLE}_id_seq'),
+            timestamp_ms BIGINT NOT NULL DEFAULT (EXTRACT(EPOCH FROM NOW()) * 1000),
+            mode TEXT,
+            pump BOOLEAN,
+            "case" REAL,
+            water REAL,
+            outlet REAL,
+            inlet REAL,
+            discharge REAL,
+            suction REAL,
+            evaporator REAL,
+            ambient REAL,
+            compspeed INTEGER,
+            waterspeed INTEGER,
+            fanspeed INTEGER,
+            power INTEGER,
+            current REAL,
+            hours REAL,
+            starts REAL,
+            boost BOOLEAN,
+            PRIMARY KEY (id, timestamp_ms)
+        ) PARTITION BY RANGE (timestamp_ms);
+        ALTER SEQUENCE {HISTORY_TABLE}_id_seq OWNED BY {HISTORY_TABLE}.id;
+        CREATE INDEX {HISTORY_TABLE}_timestamp_ms_idx ON {HISTORY_TABLE} (timestamp_ms);
+        CREATE TABLE {HISTORY_TABLE}_default PARTITION OF {HISTORY_TABLE} DEFAULT;
+    """)
+
+    last_ms = await connection.fetchval(f"SELECT max(timestamp_ms) FROM {legacy}")
+    if last_ms is None:
+        await connection.execute(f"DROP TABLE {legacy}")
+        return
+
+    # everything up to the end of the newest month in the old table stays where it is
+    _, legacy_end = month_bounds(last_ms)
+    await connection.execute(f"""
+        UPDATE {legacy} SET timestamp_ms = 0 WHERE timestamp_ms IS NULL;
+        ALTER TABLE {legacy} ALTER COLUMN timestamp_ms SET NOT NULL;
+        ALTER TABLE {HISTORY_TABLE} ATTACH PARTITION {legacy}
+            FOR VALUES FROM (MINVALUE) TO ({legacy_end});
+    """)
+
+
+async def _create_rollups(connection: asyncpg.Connection) -> None:
+    """Create the 1 minute, 1 hour and 1 day rollup tables and fill them from existing history."""
+    flags = [f"{column}_{part} INTEGER NOT NULL" for column in FLAG_COLUMNS for part in ("true", "count")]
+    numbers = [f"{column}_min REAL, {column}_max REAL, {column}_sum DOUBLE PRECISION NOT NULL, {column}_count INTEGER NOT NULL"
+               for column in NUMERIC_COLUMNS]
+    flag_aggregates = [f"count(*) FILTER (WHERE {column}), count({column})" for column in FLAG_COLUMNS]
+    number_aggregates = [f'min("{column}"), max("{column}"), coalesce(sum("{column}"::double precision), 0), count("{column}")'
+                         for column in NUMERIC_COLUMNS]
+    for suffix, tier_ms in ROLLUP_TIERS:
+        table = f"{HISTORY_TABLE}_{suffix}"
+        await connection.execute(f"""
+            CREATE TABLE {table} (
+                bucket_ms BIGINT PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                last_ms BIGINT NOT NULL,
+                mode TEXT,
+                {", ".join(flags + numbers)}
+            );
+            INSERT INTO {table}
+            SELECT timestamp_ms / {tier_ms} * {tier_ms}, count(*), max(timestamp_ms),
+                   (array_agg(mode ORDER BY timestamp_ms DESC))[1],
+                   {", ".join(flag_aggregates + number_aggregates)}
+            FROM {HISTORY_TABLE}
+            GROUP BY 1;
+        """)
+
+
+async def _index_flags(connection: asyncpg.Connection) -> None:
+    """Partial indexes so filtering history on pump or boost reads only the matching rows."""
+    for column in FLAG_COLUMNS:
+        await connection.execute(
+            f"CREATE INDEX {HISTORY_TABLE}_{column}_idx ON {HISTORY_TABLE} (timestamp_ms) WHERE {column}")
+
+
+# (version, description, migration); append only, never edit an applied migration
+MIGRATIONS = [
+    (1, "create reclaim_state_history", _create_history_table),
+    (2, "partition reclaim_state_history by month with a timestamp index", _partition_history_by_month),
+    (3, "add 1 minute, 1 hour and 1 day rollups of reclaim_state_history", _create_rollups),
+    (4, "add partial timestamp indexes on reclaim_state_history where pump and where boost", _index_flags),
+]
+
+
+async def migrate(connection: asyncpg.Connection) -> int:
+    """Apply every pending migration, returning the resulting schema version."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_ms BIGINT NOT NULL DEFAULT (EXTRACT(EPOCH FROM NOW()) * 1000)
+        )
+    """)
+    async with connection.transaction():
+        await connection.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+        version = await connection.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+        for migration_version, description, migration in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            _LOGGER.info(f"Applying schema migration {migration_version}: {description}")
+            async with connection.transaction():
+                await migration(connection)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                    migration_version, description)
+            version = migration_version
+    return version
+
+
+async def schema_version(connection: asyncpg.Connection) -> int:
+    """The version migrate() has brought the schema to, without migrating it."""
+    if not await connection.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+        return 0
+    return await connection.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+
+
+def month_bounds(timestamp_ms: int) -> tuple[int, int]:
+    """Start and end epoch ms of the UTC month containing timestamp_ms."""
+    moment = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+async def ensure_partitions(connection: asyncpg.Connection, first_ms: int, last_ms: int) -> None:
+    """Create the monthly partitions covering first_ms to last_ms if they are missing."""
+    start, end = month_bounds(first_ms)
+    while start <= last_ms:
+        month = datetime.fromtimestamp(start / 1000, tz=timezone.utc)
+        name = f"{HISTORY_TABLE}_y{month.year}m{month.month:02d}"
+        try:
+            await connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {HISTORY_TABLE} FOR VALUES FROM ({start}) TO ({end})")
+        except asyncpg.exceptions.InvalidObjectDefinitionError:
+            # the month is already covered by the legacy partition
+            pass
+        except asyncpg.exceptions.CheckViolationError:
+            _LOGGER.warning(f"Rows for {name} are already in the default partition; leaving them there")
+        start, end = month_bounds(end)
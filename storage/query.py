@@ -0,0 +1,91 @@
+"""Column projection and typed filters for history queries."""
+
+import re
+from typing import Any, Iterable, Optional
+
+from .const import FLAG_COLUMNS, HISTORY_COLUMNS, HISTORY_TABLE
+
+# every column of a raw history row
+RAW_FIELDS = ("id", *HISTORY_COLUMNS)
+
+# Python type each filterable column's value is parsed to
+FILTER_TYPES = {
+    **{column: float for column in HISTORY_COLUMNS},
+    "id": int,
+    "timestamp_ms": int,
+    "mode": str,
+    "compspeed": int,
+    "waterspeed": int,
+    "fanspeed": int,
+    "power": int,
+    **{column: bool for column in FLAG_COLUMNS},
+}
+
+# (column, operator, value parsed to the column's type)
+Filter = tuple[str, str, Any]
+
+_FILTER = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$")
+_BOOLEANS = {"true": True, "1": True, "false": False, "0": False}
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str] = RAW_FIELDS,
+                 required: Iterable[str] = ()) -> list[str]:
+    """Split a comma separated projection, adding the required fields it leaves out.
+
+    Without a projection every allowed field is returned. Raises ValueError
+    naming the first unknown field.
+    """
+    allowed = list(allowed)
+    if not fields:
+        return allowed
+    names = []
+    for name in (name.strip() for name in fields.split(",")):
+        if name not in allowed:
+            raise ValueError(f"Unknown field {name!r}; expected some of {', '.join(allowed)}")
+        if name not in names:
+            names.append(name)
+    return [name for name in required if name not in names] + names
+
+
+def parse_filters(filters: Iterable[str]) -> list[Filter]:
+    """Parse filters such as 'boost=true' or 'water<45' into (column, operator, typed value).
+
+    Raises ValueError for an unknown column, operator or value.
+    """
+    parsed = []
+    for text in filters:
+        match = _FILTER.match(text)
+        if not match or match.group(1) not in FILTER_TYPES:
+            raise ValueError(f"Filter {text!r} must be <column><op><value> on one of {', '.join(FILTER_TYPES)}")
+        column, operator, value = match.groups()
+        kind = FILTER_TYPES[column]
+        if kind in (bool, str) and operator not in ("=", "!="):
+            raise ValueError(f"{column} only supports = and !=")
+        try:
+            parsed.append((column, operator, _BOOLEANS[value.lower()] if kind is bool else kind(value)))
+        except (KeyError, ValueError):
+            raise ValueError(f"{value!r} is not a valid {column}") from None
+    return parsed
+
+
+def compile_filters(filters: Iterable[Filter], first_parameter: int) -> tuple[str, list]:
+    """AND-ed SQL conditions for parsed filters.
+
+    Returns the SQL, starting with ' AND ' when there are any conditions, and
+    the values for its $n placeholders, which are numbered from first_parameter.
+    """
+    sql, params = "", []
+    for column, operator, value in filters:
+        params.append(value)
+        sql += f' AND "{column}" {operator} ${first_parameter + len(params) - 1}'
+    return sql, params
+
+
+def select_raw(fields: Iterable[str], conditions: str = "") -> str:
+    """Raw rows between $1 and $2 inclusive matching conditions, projected to fields, in keyset order."""
+    columns = ", ".join(f'"{field}"' for field in fields)
+    return f"""
+        SELECT {columns} FROM {HISTORY_TABLE}
+        WHERE timestamp_ms >= $1 AND timestamp_ms <= $2{conditions}
+        ORDER BY timestamp_ms, id
+    """
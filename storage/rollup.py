@@ -0,0 +1,145 @@
+"""Rollup tables summarising history at 1 minute, 1 hour and 1 day resolution.
+
+Each tier stores mergeable partial aggregates per bucket (min, max, sum and
+count per numeric column, true and non-null counts per flag) so a batch of new
+rows can be folded in with an upsert instead of re-aggregating the raw table.
+"""
+
+from typing import Iterable, Optional
+
+import asyncpg
+
+from .const import FLAG_COLUMNS, HISTORY_COLUMNS, HISTORY_TABLE, NUMERIC_COLUMNS, ROLLUP_TIERS, STATE_COLUMNS
+from .downsample import bucket_width
+
+# partial aggregate columns after bucket_ms, in insert order
+ROLLUP_COLUMNS = (
+    "samples", "last_ms", "mode",
+    *(f"{column}_{part}" for column in FLAG_COLUMNS for part in ("true", "count")),
+    *(f"{column}_{part}" for column in NUMERIC_COLUMNS for part in ("min", "max", "sum", "count")),
+)
+
+
+def rollup_table(suffix: str) -> str:
+    return f"{HISTORY_TABLE}_{suffix}"
+
+
+def plan(start_ms: int, end_ms: int, bucket_ms: Optional[int] = None,
+         max_points: Optional[int] = None, filtered: bool = False) -> tuple[Optional[str], int, int]:
+    """Choose the rollup tier, first bucket start and bucket width for a bucketed query.
+
+    Returns the suffix of the coarsest tier whose buckets tile the requested ones
+    (None to aggregate raw rows), with the start moved back onto a tier boundary
+    and the width a whole number of tier buckets. An explicit bucket_ms is only
+    served from a tier it is a multiple of; for max_points the width is rounded
+    up, so there are never more than max_points buckets. Filtered queries cannot
+    use the rollups and always start at start_ms.
+
+    Every backend buckets with this plan, so bucket edges do not depend on where
+    a query is answered.
+    """
+    width = bucket_ms or bucket_width(start_ms, end_ms, max_points)
+    if filtered:
+        return None, start_ms, width
+    for suffix, tier_ms in reversed(ROLLUP_TIERS):
+        if tier_ms > width or (bucket_ms and bucket_ms % tier_ms):
+            continue
+        origin = start_ms - start_ms % tier_ms
+        if not bucket_ms:
+            width = -(-bucket_width(origin, end_ms, max_points) // tier_ms) * tier_ms
+        return suffix, origin, width
+    return None, start_ms, width
+
+
+def aggregate(rows: list[tuple], tier_ms: int) -> list[tuple]:
+    """Partial aggregates of rows in HISTORY_COLUMNS order, one tuple per tier bucket."""
+    buckets: dict[int, list[tuple]] = {}
+    for row in rows:
+        buckets.setdefault(row[0] // tier_ms * tier_ms, []).append(row)
+
+    result = []
+    for bucket_ms, bucket in buckets.items():
+        last = max(bucket, key=lambda row: row[0])
+        values = [bucket_ms, len(bucket), last[0], last[1]]
+        for i in _FLAG_INDICES:
+            flags = [row[i] for row in bucket if row[i] is not None]
+            values += [sum(flags), len(flags)]
+        for i in _NUMERIC_INDICES:
+            numbers = [row[i] for row in bucket if row[i] is not None]
+            values += [min(numbers, default=None), max(numbers, default=None), float(sum(numbers)), len(numbers)]
+        result.append(tuple(values))
+    return result
+
+
+async def update_rollups(connection: asyncpg.Connection, rows: list[tuple]) -> None:
+    """Fold a batch of newly written history rows into every tier."""
+    for suffix, tier_ms in ROLLUP_TIERS:
+        await connection.executemany(_UPSERTS[suffix], aggregate(rows, tier_ms))
+
+
+async def rebuild_rollups(connection: asyncpg.Connection, timestamps: Iterable[int]) -> None:
+    """Re-aggregate every tier over the days holding timestamps from the raw rows left there, e.g. after a delete."""
+    day_ms = ROLLUP_TIERS[-1][1]
+    for day in sorted({timestamp_ms // day_ms * day_ms for timestamp_ms in timestamps}):
+        rows = await connection.fetch(f"""
+            SELECT {", ".join(f'"{column}"' for column in HISTORY_COLUMNS)} FROM {HISTORY_TABLE}
+            WHERE timestamp_ms >= $1 AND timestamp_ms < $2
+        """, day, day + day_ms)
+        for suffix, tier_ms in ROLLUP_TIERS:
+            await connection.execute(f"DELETE FROM {rollup_table(suffix)} WHERE bucket_ms >= $1 AND bucket_ms < $2",
+                                     day, day + day_ms)
+            await connection.executemany(_UPSERTS[suffix], aggregate(rows, tier_ms))
+
+
+def _upsert(table: str) -> str:
+    columns = ("bucket_ms", *ROLLUP_COLUMNS)
+    merges = [
+        f"samples = {table}.samples + EXCLUDED.samples",
+        f"last_ms = greatest({table}.last_ms, EXCLUDED.last_ms)",
+        f"mode = CASE WHEN EXCLUDED.last_ms >= {table}.last_ms THEN EXCLUDED.mode ELSE {table}.mode END",
+    ]
+    for column in ROLLUP_COLUMNS[3:]:
+        if column.endswith("_min"):
+            merges.append(f"{column} = least({table}.{column}, EXCLUDED.{column})")
+        elif column.endswith("_max"):
+            merges.append(f"{column} = greatest({table}.{column}, EXCLUDED.{column})")
+        else:
+            merges.append(f"{column} = {table}.{column} + EXCLUDED.{column}")
+    return f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join(f"${i}" for i in range(1, len(columns) + 1))})
+        ON CONFLICT (bucket_ms) DO UPDATE SET {", ".join(merges)}
+    """
+
+
+def query(suffix: str, fields: Iterable[str] = STATE_COLUMNS) -> str:
+    """Re-bucket a tier, taking the same parameters and giving the same columns as downsample.bucket_query.
+
+    $1 and $3 must lie on the tier's bucket boundaries, as from plan().
+    """
+    columns = []
+    for column in fields:
+        if column == "mode":
+            columns.append("(array_agg(mode ORDER BY last_ms DESC))[1] AS mode")
+        elif column in FLAG_COLUMNS:
+            columns.append(f"bool_or({column}_true > 0) AS {column}")
+            columns.append(f"sum({column}_true)::double precision / nullif(sum({column}_count), 0) AS {column}_fraction")
+        else:
+            columns.append(f"min({column}_min) AS {column}_min")
+            columns.append(f"max({column}_max) AS {column}_max")
+            columns.append(f'sum({column}_sum) / nullif(sum({column}_count), 0) AS "{column}"')
+    aggregates = "".join(f",\n        {column}" for column in columns)
+    return f"""
+    SELECT
+        $1 + (bucket_ms - $1) / $3 * $3 AS timestamp_ms,
+        sum(samples) AS samples{aggregates}
+    FROM {rollup_table(suffix)}
+    WHERE bucket_ms >= $1 AND bucket_ms <= $2
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+_FLAG_INDICES = [HISTORY_COLUMNS.index(column) for column in FLAG_COLUMNS]
+_NUMERIC_INDICES = [HISTORY_COLUMNS.index(column) for column in NUMERIC_COLUMNS]
+_UPSERTS = {suffix: _upsert(rollup_table(suffix)) for suffix, _ in ROLLUP_TIERS}
@@ -0,0 +1,93 @@
+"""Throughput of the per-row INSERT logging path against HistoryWriter's COPY and SQLite batches.
+
+Needs the database from docker-compose.yml (or the DB_* environment variables).
+Rows are written to a scratch schema that is dropped afterwards, and to a
+temporary SQLite file. Run from the repository root with:
+
+    python -m tests.benchmarks.bench_history_writer
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+import asyncpg
+
+from model import ReclaimStateResponse
+from storage import HistoryStore, HistoryWriter, PostgresStore, SqliteStore
+from storage.const import HISTORY_TABLE
+from storage.migrations import ensure_partitions, migrate
+
+SCHEMA = "reclaim_bench"
+START_MS = int(time.time() * 1000)
+
+STATE = ReclaimStateResponse(
+    mode="Mode 1: 24H", pump=True, case=50.0, water=60.0, outlet=1.0, inlet=2.0,
+    discharge=3.0, suction=4.0, evaporator=5.0, ambient=6.0, compspeed=7,
+    waterspeed=8, fanspeed=9, power=10, current=11.0, hours=12.0, starts=13.0,
+    boost=False,
+)
+
+INSERT = f"""
+    INSERT INTO {HISTORY_TABLE} (timestamp_ms, mode, pump, "case", water, outlet, inlet, discharge, suction, evaporator, ambient, compspeed, waterspeed, fanspeed, power, current, hours, starts, boost)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19)
+"""
+
+
+async def insert_per_row(pool: asyncpg.Pool, rows: int) -> None:
+    s = STATE
+    for timestamp_ms in range(START_MS, START_MS + rows):
+        async with pool.acquire() as connection:
+            await connection.execute(INSERT, timestamp_ms, s.mode, s.pump, s.case, s.water, s.outlet, s.inlet, s.discharge, s.suction, s.evaporator, s.ambient, s.compspeed, s.waterspeed, s.fanspeed, s.power, s.current, s.hours, s.starts, s.boost)
+
+
+async def history_writer(pool: asyncpg.Pool, rows: int) -> None:
+    await write_batches(PostgresStore(pool), rows)
+
+
+async def sqlite_writer(pool: asyncpg.Pool, rows: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteStore(os.path.join(directory, "history.db"))
+        await store.open()
+        await write_batches(store, rows)
+        await store.close()
+
+
+async def write_batches(store: HistoryStore, rows: int) -> None:
+    writer = HistoryWriter(store)
+    await writer.start()
+    for timestamp_ms in range(START_MS, START_MS + rows):
+        writer.put(timestamp_ms, STATE)
+        if timestamp_ms % writer.max_rows == 0:
+            await asyncio.sleep(0)
+    await writer.close()
+
+
+async def main(rows: int = 20000) -> None:
+    pool = await asyncpg.create_pool(
+        user=os.environ.get("DB_USER", "user"),
+        password=os.environ.get("DB_PASSWORD", "password"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=int(os.environ.get("DB_PORT", "5433")),
+        database=os.environ.get("DB_NAME", "reclaim_energy"),
+        server_settings={"search_path": SCHEMA},
+    )
+    async with pool.acquire() as connection:
+        await connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+        await migrate(connection)
+        await ensure_partitions(connection, START_MS, START_MS + rows)
+
+    for path in (insert_per_row, history_writer, sqlite_writer):
+        start = time.perf_counter()
+        await path(pool, rows)
+        elapsed = time.perf_counter() - start
+        print(f"{path.__name__:>16}: {rows / elapsed:>10.0f} rows/s")
+
+    async with pool.acquire() as connection:
+        await connection.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""Micro-benchmarks of each stage from an MQTT payload to a /history response, checked against a baseline.
+
+Every stage runs on a realistic payload: a full register read with every
+mapped register plus unmapped filler, as the controller sends it, and 1000
+history rows for the columnar transpose. For each stage this reports ops/s,
+the speed relative to a fixed calibration workload (so baselines carry over
+between machines), and the peak bytes allocated by one call as traced by
+tracemalloc.
+
+Run from the repository root with:
+
+    python -m tests.benchmarks.bench_hot_paths            # compare with baseline.json
+    python -m tests.benchmarks.bench_hot_paths --update   # record a new baseline
+
+The process exits non-zero when a stage's relative speed drops by more than
+--tolerance or its allocations grow by more than --allocation-tolerance.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+from custom_components.reclaimenergy.reclaimv2 import MessageListener, ReclaimState, ReclaimV2, validate_unique_id
+from main import _columns
+from model import ReclaimStateResponse
+from storage.query import RAW_FIELDS
+
+from tests.benchmarks.bench_state import PAYLOAD, RESPONSE_FIELDS
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+UNIQUE_ID = "12345678901234567"
+MESSAGE = SimpleNamespace(
+    payload=json.dumps({"messageId": "read", "modbusReg": 1, "modbusVal": PAYLOAD}).encode(),
+    topic="dontek2bdc545d6b4b/status/psw",
+)
+DECODED = json.loads(MESSAGE.payload)
+REGISTERS = ReclaimState.registers(PAYLOAD)
+STATE = ReclaimState(REGISTERS)
+# rows as the store returns them, in the default /history column order
+RECORDS = [dict(zip(RAW_FIELDS, (i + 1, 1735689600000 + 10000 * i, "Mode 1: 24H", True, *[40.5] * 15, False)))
+           for i in range(1000)]
+
+API = ReclaimV2(int(UNIQUE_ID), "ca.pem", "cert.pem", "key.pem")
+LISTENER = MessageListener()
+
+
+def read_attributes(state=STATE):
+    for name in RESPONSE_FIELDS:
+        getattr(state, name)
+
+
+STAGES = {
+    "validate_unique_id": lambda: validate_unique_id(UNIQUE_ID),
+    "json_parse": lambda: json.loads(MESSAGE.payload),
+    "register_dict": lambda: ReclaimState.registers(DECODED["modbusVal"]),
+    "state_decode": lambda: ReclaimState(REGISTERS),
+    "attribute_reads": read_attributes,
+    "process_message": lambda: API._process_message(MESSAGE, LISTENER),
+    "response_from_state": lambda: ReclaimStateResponse.from_state(STATE),
+    "history_columns": lambda: _columns(RECORDS),
+}
+
+
+def calibrate() -> None:
+    """Fixed interpreter-bound work that stage speeds are expressed relative to."""
+    values = {str(i): i for i in range(100)}
+    sorted(values, key=values.get)
+
+
+def relative_speed(call, rounds: int = 9) -> tuple[float, float]:
+    """ops/s of call and the median ratio of it to calibrate's ops/s.
+
+    The two are timed alternately in short runs, so a change in clock speed or
+    a noisy neighbour affects both sides of each ratio alike.
+    """
+    numbers = [max(1, timeit.Timer(function).autorange()[0] // 4) for function in (call, calibrate)]
+    speeds, ratios = [], []
+    for _ in range(rounds):
+        call_speed, calibrate_speed = (number / timeit.timeit(function, number=number)
+                                       for function, number in zip((call, calibrate), numbers))
+        speeds.append(call_speed)
+        ratios.append(call_speed / calibrate_speed)
+    return max(speeds), statistics.median(ratios)
+
+
+def peak_bytes(call, repeat: int = 5) -> int:
+    """Median of the peak bytes allocated while making one call."""
+    call()
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks))
+
+
+def measure() -> dict:
+    stages = {}
+    for name, call in STAGES.items():
+        ops, relative = relative_speed(call)
+        stages[name] = {"ops_per_sec": round(ops), "relative": round(relative, 4), "peak_bytes": peak_bytes(call)}
+    return {"stages": stages}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float, allocation_tolerance: float) -> list[str]:
+    found = []
+    for name, result in results["stages"].items():
+        expected = baseline["stages"].get(name)
+        if expected is None:
+            continue
+        if result["relative"] < expected["relative"] * (1 - tolerance):
+            found.append(f"{name}: {result['relative']:.4f} relative speed against {expected['relative']:.4f}")
+        # a little slack for allocator noise on stages that allocate almost nothing
+        if result["peak_bytes"] > expected["peak_bytes"] * (1 + allocation_tolerance) + 64:
+            found.append(f"{name}: {result['peak_bytes']} peak bytes per call against {expected['peak_bytes']}")
+    return found
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed drop in relative speed, as a fraction (default 0.25)")
+    parser.add_argument("--allocation-tolerance", type=float, default=0.10,
+                        help="allowed growth in peak bytes per call, as a fraction (default 0.10)")
+    args = parser.parse_args(argv)
+
+    results = measure()
+    baseline = None
+    if not args.update and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'stage':>20} {'ops/s':>12} {'relative':>9} {'baseline':>9} {'bytes/call':>11}")
+    for name, result in results["stages"].items():
+        expected = baseline["stages"].get(name, {}) if baseline else {}
+        print(f"{name:>20} {result['ops_per_sec']:>12,} {result['relative']:>9.4f} "
+              f"{expected.get('relative', float('nan')):>9.4f} {result['peak_bytes']:>11,}")
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; record one with --update")
+        return 0
+
+    found = regressions(results, baseline, args.tolerance, args.allocation_tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
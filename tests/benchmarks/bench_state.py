@@ -0,0 +1,90 @@
+"""Micro-benchmark of ReclaimState decoding against the previous lazy class.
+
+Run from the repository root with:
+
+    python -m tests.benchmarks.bench_state
+"""
+
+import timeit
+
+from custom_components.reclaimenergy.reclaimv2 import ReclaimState
+
+# realistic full read: every mapped register plus unmapped filler up to 70 pairs
+REGISTERS = {entry[0]: 0 for entry in ReclaimState.modbus_map.values()}
+REGISTERS.update({50: 65500, 79: 104, 200: 1, 40964: 3, 41000: 2, 226: 6500})
+REGISTERS.update({300 + i: i for i in range(70 - len(REGISTERS))})
+PAYLOAD = [x for pair in REGISTERS.items() for x in pair]
+
+# the attributes read by ReclaimStateResponse.from_state
+RESPONSE_FIELDS = (
+    "mode", "pump", "case", "water", "outlet", "inlet", "discharge", "suction",
+    "evaporator", "ambient", "compspeed", "waterspeed", "fanspeed", "power",
+    "current", "hours", "starts", "boost",
+)
+
+
+class LazyReclaimState:
+    """The previous ReclaimState, which decodes on every attribute access."""
+
+    modbus_map = ReclaimState.modbus_map
+
+    def __init__(self, data: dict) -> None:
+        self.data = data
+
+    def __getattr__(self, name: str):
+        try:
+            if self.data:
+                mb = self.modbus_map[name]
+                if mb[0] not in self.data:
+                    return "unavailable"
+
+                if mb[1]:
+                    return mb[1](self.data[mb[0]])
+
+                return self.data[mb[0]]
+            return "unavailable"
+        except (IndexError, KeyError) as e:
+            raise AttributeError from e
+
+
+def lazy_message():
+    data = {PAYLOAD[i]: PAYLOAD[i + 1] for i in range(0, len(PAYLOAD), 2)}
+    state = LazyReclaimState(data)
+    for name in RESPONSE_FIELDS:
+        getattr(state, name)
+
+
+def slotted_message():
+    state = ReclaimState.from_modbus(PAYLOAD)
+    for name in RESPONSE_FIELDS:
+        getattr(state, name)
+
+
+def lazy_sensor_reads(state=LazyReclaimState(ReclaimState.from_modbus(PAYLOAD).data)):
+    for name in RESPONSE_FIELDS:
+        if hasattr(state, name):
+            getattr(state, name)
+
+
+def slotted_sensor_reads(state=ReclaimState.from_modbus(PAYLOAD)):
+    for name in RESPONSE_FIELDS:
+        if hasattr(state, name):
+            getattr(state, name)
+
+
+def main(number: int = 20000) -> None:
+    for lazy, slotted in (
+        (lazy_message, slotted_message),
+        (lazy_sensor_reads, slotted_sensor_reads),
+    ):
+        lazy_time = min(timeit.repeat(lazy, number=number, repeat=5))
+        slotted_time = min(timeit.repeat(slotted, number=number, repeat=5))
+        print(
+            f"{lazy.__name__:>18}: {number / lazy_time:>10.0f} ops/s  "
+            f"{slotted.__name__:>21}: {number / slotted_time:>10.0f} ops/s  "
+            f"({lazy_time / slotted_time:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
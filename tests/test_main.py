@@ -1,9 +1,16 @@
+import asyncio
+import json
+import threading
+import time
+import pyarrow as pa
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, AsyncMock, patch
 
-from main import app, MessageListener
-from model import ReclaimStateResponse, BoostStatus
+from main import app, Device, MessageListener, StateCache, STREAM_DROPPED, _log_data
+from custom_components.reclaimenergy.reclaimv2 import ReclaimState, ReclaimStateStore
+from model import ReclaimStateResponse, BoostStatus, StateStream
+from storage import HistoryWriter, PostgresStore, RecentHistory, SqliteStore
 
 # Mock ReclaimStateResponse objects
 STATE_SUCCESS = ReclaimStateResponse(
@@ -111,17 +118,27 @@ BOOST_OFF_FINAL = ReclaimStateResponse(
     boost=False
 )
 
+DEVICE_ID = 12345678901234567
+OTHER_DEVICE_ID = 76543210987654321
+
 @pytest.fixture
 def client():
-    app.state.reclaimv2 = MagicMock()
-    app.state.listener = MessageListener()
+    app.state.devices = {
+        unique_id: Device(MagicMock(), MessageListener())
+        for unique_id in (DEVICE_ID, OTHER_DEVICE_ID)
+    }
+    app.state.default_device_id = DEVICE_ID
+    app.state.recent = RecentHistory(100)
     return TestClient(app)
 
-@patch('model.ReclaimStateResponse.from_state')
+def _reclaimv2(unique_id: int = DEVICE_ID) -> MagicMock:
+    return app.state.devices[unique_id].reclaimv2
+
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_state_success(mock_from_state, client):
     # Arrange
     mock_from_state.return_value = STATE_SUCCESS
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
 
     # Act
     response = client.get("/state")
@@ -136,7 +153,7 @@ def test_state_success(mock_from_state, client):
 
 def test_state_failure(client):
     # Arrange
-    app.state.reclaimv2.request_update = AsyncMock(return_value=False)
+    _reclaimv2().request_state = AsyncMock(return_value=None)
 
     # Act
     response = client.get("/state")
@@ -144,25 +161,25 @@ def test_state_failure(client):
     # Assert
     assert response.status_code == 204
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_success(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_ON_INITIAL, BOOST_ON_FINAL]
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/on")
 
     # Assert
     assert response.status_code == 200
-    app.state.reclaimv2.set_value.assert_called_once_with("boost", True)
+    _reclaimv2().set_value.assert_called_once_with("boost", True)
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_already_on(mock_from_state, client):
     # Arrange
     mock_from_state.return_value = BOOST_ON_FINAL
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
 
     # Act
     response = client.post("/boost/on")
@@ -172,25 +189,25 @@ def test_boost_on_failure_already_on(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Boost was already ON; will not turn boost ON.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_off_success(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_OFF_INITIAL, BOOST_OFF_FINAL]
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/off")
 
     # Assert
     assert response.status_code == 200
-    app.state.reclaimv2.set_value.assert_called_once_with("boost", False)
+    _reclaimv2().set_value.assert_called_once_with("boost", False)
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_off_failure_already_off(mock_from_state, client):
     # Arrange
     mock_from_state.return_value = BOOST_OFF_FINAL
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
 
     # Act
     response = client.post("/boost/off")
@@ -200,12 +217,12 @@ def test_boost_off_failure_already_off(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Boost was already OFF; will not turn boost OFF.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_off_failure_get_updated_state(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_OFF_INITIAL, None]
-    app.state.reclaimv2.request_update = AsyncMock(side_effect=[True, False])
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(side_effect=[ReclaimState({}), None])
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/off")
@@ -215,12 +232,12 @@ def test_boost_off_failure_get_updated_state(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to get updated state; boost status uncertain.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_off_failure_turn_off_boost(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_OFF_INITIAL, BOOST_OFF_INITIAL]
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/off")
@@ -230,10 +247,10 @@ def test_boost_off_failure_turn_off_boost(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to turn OFF boost.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_off_failure_get_current_state(mock_from_state, client):
     # Arrange
-    app.state.reclaimv2.request_update = AsyncMock(return_value=False)
+    _reclaimv2().request_state = AsyncMock(return_value=None)
 
     # Act
     response = client.post("/boost/off")
@@ -243,12 +260,12 @@ def test_boost_off_failure_get_current_state(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to get current state; will not turn boost OFF.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_get_updated_state(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_ON_INITIAL, None]
-    app.state.reclaimv2.request_update = AsyncMock(side_effect=[True, False])
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(side_effect=[ReclaimState({}), None])
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/on")
@@ -258,12 +275,12 @@ def test_boost_on_failure_get_updated_state(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to get updated state; boost status uncertain.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_turn_on_boost(mock_from_state, client):
     # Arrange
     mock_from_state.side_effect = [BOOST_ON_INITIAL, BOOST_ON_INITIAL]
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
-    app.state.reclaimv2.set_value = AsyncMock()
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
+    _reclaimv2().set_value = AsyncMock()
 
     # Act
     response = client.post("/boost/on")
@@ -273,10 +290,10 @@ def test_boost_on_failure_turn_on_boost(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to turn ON boost.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_get_current_state(mock_from_state, client):
     # Arrange
-    app.state.reclaimv2.request_update = AsyncMock(return_value=False)
+    _reclaimv2().request_state = AsyncMock(return_value=None)
 
     # Act
     response = client.post("/boost/on")
@@ -286,7 +303,7 @@ def test_boost_on_failure_get_current_state(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Failed to get current state; will not turn boost ON.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_heater_running(mock_from_state, client):
     # Arrange
     mock_response = ReclaimStateResponse(
@@ -310,7 +327,7 @@ def test_boost_on_failure_heater_running(mock_from_state, client):
         boost=False
     )
     mock_from_state.return_value = mock_response
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
 
     # Act
     response = client.post("/boost/on")
@@ -320,7 +337,7 @@ def test_boost_on_failure_heater_running(mock_from_state, client):
     json = response.json()
     assert json['detail'] == 'Heater is already running (non-boost); will not turn on boost.'
 
-@patch('model.ReclaimStateResponse.from_state')
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
 def test_boost_on_failure_water_temp_high(mock_from_state, client):
     # Arrange
     mock_response = ReclaimStateResponse(
@@ -344,7 +361,7 @@ def test_boost_on_failure_water_temp_high(mock_from_state, client):
         boost=False
     )
     mock_from_state.return_value = mock_response
-    app.state.reclaimv2.request_update = AsyncMock(return_value=True)
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
 
     # Act
     response = client.post("/boost/on")
@@ -353,3 +370,425 @@ def test_boost_on_failure_water_temp_high(mock_from_state, client):
     assert response.status_code == 409
     json = response.json()
     assert json['detail'] == 'Water temperature is over 55C; will not turn on boost.'
+
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
+def test_state_max_age_served_from_cache(mock_from_state, client):
+    # Arrange
+    mock_from_state.return_value = STATE_SUCCESS
+    _reclaimv2().request_state = AsyncMock(return_value=ReclaimState({}))
+
+    # Act
+    first = client.get("/state")
+    second = client.get("/state", params={"max_age_ms": 60000})
+    third = client.get("/state")
+
+    # Assert
+    assert first.status_code == second.status_code == third.status_code == 200
+    assert _reclaimv2().request_state.await_count == 2
+
+def test_state_cache_coalesces_concurrent_reads():
+    # Arrange
+    async def slow_read():
+        await asyncio.sleep(0.01)
+        return ReclaimState({})
+    reclaimv2 = MagicMock()
+    reclaimv2.request_state = AsyncMock(side_effect=slow_read)
+    cache = StateCache(reclaimv2)
+
+    # Act
+    async def scenario():
+        return await asyncio.gather(*(cache.get() for _ in range(5)))
+    states = asyncio.run(scenario())
+
+    # Assert
+    assert len({id(state) for state in states}) == 1
+    reclaimv2.request_state.assert_awaited_once()
+
+@patch('model.ReclaimStateResponse.ReclaimStateResponse.from_state')
+def test_state_for_device(mock_from_state, client):
+    # Arrange
+    mock_from_state.return_value = STATE_SUCCESS
+    _reclaimv2().request_state = AsyncMock(return_value=None)
+    _reclaimv2(OTHER_DEVICE_ID).request_state = AsyncMock(return_value=ReclaimState({}))
+
+    # Act
+    response = client.get("/state", params={"device_id": OTHER_DEVICE_ID})
+
+    # Assert
+    assert response.status_code == 200
+    _reclaimv2().request_state.assert_not_awaited()
+
+def test_state_unknown_device(client):
+    # Act
+    response = client.get("/state", params={"device_id": 1})
+
+    # Assert
+    assert response.status_code == 404
+
+def test_devices(client):
+    # Act
+    response = client.get("/devices")
+
+    # Assert
+    assert response.json() == {"default": str(DEVICE_ID),
+                               "devices": [str(DEVICE_ID), str(OTHER_DEVICE_ID)]}
+
+def test_logging_records_device_pushes():
+    # Arrange
+    device = Device(MagicMock(), MessageListener())
+    device.reclaimv2.store = ReclaimStateStore()
+    device.reclaimv2.request_state = AsyncMock(return_value=None)
+    app.state.history_writer = MagicMock()
+
+    # Act
+    async def scenario():
+        app.state.stop_logging_event = asyncio.Event()
+        task = asyncio.create_task(_log_data(device, 3600, on_push=True, min_spacing_ms=0))
+        await asyncio.sleep(0)
+        registers = {entry[0]: 0 for entry in ReclaimState.modbus_map.values()}
+        for water in (100, 101):
+            device.listener.on_message(device.reclaimv2.store.apply({79: water}))
+            device.listener.on_message(device.reclaimv2.store.apply({**registers, 40964: 2, 79: water}, full=True))
+            await asyncio.sleep(0.01)
+        app.state.stop_logging_event.set()
+        await task
+    asyncio.run(scenario())
+
+    # Assert
+    put_row = app.state.history_writer.put_row
+    assert put_row.call_count == app.state.logging_stats["recorded"] == 2
+    assert [call.args[0][4] for call in put_row.call_args_list] == [50.0, 50.5]
+    device.reclaimv2.request_state.assert_not_awaited()
+
+def test_logging_polls_without_subscribing():
+    # Arrange
+    device = Device(MagicMock(), MessageListener())
+    device.reclaimv2.store = ReclaimStateStore()
+    device.reclaimv2.request_state = AsyncMock(return_value=None)
+    app.state.history_writer = MagicMock()
+
+    # Act
+    async def scenario():
+        app.state.stop_logging_event = asyncio.Event()
+        task = asyncio.create_task(_log_data(device, 3600, on_push=False, min_spacing_ms=0))
+        await asyncio.sleep(0)
+        subscribers = len(device.listener._subscribers)
+        app.state.stop_logging_event.set()
+        await task
+        return subscribers
+    subscribers = asyncio.run(scenario())
+
+    # Assert
+    assert subscribers == 0
+
+def test_logging_skips_ticks_passed_during_slow_poll():
+    # Arrange
+    device = Device(MagicMock(), MessageListener())
+    device.reclaimv2.store = ReclaimStateStore()
+    app.state.history_writer = MagicMock()
+    interval = 0.2
+    polls = []
+
+    async def slow_poll(max_age_ms=0):
+        polls.append(time.time())
+        await asyncio.sleep(2.5 * interval if len(polls) == 1 else 0)
+        return None
+    device.state_cache.get = slow_poll
+
+    # Act
+    async def scenario():
+        app.state.stop_logging_event = asyncio.Event()
+        task = asyncio.create_task(_log_data(device, interval, on_push=False, min_spacing_ms=0))
+        while len(polls) < 2:
+            await asyncio.sleep(0.01)
+        app.state.stop_logging_event.set()
+        await task
+    asyncio.run(scenario())
+
+    # Assert
+    offsets = [poll / interval - round(poll / interval) for poll in polls]
+    assert all(abs(offset) < 0.15 for offset in offsets)
+    assert round((polls[1] - polls[0]) / interval) == 3
+    assert app.state.logging_stats["missed_ticks"] == 2
+
+def _history_pool(rows: list[dict]) -> MagicMock:
+    connection = MagicMock()
+    connection.fetch = AsyncMock(return_value=rows)
+    pool = MagicMock()
+    pool.acquire.return_value.__aenter__ = AsyncMock(return_value=connection)
+    pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+    return pool
+
+def test_history_since_cursor(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([{'id': 7, 'timestamp_ms': 2000, 'water': 50.0},
+                                    {'id': 8, 'timestamp_ms': 3000, 'water': 51.0}]))
+
+    # Act
+    response = client.get("/history/0/5000", params={"after": "1000:6"})
+
+    # Assert
+    assert response.status_code == 200
+    assert response.json() == {'id': [7, 8], 'timestamp_ms': [2000, 3000], 'water': [50.0, 51.0]}
+    assert response.headers['X-History-Cursor'] == "3000:8"
+    assert response.headers['ETag'] == '"3000:8"'
+    connection = app.state.store.pool.acquire.return_value.__aenter__.return_value
+    assert connection.fetch.call_args.args[1:] == (0, 5000, 1000, 6, None)
+
+def test_history_since_cursor_not_modified(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+
+    # Act
+    response = client.get("/history/0/5000", params={"after": "3000:8"}, headers={"If-None-Match": '"3000:8"'})
+
+    # Assert
+    assert response.status_code == 304
+    assert response.headers['X-History-Cursor'] == "3000:8"
+
+def test_history_bad_cursor(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+
+    # Act
+    response = client.get("/history/0/5000", params={"after": "yesterday"})
+
+    # Assert
+    assert response.status_code == 400
+
+def test_history_bad_limit(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+
+    # Act
+    responses = [client.get("/history/0/5000", params={"after": "1000:1", "limit": limit}) for limit in (0, -1)]
+
+    # Assert
+    assert [response.status_code for response in responses] == [400, 400]
+
+def test_history_stream_columns(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+    connection = app.state.store.pool.acquire.return_value.__aenter__.return_value
+    cursor = MagicMock()
+    cursor.fetch = AsyncMock(side_effect=[[{'id': 1, 'water': 50.0}, {'id': 2, 'water': 51.0}],
+                                          [{'id': 3, 'water': 52.0}], []])
+    connection.cursor = AsyncMock(return_value=cursor)
+
+    # Act
+    response = client.get("/history/0/5000", params={"stream": "columns"})
+
+    # Assert
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {'id': [1, 2], 'water': [50.0, 51.0]},
+        {'id': [3], 'water': [52.0]},
+    ]
+    connection.fetch.assert_not_awaited()
+
+def test_history_export_arrow(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+    connection = app.state.store.pool.acquire.return_value.__aenter__.return_value
+    cursor = MagicMock()
+    cursor.fetch = AsyncMock(side_effect=[[{'timestamp_ms': 1000, 'water': 50.5, 'boost': True},
+                                           {'timestamp_ms': 2000, 'water': None, 'boost': False}], []])
+    connection.cursor = AsyncMock(return_value=cursor)
+
+    # Act
+    response = client.get("/history/0/5000", params={"export": "arrow", "fields": "timestamp_ms,water,boost",
+                                                     "compression": "zstd"})
+
+    # Assert
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.schema.types == [pa.int64(), pa.float32(), pa.bool_()]
+    assert table.to_pydict() == {'timestamp_ms': [1000, 2000], 'water': [50.5, None], 'boost': [True, False]}
+    assert connection.cursor.call_args.args[0].split('FROM')[0].split() == ['SELECT', '"timestamp_ms",', '"water",', '"boost"']
+
+def test_history_export_unknown_field(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([]))
+
+    # Act
+    response = client.get("/history/0/5000", params={"export": "parquet", "fields": "water,password"})
+
+    # Assert
+    assert response.status_code == 400
+
+def test_history_fields_and_filters(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([{'id': 7, 'timestamp_ms': 2000, 'water': 42.0}]))
+
+    # Act
+    response = client.get("/history/0/5000", params=[("fields", "water"), ("where", "boost=true"), ("where", "water<45")])
+
+    # Assert
+    assert response.status_code == 200
+    assert response.json() == {'id': [7], 'timestamp_ms': [2000], 'water': [42.0]}
+    connection = app.state.store.pool.acquire.return_value.__aenter__.return_value
+    query, *params = connection.fetch.call_args.args
+    assert query.split('FROM')[0].split() == ['SELECT', '"id",', '"timestamp_ms",', '"water"']
+    assert 'AND "boost" = $3 AND "water" < $4' in query
+    assert params == [0, 5000, True, 45.0]
+
+def _full_state(water: int = 100) -> ReclaimState:
+    registers = {entry[0]: 0 for entry in ReclaimState.modbus_map.values()}
+    return ReclaimState({**registers, 40964: 2, 79: water})
+
+def test_listener_drops_slow_subscriber():
+    # Arrange
+    listener = MessageListener()
+
+    dropped = STREAM_DROPPED.labels().value
+
+    # Act
+    async def scenario():
+        with listener.subscribe(maxsize=2, drop_slow=True) as slow, listener.subscribe(maxsize=2) as lossy:
+            for water in (100, 101, 102, 103):
+                listener.on_message(_full_state(water))
+            return [slow.get_nowait() for _ in range(slow.qsize())], lossy.qsize(), len(listener._subscribers)
+    slow, lossy_size, subscribers = asyncio.run(scenario())
+
+    # Assert
+    assert slow == [None]
+    assert lossy_size == 2
+    assert subscribers == 1
+    assert STREAM_DROPPED.labels().value - dropped == 3
+
+def test_stream_socket_sends_full_state(client):
+    # Arrange
+    app.state.devices[DEVICE_ID].listener.state = _full_state()
+
+    # Act
+    with client.websocket_connect("/stream") as websocket:
+        frame = websocket.receive_json()
+
+    # Assert
+    assert frame['water'] == 50.0 and frame['mode'] == "Mode 1: 24H" and 'timestamp_ms' in frame
+    assert set(frame) == {'timestamp_ms', *StateStream.FIELDS}
+
+def test_stream_socket_binary(client):
+    # Arrange
+    app.state.devices[DEVICE_ID].listener.state = _full_state()
+
+    # Act
+    with client.websocket_connect("/stream?binary=true") as websocket:
+        frame = websocket.receive_bytes()
+
+    # Assert
+    decoded = StateStream.decode_binary(frame)
+    assert decoded['water'] == 50.0 and decoded['mode'] == "Mode 1: 24H" and decoded['boost'] is False
+
+def test_tables_single_cached_query(client):
+    # Arrange
+    app.state.store = PostgresStore(_history_pool([
+        {'table_name': 'reclaim_state_history', 'column_name': 'id', 'data_type': 'integer'},
+        {'table_name': 'reclaim_state_history', 'column_name': 'water', 'data_type': 'real'},
+        {'table_name': 'empty', 'column_name': None, 'data_type': None},
+    ]))
+    app.state.store.schema_version = 4
+    app.state.tables_cache = None
+    connection = app.state.store.pool.acquire.return_value.__aenter__.return_value
+
+    # Act
+    first = client.get("/tables").json()
+    second = client.get("/tables").json()
+    app.state.store.schema_version = 5
+    client.get("/tables")
+
+    # Assert
+    assert first == second == {'reclaim_state_history': {'id': 'integer', 'water': 'real'}, 'empty': {}}
+    assert connection.fetch.await_count == 2
+    assert connection.fetch.call_args.args[1] == ['pg_catalog', 'information_schema']
+
+def test_history_recent_range_from_memory(client):
+    # Arrange
+    app.state.store = None
+    for i in range(5):
+        app.state.recent.append((i + 1, 1000 * (i + 1), "Mode 1: 24H", True, *[40.0 + i] * 15, False))
+
+    # Act
+    covered = client.get("/history/2000/5000", params={"fields": "water"})
+    older = client.get("/history/0/5000", params={"fields": "water"})
+
+    # Assert
+    assert covered.status_code == 200
+    assert covered.json() == {'id': [2, 3, 4, 5], 'timestamp_ms': [2000, 3000, 4000, 5000],
+                              'water': [41.0, 42.0, 43.0, 44.0]}
+    assert covered.headers['X-History-Cursor'] == "5000:5"
+    assert older.status_code == 503
+
+def test_startup_brings_services_up_concurrently(tmp_path):
+    # Arrange
+    # each startup task waits for the other, so run one after the other both time out and fail
+    both_started = threading.Barrier(2, timeout=5)
+
+    def obtain_keys(*paths):
+        both_started.wait()
+        return True
+
+    async def open_store():
+        await asyncio.to_thread(both_started.wait)
+        return SqliteStore(str(tmp_path / "history.db"))
+
+    # Act
+    with patch('main._read_unique_ids', return_value=[DEVICE_ID]), \
+            patch('main.obtain_and_save_aws_keys', side_effect=obtain_keys), \
+            patch('main._open_store', side_effect=open_store), \
+            patch('main.HISTORY_SPOOL_PATH', str(tmp_path / "history.spool")), \
+            patch('main.ReclaimFleet.connect', new_callable=AsyncMock) as connect, \
+            patch('main.HistoryWriter.start', new_callable=AsyncMock):
+        with TestClient(app) as started_client:
+            health = started_client.get("/health")
+
+    # Assert
+    connect.assert_awaited_once()
+    assert health.status_code == 503
+    assert health.json() == {'credentials': 'ready', 'mqtt': 'connecting', 'database': 'ready'}
+
+def test_health_without_credentials(client):
+    # Arrange
+    app.state.credentials_ready = False
+    app.state.store = PostgresStore(_history_pool([]))
+
+    # Act
+    response = client.get("/health")
+
+    # Assert
+    assert response.status_code == 503
+    assert response.json() == {'credentials': 'failed', 'mqtt': 'failed', 'database': 'ready'}
+
+def _samples(client: TestClient) -> dict[str, float]:
+    lines = client.get("/metrics").text.splitlines()
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1]) for line in lines if not line.startswith('#')}
+
+def test_metrics_exposition(client):
+    # Arrange
+    app.state.store = None
+    app.state.fleet = MagicMock(messages_dropped=1)
+    app.state.history_writer = HistoryWriter(None)
+    for device in app.state.devices.values():
+        device.reclaimv2.configure_mock(messages_received=4, messages_dropped=0, decode_seconds=0.002)
+    app.state.recent.append((1, 1000, "Mode 1: 24H", True, *[40.0] * 15, False))
+    query = 'reclaim_history_query_seconds_bucket{endpoint="/history",query="raw",source="memory",le="+Inf"}'
+    boost = 'reclaim_boost_toggles_total{action="on",outcome="rejected"}'
+    before = _samples(client)
+
+    # Act
+    client.get("/history/1000/2000", params={"fields": "water"})
+    with patch('main._get_latest_state', AsyncMock(return_value=BOOST_ON_INITIAL.model_copy(update={'pump': True}))):
+        client.post("/boost/on")
+    response = client.get("/metrics")
+    after = _samples(client)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert '# TYPE reclaim_history_query_seconds histogram' in response.text.splitlines()
+    assert after[query] - before.get(query, 0) == 1
+    assert after[boost] - before.get(boost, 0) == 1
+    assert after[f'reclaim_mqtt_decode_seconds_count{{device="{DEVICE_ID}"}}'] == 4
+    assert after['reclaim_mqtt_messages_dropped_total{device="unknown"}'] == 1
+    assert after['reclaim_history_pending_rows'] == 0
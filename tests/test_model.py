@@ -0,0 +1,48 @@
+from model import ReclaimStateResponse, StateStream
+
+STATE = ReclaimStateResponse(
+    mode="Mode 1: 24H",
+    pump=True,
+    case=50.0,
+    water=60.0,
+    outlet=1.0,
+    inlet=2.0,
+    discharge=3.0,
+    suction=4.0,
+    evaporator=5.0,
+    ambient=6.0,
+    compspeed=7,
+    waterspeed=8,
+    fanspeed=9,
+    power=10,
+    current=11.0,
+    hours=12.0,
+    starts=13.0,
+    boost=False
+)
+
+def test_state_stream_sends_only_changes():
+    # Arrange
+    encoder = StateStream()
+
+    # Act
+    first = encoder.diff(STATE)
+    unchanged = encoder.json_frame(1, STATE)
+    changed = encoder.json_frame(2, STATE.model_copy(update={'water': 61.0, 'boost': True}))
+
+    # Assert
+    assert first == STATE.model_dump()
+    assert unchanged is None
+    assert changed == '{"timestamp_ms": 2, "water": 61.0, "boost": true}'
+
+def test_state_stream_binary_round_trip():
+    # Arrange
+    encoder = StateStream()
+    encoder.diff(STATE)
+
+    # Act
+    frame = encoder.binary_frame(1700000000000, STATE.model_copy(update={'power': 1500, 'mode': "Mode 5: User Timers"}))
+
+    # Assert
+    assert len(frame) == 8 + 4 + 1 + 4
+    assert StateStream.decode_binary(frame) == {'timestamp_ms': 1700000000000, 'mode': "Mode 5: User Timers", 'power': 1500}
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import math
+from contextlib import suppress
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from custom_components.reclaimenergy.const import MAX_RECONNECT_DELAY
+from custom_components.reclaimenergy.reclaimv2 import (
+    MessageListener,
+    ReclaimFleet,
+    ReclaimState,
+    ReclaimV2,
+    reconnect_delay,
+)
+
+UNIQUE_ID = 12345678901234567
+
+FULL_READ = {
+    "messageId": "read",
+    "modbusReg": 1,
+    "modbusVal": [79, 100, 200, 1, 40964, 2, 40990, 0],
+}
+
+
+def _message(payload: dict, topic: str = "") -> SimpleNamespace:
+    return SimpleNamespace(payload=json.dumps(payload).encode(), topic=topic)
+
+
+def _connected_api(**kwargs) -> ReclaimV2:
+    api = ReclaimV2(UNIQUE_ID, "ca.pem", "cert.pem", "key.pem", **kwargs)
+    api._connected = True
+    api._client = MagicMock()
+    api._client.publish = AsyncMock()
+    return api
+
+
+def test_state_decodes_registers_once():
+    state = ReclaimState.from_modbus([50, 65535, 226, 6500, 40964, 99, 41000, 2, 7, 7])
+
+    assert state.case == -0.5
+    assert state.current == 6.5
+    assert state.mode8_day == "Mon"
+    assert state.water == "unavailable"
+    assert not hasattr(state, "mode")
+    assert not hasattr(state, "unknown")
+    assert state.data[7] == 7
+    assert ReclaimState(state.data).case == state.case
+
+
+def test_empty_state_is_unavailable():
+    state = ReclaimState({})
+
+    assert state.mode == "unavailable"
+    assert state.boost == "unavailable"
+
+
+def test_request_state_resolves_on_next_full_read():
+    async def scenario():
+        api = _connected_api()
+        listener = MessageListener()
+        task = asyncio.create_task(api.request_state())
+        await asyncio.sleep(0)
+        api._process_message(_message(FULL_READ), listener)
+        return api, await task
+
+    api, state = asyncio.run(scenario())
+
+    assert state.water == 50.0
+    assert state.pump == 1
+    assert state.mode == "Mode 1: 24H"
+    assert api.last_round_trip is not None
+    assert api._pending_reads == []
+    api._client.publish.assert_awaited_once()
+
+
+def test_request_state_ignores_write_acks():
+    async def scenario():
+        api = _connected_api()
+        listener = MessageListener()
+        task = asyncio.create_task(api.request_state(timeout=0.05))
+        await asyncio.sleep(0)
+        api._process_message(
+            _message({"messageId": "write", "modbusReg": 40990, "modbusVal": [1]}),
+            listener,
+        )
+        return api, await task
+
+    api, state = asyncio.run(scenario())
+
+    assert state is None
+    assert api.last_round_trip is None
+    assert api._pending_reads == []
+
+
+def test_request_state_not_connected():
+    api = ReclaimV2(UNIQUE_ID, "ca.pem", "cert.pem", "key.pem")
+
+    assert asyncio.run(api.request_state()) is None
+    assert api._pending_reads == []
+
+
+def test_fleet_routes_messages_by_topic():
+    fleet = ReclaimFleet("ca.pem", "cert.pem", "key.pem")
+    listeners = {unique_id: MagicMock() for unique_id in (UNIQUE_ID, UNIQUE_ID + 1000)}
+    devices = {
+        unique_id: fleet.add_device(unique_id, listener)
+        for unique_id, listener in listeners.items()
+    }
+
+    fleet._route_message(_message(FULL_READ, devices[UNIQUE_ID + 1000].subscribe_topic))
+    fleet._route_message(_message(FULL_READ, "dontek0000/status/psw"))
+
+    listeners[UNIQUE_ID].on_message.assert_not_called()
+    listeners[UNIQUE_ID + 1000].on_message.assert_called_once()
+
+
+def test_fleet_shares_client_between_devices():
+    fleet = ReclaimFleet("ca.pem", "cert.pem", "key.pem")
+    devices = [fleet.add_device(UNIQUE_ID + 1000 * i, MessageListener()) for i in range(3)]
+    client = MagicMock()
+
+    fleet._connected = True
+    fleet._attach(client)
+
+    assert all(device._client is client and device._connected for device in devices)
+    fleet._attach(None)
+    assert all(device._client is None for device in devices)
+
+
+def test_decode_batch_matches_state():
+    payloads = [
+        FULL_READ["modbusVal"] + [50, 65535, 226, 6500, 41000, 2],
+        [79, 65436, 40964, 99, 40990, 1, 40971, 1792],
+        [],
+    ]
+
+    columns = ReclaimState.decode_batch(payloads)
+
+    assert columns["water"].tolist()[:2] == [50.0, -50.0]
+    assert columns["case"][0] == -0.5
+    assert columns["current"][0] == 6.5
+    assert columns["mode"].tolist() == ["Mode 1: 24H", None, None]
+    assert columns["mode8_day"].tolist() == ["Mon", None, None]
+    assert columns["boost"].tolist() == [False, True, False]
+    assert columns["mode5_timer1_start"][1] == 7
+    assert math.isnan(columns["pump"][1])
+    state = ReclaimState.from_modbus(payloads[0])
+    for name in ("pump", "water", "case", "current", "mode", "boost"):
+        assert columns[name][0] == getattr(state, name)
+
+
+def test_write_ack_merges_into_last_read():
+    api = _connected_api()
+    listener = MagicMock()
+
+    api._process_message(_message(FULL_READ), listener)
+    api._process_message(
+        _message({"messageId": "write", "modbusReg": 40990, "modbusVal": [1]}), listener
+    )
+
+    state = listener.on_message.call_args.args[0]
+    assert state.boost is True
+    assert state.water == 50.0
+    assert api.store.version == 2
+    assert api.store.updated_ms[40990] >= api.store.updated_ms[79] == api.store.read_ms
+
+
+class _SilentClient:
+    """An aiomqtt.Client stand-in that connects but never delivers a message."""
+
+    connections = 0
+
+    def __init__(self, **kwargs) -> None:
+        _SilentClient.connections += 1
+        self.subscribe = AsyncMock()
+        self.publish = AsyncMock()
+        self.messages = self._messages()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def _messages(self):
+        await asyncio.Event().wait()
+        yield
+
+
+def test_full_read_replaces_last_read():
+    api = _connected_api()
+    listener = MagicMock()
+
+    api._process_message(_message(FULL_READ), listener)
+    api._process_message(_message({**FULL_READ, "modbusVal": [79, 100, 40964, 2]}), listener)
+
+    state = listener.on_message.call_args.args[0]
+    assert 40990 not in state.data and 1 not in state.data
+    assert 40990 not in api.store.updated_ms
+    assert state.water == 50.0
+
+
+def test_watchdog_reconnects_after_unanswered_requests():
+    async def scenario():
+        api = ReclaimV2(UNIQUE_ID, "ca.pem", "cert.pem", "key.pem", request_timeout=0.05)
+        tls_context = api._tls_context = MagicMock()
+        _SilentClient.connections = 0
+        with patch("aiomqtt.Client", _SilentClient), \
+                patch("custom_components.reclaimenergy.reclaimv2.reconnect_delay", return_value=0):
+            await api.connect(MessageListener())
+            await asyncio.sleep(0.01)
+            await api.request_update()
+            api._process_message(_message(FULL_READ), MessageListener())
+            answered = api._watchdog.when()
+            await api.request_update()
+            await api.request_update()
+            await api.request_update()
+            await asyncio.sleep(0.1)
+            connections = _SilentClient.connections
+            await api.disconnect()
+        return answered, connections, api._tls_context is tls_context
+
+    answered, connections, same_tls_context = asyncio.run(scenario())
+
+    assert answered is None
+    assert connections == 2
+    assert same_tls_context
+
+
+def test_watchdog_reconnects_back_off():
+    async def scenario():
+        api = ReclaimV2(UNIQUE_ID, "ca.pem", "cert.pem", "key.pem", request_timeout=0.02)
+        api._tls_context = MagicMock()
+        attempts = []
+
+        def delay(attempt):
+            attempts.append(attempt)
+            return 0
+
+        with patch("aiomqtt.Client", _SilentClient), \
+                patch("custom_components.reclaimenergy.reclaimv2.reconnect_delay", side_effect=delay):
+            await api.connect(MessageListener())
+            with suppress(TimeoutError):
+                async with asyncio.timeout(5):
+                    while len(attempts) < 3:
+                        await asyncio.sleep(0.01)
+                        if api._client:
+                            await api.request_update()
+            await api.disconnect()
+        return attempts
+
+    attempts = asyncio.run(scenario())
+
+    assert attempts[:3] == [0, 1, 2]
+
+
+def test_reconnect_delay_grows_with_jitter():
+    delays = [reconnect_delay(attempt) for attempt in range(12)]
+
+    assert 0.5 <= delays[0] <= 1
+    assert 4 <= delays[3] <= 8
+    assert MAX_RECONNECT_DELAY / 2 <= delays[-1] <= MAX_RECONNECT_DELAY
@@ -0,0 +1,515 @@
+import argparse
+import asyncio
+import math
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+import pytest
+
+from model import ReclaimStateResponse
+from storage import (HistoryCompressor, HistorySpool, HistoryWriter, PostgresStore, RecentHistory, SqliteStore,
+                     downsample, export, history_row, query, rollup)
+from storage.HistorySpool import encode_row
+from storage.const import HISTORY_COLUMNS, ROLLUP_TIERS
+from storage.migrations import month_bounds
+
+STATE = ReclaimStateResponse(
+    mode="Mode 1: 24H",
+    pump=True,
+    case=50.0,
+    water=60.0,
+    outlet=1.0,
+    inlet=2.0,
+    discharge=3.0,
+    suction=4.0,
+    evaporator=5.0,
+    ambient=6.0,
+    compspeed=7,
+    waterspeed=8,
+    fanspeed=9,
+    power=10,
+    current=11.0,
+    hours=12.0,
+    starts=13.0,
+    boost=False
+)
+
+def _pool() -> MagicMock:
+    connection = MagicMock()
+    connection.copy_records_to_table = AsyncMock()
+    connection.execute = AsyncMock()
+    connection.executemany = AsyncMock()
+    connection.fetchval = AsyncMock(return_value=41)
+    pool = MagicMock()
+    pool.connection = connection
+
+    @asynccontextmanager
+    async def acquire():
+        yield connection
+    pool.acquire = acquire
+    return pool
+
+def test_history_writer_flushes_on_size():
+    # Arrange
+    pool = _pool()
+
+    # Act
+    async def scenario():
+        writer = HistoryWriter(PostgresStore(pool), max_rows=3, flush_interval=60)
+        await writer.start()
+        for timestamp_ms in range(3):
+            writer.put(timestamp_ms, STATE)
+        await asyncio.sleep(0.01)
+        pending = writer.pending
+        await writer.close()
+        return pending
+    pending = asyncio.run(scenario())
+
+    # Assert
+    assert pending == 0
+    copy = pool.connection.copy_records_to_table
+    copy.assert_awaited_once()
+    assert copy.call_args.kwargs['columns'] == query.RAW_FIELDS
+    assert [row[:2] for row in copy.call_args.kwargs['records']] == [(42, 0), (43, 1), (44, 2)]
+    assert copy.call_args.kwargs['records'][0][2:5] == ("Mode 1: 24H", True, 50.0)
+    assert pool.connection.executemany.await_count == 3
+
+def test_history_writer_flushes_pending_on_close():
+    # Arrange
+    pool = _pool()
+
+    # Act
+    async def scenario():
+        writer = HistoryWriter(PostgresStore(pool), max_rows=100, flush_interval=60)
+        await writer.start()
+        writer.put(1, STATE)
+        await asyncio.sleep(0)
+        await writer.close()
+    asyncio.run(scenario())
+
+    # Assert
+    pool.connection.copy_records_to_table.assert_awaited_once()
+
+def _series(count: int) -> list[tuple]:
+    rows = []
+    for i in range(count):
+        heating = 300 <= i < 400
+        state = STATE.model_copy(update={
+            'pump': heating,
+            'boost': 350 <= i < 353,
+            'water': 40 + (0.05 * (i - 300) if heating else 0) + 0.2 * math.sin(i),
+            'ambient': 15 + 5 * math.sin(i / 100),
+            'power': 1500 if heating else 0,
+        })
+        rows.append(history_row(i * 10000, state))
+    return rows
+
+def _interpolate(kept: list[tuple], timestamp_ms: int, index: int) -> float:
+    for before, after in zip(kept, kept[1:]):
+        if before[0] <= timestamp_ms <= after[0]:
+            fraction = (timestamp_ms - before[0]) / (after[0] - before[0])
+            return before[index] + fraction * (after[index] - before[index])
+    raise AssertionError(f"{timestamp_ms} not covered")
+
+def test_history_compressor_keeps_signal_within_deadband():
+    # Arrange
+    rows = _series(1000)
+    compressor = HistoryCompressor(heartbeat_ms=10 ** 9)
+
+    # Act
+    kept = [kept for row in rows for kept in compressor.add(row)] + compressor.flush()
+
+    # Assert
+    assert len(kept) < len(rows) / 5
+    assert kept[0] == rows[0] and kept[-1] == rows[-1]
+    water, ambient = HISTORY_COLUMNS.index('water'), HISTORY_COLUMNS.index('ambient')
+    for row in rows:
+        assert abs(_interpolate(kept, row[0], water) - row[water]) <= 0.5 + 1e-9
+        assert abs(_interpolate(kept, row[0], ambient) - row[ambient]) <= 0.5 + 1e-9
+    boost = HISTORY_COLUMNS.index('boost')
+    assert [row[0] for row in kept if row[boost]] == [3500000, 3520000]
+
+def test_history_compressor_heartbeat():
+    # Arrange
+    rows = [history_row(i * 60000, STATE) for i in range(100)]
+    compressor = HistoryCompressor(heartbeat_ms=15 * 60000)
+
+    # Act
+    kept = [kept for row in rows for kept in compressor.add(row)]
+
+    # Assert
+    assert [row[0] // 60000 for row in kept] == [0, 15, 30, 45, 60, 75, 90]
+
+def test_history_compressor_keeps_single_sample_boost():
+    # Arrange
+    rows = [history_row(i * 1000, STATE.model_copy(update={'boost': i == 1})) for i in range(4)]
+    compressor = HistoryCompressor(heartbeat_ms=10 ** 9)
+
+    # Act
+    kept = [kept for row in rows for kept in compressor.add(row)] + compressor.flush()
+
+    # Assert
+    boost = HISTORY_COLUMNS.index('boost')
+    assert [(row[0], row[boost]) for row in kept] == [(0, False), (1000, True), (2000, False), (3000, False)]
+
+def test_history_compressor_keeps_mode_flip():
+    # Arrange
+    modes = ["Mode 1: 24H"] * 3 + ["Mode 2: Timer"] * 3
+    rows = [history_row(i * 1000, STATE.model_copy(update={'mode': mode})) for i, mode in enumerate(modes)]
+    compressor = HistoryCompressor(heartbeat_ms=10 ** 9)
+
+    # Act
+    kept = [kept for row in rows for kept in compressor.add(row)] + compressor.flush()
+
+    # Assert
+    assert [row[0] for row in kept] == [0, 2000, 3000, 5000]
+
+def test_month_bounds_wraps_year():
+    # Arrange
+    december_ms = 1733097600000  # 2024-12-02T00:00:00Z
+
+    # Act
+    start, end = month_bounds(december_ms)
+
+    # Assert
+    assert start == 1733011200000  # 2024-12-01
+    assert end == 1735689600000  # 2025-01-01
+
+def test_bucket_width_fits_max_points():
+    # Act
+    width = downsample.bucket_width(0, 365 * 86400000 - 1, 2000)
+
+    # Assert
+    assert width * 2000 >= 365 * 86400000
+    assert (365 * 86400000 - 1) // width < 2000
+
+def test_lttb_keeps_spike():
+    # Arrange
+    x = np.arange(10000, dtype=np.float64)
+    y = np.sin(x / 500)
+    y[4321] = 50.0
+    y[100:200] = np.nan
+
+    # Act
+    kept = downsample.lttb(x, y, 200)
+
+    # Assert
+    assert len(kept) == 200
+    assert kept[0] == 0 and kept[-1] == 9999
+    assert 4321 in kept
+    assert np.all(np.diff(kept) > 0)
+
+def test_rollup_aggregate_merges_bucket():
+    # Arrange
+    rows = [history_row(i * 20000, STATE.model_copy(update={'water': 50.0 + i, 'boost': i == 1, 'mode': f"m{i}"}))
+            for i in range(4)]
+
+    # Act
+    buckets = rollup.aggregate(rows, 60000)
+
+    # Assert
+    assert [bucket[0] for bucket in buckets] == [0, 60000]
+    first = dict(zip(("bucket_ms", *rollup.ROLLUP_COLUMNS), buckets[0]))
+    assert first['samples'] == 3 and first['last_ms'] == 40000 and first['mode'] == "m2"
+    assert (first['boost_true'], first['boost_count']) == (1, 3)
+    assert (first['water_min'], first['water_max'], first['water_sum'], first['water_count']) == (50.0, 52.0, 153.0, 3)
+
+def test_postgres_delete_rebuilds_rollups():
+    # Arrange
+    pool = _pool()
+    rows = _series(20)
+    remaining = rows[10:]
+    pool.connection.fetch = AsyncMock(side_effect=[[{'timestamp_ms': row[0]} for row in rows[:10]], remaining])
+
+    # Act
+    deleted = asyncio.run(PostgresStore(pool).delete(1, 10))
+
+    # Assert
+    assert deleted == 10
+    rebuilt = [call.args[1] for call in pool.connection.executemany.await_args_list]
+    assert rebuilt == [rollup.aggregate(remaining, tier_ms) for _, tier_ms in ROLLUP_TIERS]
+    cleared = [call.args[1:] for call in pool.connection.execute.await_args_list]
+    assert cleared == [(0, 86400000)] * len(ROLLUP_TIERS)
+
+def test_rollup_plan_aligns_to_coarsest_tier():
+    # Arrange
+    start, end = 1735689600000 + 1234, 1735689600000 + 30 * 86400000
+
+    # Act
+    hourly = rollup.plan(start, end, max_points=300)
+    explicit = rollup.plan(start, end, bucket_ms=90 * 60000)
+    raw = rollup.plan(start, end, bucket_ms=30000)
+
+    # Assert
+    assert hourly == ("1h", 1735689600000, 3 * 3600000)
+    assert explicit == ("1m", 1735689600000, 90 * 60000)
+    assert raw == (None, start, 30000)
+
+def test_compile_filters_typed_parameters():
+    # Act
+    filters = query.parse_filters(["boost=true", "water < 45", "compspeed>=3000", "mode!=Mode 1: 24H"])
+    sql, params = query.compile_filters(filters, 3)
+
+    # Assert
+    assert sql == ' AND "boost" = $3 AND "water" < $4 AND "compspeed" >= $5 AND "mode" != $6'
+    assert params == [True, 45.0, 3000, "Mode 1: 24H"]
+
+def test_compile_filters_rejects_bad_filters():
+    for text in ("boost<true", "water<warm", "password=1", "water"):
+        with pytest.raises(ValueError):
+            query.parse_filters([text])
+
+def test_parse_fields_adds_required():
+    # Act
+    fields = query.parse_fields("water,outlet,water", required=("id", "timestamp_ms"))
+
+    # Assert
+    assert fields == ["id", "timestamp_ms", "water", "outlet"]
+
+def test_sqlite_store_history_reads(tmp_path):
+    # Arrange
+    store = SqliteStore(str(tmp_path / "history.db"))
+
+    # Act
+    async def scenario():
+        await store.open()
+        writer = HistoryWriter(store, max_rows=100, flush_interval=60)
+        await writer.start()
+        for row in _series(1000):
+            writer.put_row(row)
+        await writer.close()
+        raw = await store.fetch_raw(0, 10 ** 9, ["id", "timestamp_ms", "boost"], query.parse_filters(["boost=true"]))
+        since = await store.fetch_since(0, 10 ** 9, (raw[0]['timestamp_ms'], raw[0]['id']), 1,
+                                        ["id", "timestamp_ms"], [])
+        buckets = await store.fetch_buckets(0, 10 ** 9, ["mode", "pump", "water"], [], 1000000, None)
+        newest = await store.newest(0, 10 ** 9)
+        blocks = [len(block) async for block in store.raw_blocks(0, 10 ** 9, ["id"], [], block_rows=400)]
+        tables = await store.tables()
+        deleted = await store.delete(1, 500)
+        await store.close()
+        return raw, since, buckets, newest, blocks, tables, deleted
+    raw, since, buckets, newest, blocks, tables, deleted = asyncio.run(scenario())
+
+    # Assert
+    assert [(row['timestamp_ms'], row['boost']) for row in raw] == [(3500000, True), (3510000, True), (3520000, True)]
+    assert [row['timestamp_ms'] for row in since] == [3510000]
+    assert len(buckets) == 10 and buckets[3]['timestamp_ms'] == 3000000 and buckets[3]['samples'] == 100
+    assert buckets[3]['pump'] is True and buckets[3]['pump_fraction'] == 1.0 and buckets[2]['pump'] is False
+    assert buckets[3]['mode'] == "Mode 1: 24H" and buckets[3]['water_max'] > buckets[3]['water'] > buckets[3]['water_min']
+    assert newest == (9990000, 1000)
+    assert blocks == [400, 400, 200]
+    assert tables['reclaim_state_history']['boost'] == 'INTEGER'
+    assert deleted == 500
+
+def test_export_cli_leaves_schema_alone(tmp_path):
+    # Arrange
+    path = str(tmp_path / "history.db")
+    sqlite3.connect(path).close()
+    args = argparse.Namespace(start_timestamp_ms=0, end_timestamp_ms=10 ** 9, output=str(tmp_path / "out.arrow"),
+                              format=None, compression=None, fields=None, where=[], sqlite=path)
+
+    # Act
+    with pytest.raises(SystemExit):
+        asyncio.run(export._export(args))
+    with sqlite3.connect(path) as connection:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        tables = connection.execute("SELECT name FROM sqlite_master").fetchall()
+
+    # Assert
+    assert version == 0 and tables == []
+
+def test_recent_history_matches_store(tmp_path):
+    # Arrange
+    store = SqliteStore(str(tmp_path / "history.db"))
+    recent = RecentHistory(capacity=600)
+    start, end = 4020000, 9000000
+
+    # Act
+    async def scenario():
+        await store.open()
+        writer = HistoryWriter(store, max_rows=100, flush_interval=60, recent=recent)
+        await writer.start()
+        for row in _series(1000):
+            writer.put_row(row)
+        await writer.close()
+        reads = []
+        for source in (store, recent):
+            reads.append([
+                await source.fetch_raw(start, end, ["id", "timestamp_ms", "mode", "water", "power", "boost"],
+                                       query.parse_filters(["water>40.1"]), sample_rate=3),
+                await source.fetch_since(start, end, (5000000, 501), 5, ["id", "timestamp_ms"], []),
+                await source.fetch_buckets(start, end, ["mode", "pump", "water", "power"], [], None, 40),
+                await source.fetch_buckets(start, end, ["boost", "ambient"], query.parse_filters(["boost=false"]), 60000, None),
+                await source.newest(start, end),
+            ])
+        await store.close()
+        return reads
+    from_store, from_memory = asyncio.run(scenario())
+
+    # Assert
+    assert recent.covers(4000000) and not recent.covers(3990000)
+    assert all(len(records) > 0 for records in from_memory[:4])
+    assert all(type(record['pump']) is bool for record in from_memory[2])
+    for memory, stored in zip(from_memory[:4], from_store[:4]):
+        assert [list(record) for record in memory] == [list(record) for record in stored]
+        for memory_record, stored_record in zip(memory, stored):
+            assert memory_record == pytest.approx(stored_record, rel=1e-6)
+    assert from_memory[4] == from_store[4] == (9000000, 901)
+
+def test_recent_history_filters_in_single_precision(tmp_path):
+    # Arrange
+    store = SqliteStore(str(tmp_path / "history.db"))
+    recent = RecentHistory(capacity=100)
+    rows = [history_row(i * 1000, STATE.model_copy(update={'current': 0.123 if i % 2 else 0.5})) for i in range(10)]
+    filters = query.parse_filters(["current=0.123"])
+
+    # Act
+    async def scenario():
+        await store.open()
+        writer = HistoryWriter(store, recent=recent)
+        await writer.start()
+        for row in rows:
+            writer.put_row(row)
+        await writer.close()
+        reads = [[record['id'] for record in await source.fetch_raw(0, 10 ** 9, ["id"], filters)]
+                 for source in (store, recent)]
+        await store.close()
+        return reads
+    from_store, from_memory = asyncio.run(scenario())
+
+    # Assert
+    assert from_memory == from_store == [2, 4, 6, 8, 10]
+
+def test_recent_history_wraps_and_deletes():
+    # Arrange
+    recent = RecentHistory(capacity=4)
+
+    # Act
+    for i in range(6):
+        recent.append((i + 1, i * 1000, "m", *[float(i)] * 17))
+    recent.append((7, 2500, "m", *[0.0] * 17))
+    recent.delete(4, 4)
+    rows = asyncio.run(recent.fetch_raw(0, 10000, ["id", "timestamp_ms"], []))
+
+    # Assert
+    assert [row['id'] for row in rows] == [3, 5, 6]
+    assert not recent.covers(2000) and recent.covers(2501)
+
+def test_history_spool_round_trips_rows(tmp_path):
+    # Arrange
+    spool = HistorySpool(str(tmp_path / "history.spool"))
+    rows = [(i + 1, *row) for i, row in enumerate(_series(3))]
+    rows[1] = rows[1][:2] + (None, None) + rows[1][4:-1] + (None,)
+
+    # Act
+    spool.append(rows)
+    with open(spool.path, "ab") as torn:
+        torn.write(b"\x40\x00\x00\x00partial")
+    read, offset = spool.read(0, 10)
+    size = os.path.getsize(spool.path)
+    reopened = HistorySpool(spool.path)
+    last_id = reopened.last_id()
+    reopened.clear()
+
+    # Assert
+    assert read == rows
+    assert offset == size - 11
+    assert os.path.getsize(spool.path) == 0
+    assert last_id == 3 and not reopened.pending
+
+def test_history_spool_truncates_torn_tail_on_reopen(tmp_path):
+    # Arrange
+    spool = HistorySpool(str(tmp_path / "history.spool"))
+    rows = [(i + 1, *row) for i, row in enumerate(_series(5))]
+    spool.append(rows[:2])
+    with open(spool.path, "ab") as torn:
+        torn.write(encode_row(rows[2])[:20])
+
+    # Act
+    reopened = HistorySpool(spool.path)
+    reopened.append(rows[3:])
+    read, _ = reopened.read(0, 10)
+
+    # Assert
+    assert read == rows[:2] + rows[3:]
+    assert reopened.size == os.path.getsize(spool.path)
+
+def test_history_writer_spools_until_store_recovers(tmp_path):
+    # Arrange
+    store = SqliteStore(str(tmp_path / "history.db"))
+    spool = HistorySpool(str(tmp_path / "history.spool"))
+    rows = _series(30)
+
+    # Act
+    async def scenario():
+        writer = HistoryWriter(None, max_rows=100, flush_interval=60, spool=spool)
+        await writer.start()
+        for row in rows[:10]:
+            writer.put_row(row)
+        offline = await writer.flush()
+        await store.open()
+        await writer.attach(store)
+        original_write = store.write
+        store.write = AsyncMock(side_effect=OSError("disk full"))
+        for row in rows[10:20]:
+            writer.put_row(row)
+        failed = await writer.flush()
+        store.write = original_write
+        # one block written before a crash, so replay must skip it
+        await store.write([(i + 1, *row) for i, row in enumerate(rows[:5])])
+        writer._retry_at = 0
+        for row in rows[20:]:
+            writer.put_row(row)
+        replayed = await writer.flush()
+        restarted = HistoryWriter(store, spool=spool)
+        await restarted.start()
+        ids = [record['id'] for record in await store.fetch_raw(0, 10 ** 9, ["id"], [])]
+        await writer.close()
+        await store.close()
+        return offline, failed, replayed, restarted._next_id, ids
+    offline, failed, replayed, next_id, ids = asyncio.run(scenario())
+
+    # Assert
+    assert offline == failed == 0
+    assert replayed == 25
+    assert ids == list(range(1, 31))
+    assert next_id == 31 and not spool.pending
+
+def test_history_writer_renumbers_spool_colliding_with_store(tmp_path):
+    # Arrange
+    store = SqliteStore(str(tmp_path / "history.db"))
+    spool = HistorySpool(str(tmp_path / "history.spool"))
+    recent = RecentHistory(capacity=100)
+    rows = _series(20)
+
+    # Act
+    async def scenario():
+        await store.open()
+        await store.write([(i + 1, *row) for i, row in enumerate(rows[:5])])
+        # no <spool>.last_id sidecar, as on the first run after an upgrade
+        writer = HistoryWriter(None, max_rows=100, flush_interval=60, recent=recent, spool=spool)
+        await writer.start()
+        for row in rows[5:12]:
+            writer.put_row(row)
+        await writer.flush()
+        for row in rows[12:15]:
+            writer.put_row(row)
+        await writer.attach(store)
+        for row in rows[15:]:
+            writer.put_row(row)
+        written = await writer.flush()
+        stored = await store.fetch_raw(0, 10 ** 9, ["id", "timestamp_ms"], [])
+        remembered = await recent.fetch_raw(0, 10 ** 9, ["id", "timestamp_ms"], [])
+        await writer.close()
+        await store.close()
+        return written, stored, remembered
+    written, stored, remembered = asyncio.run(scenario())
+
+    # Assert
+    assert written == 15
+    assert [(row['id'], row['timestamp_ms']) for row in stored] == [(i + 1, row[0]) for i, row in enumerate(rows)]
+    assert [row['id'] for row in remembered] == list(range(6, 21))
+    assert spool.last_id() == 20 and not spool.pending